@@ -0,0 +1,483 @@
+"""
+    Бенчмарки конвейера конвертации на синтетических данных.
+    Нейронная сеть заменяется [StubDmWrapper], поэтому файлы моделей не требуются.
+
+    Запуск из корня проекта:
+    python -m benchmarks.run --resolutions 640x480 1920x1080 --frames 30 --output bench_results.json
+
+    Результаты сравниваются с базовыми результатами этой же машины (benchmarks/baselines/<машина>.json,
+    в репозиторий не добавляются): замедление больше допустимого (GROUP_TOLERANCE) или рост ошибки
+    больше ERROR_TOLERANCE считается регрессией, и запуск завершается с кодом 1.
+    Базовые результаты машины создаются через --save-baseline
+"""
+import hashlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from dataclasses import dataclass, asdict, field
+from functools import cached_property, partial
+from typing import Callable, Iterator, Optional
+
+import cv2
+import numba
+import numpy as np
+
+from benchmarks.stub_wrapper import StubDmWrapper, STUB_MODEL, generate_frames
+from dmconvert.converter import DmMediaConverter, DmMediaParams
+from dmconvert.keyframes import load_keyframe_index
+from dmconvert.pipeline import DmPipelinedMediaConverter
+from dmconvert.postprocessors import create_anaglyph_processor, create_dm_correcter, create_ring_dm_correcter, \
+    create_depth_range_smoother
+from dmconvert.readers import DmVideoReader, DmImagesReader, DmPrefetchReader, DmFfmpegReader
+from dmconvert.writers import DmImageWriter, DmVideoWriter, DmAsyncWriter, DmCallbackWriter, DmFfmpegWriter
+from depthmap_wrappers.normalization import normalize_prediction
+from depthmap_wrappers.upsampling import DmGuidedUpsampleWrapper
+
+
+@dataclass
+class BenchmarkResult:
+    group: str
+    name: str
+    resolution: str
+    frames: int
+    seconds: float
+    # Дополнительные показатели бенчмарка (например, ошибка относительно эталона)
+    metrics: dict = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        result = asdict(self)
+        result["ms_per_frame"] = self.seconds / self.frames * 1000 if self.frames else None
+        result["fps"] = self.frames / self.seconds if self.seconds else None
+        return result
+
+
+class BenchmarkContext:
+    """
+    Входные данные одного разрешения: кадры, карты глубины и (при необходимости) их файлы
+    """
+
+    def __init__(self, width: int, height: int, frame_count: int, workdir: str):
+        self.width = width
+        self.height = height
+        self.resolution = f"{width}x{height}"
+        self.workdir = os.path.join(workdir, self.resolution)
+        os.makedirs(self.workdir, exist_ok=True)
+        self.frames = generate_frames(width, height, frame_count)
+        wrapper = StubDmWrapper()
+        self.dms = [wrapper.process(frame) for frame in self.frames]
+
+    @property
+    def media_params(self) -> DmMediaParams:
+        return DmMediaParams(fps=25, width=self.width, height=self.height, frame_count=len(self.frames))
+
+    @cached_property
+    def video_path(self) -> str:
+        path = os.path.join(self.workdir, "input.avi")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 25, (self.width, self.height))
+        for frame in self.frames:
+            writer.write(frame)
+        writer.release()
+        return path
+
+    @cached_property
+    def gop_video_path(self) -> str:
+        """
+        Видео с межкадровым сжатием (опорный кадр - каждые 12 кадров) для бенчмарков перехода к кадру
+        """
+        path = os.path.join(self.workdir, "input_gop.mp4")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 25, (self.width, self.height))
+        for frame in self.frames:
+            writer.write(frame)
+        writer.release()
+        return path
+
+    @cached_property
+    def images_dir(self) -> str:
+        directory = os.path.join(self.workdir, "input_images")
+        os.makedirs(directory, exist_ok=True)
+        for i, frame in enumerate(self.frames):
+            cv2.imwrite(os.path.join(directory, f"{i:06}.png"), frame)
+        return directory
+
+    def output_dir(self, name: str) -> str:
+        directory = os.path.join(self.workdir, "output", name)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        return directory
+
+
+# Бенчмарк получает контекст и возвращает пары (название, время на все кадры в секундах),
+# при необходимости - с третьим элементом: словарем дополнительных показателей
+Benchmark = Callable[[BenchmarkContext], Iterator[tuple]]
+BENCHMARKS: dict[str, Benchmark] = {}
+
+
+# Директория базовых результатов: у каждой машины свой файл, время на разных машинах не сравнивается
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# Допустимое замедление относительно базовых результатов (доля времени на кадр);
+# для групп с заметным разбросом (запись на диск, декодирование) - больше
+DEFAULT_TOLERANCE = 0.25
+GROUP_TOLERANCE = {"writers": 0.5, "readers": 0.4, "seek": 0.5}
+
+# Допустимый рост показателя error (уровней глубины из 255)
+ERROR_TOLERANCE = 0.5
+
+
+def benchmark(group: str):
+    def register(func: Benchmark) -> Benchmark:
+        BENCHMARKS[group] = func
+        return func
+
+    return register
+
+
+def _measure(func: Callable[[], None]) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+@benchmark("postprocessors")
+def bench_postprocessors(ctx: BenchmarkContext) -> Iterator[tuple[str, float]]:
+    cases = {
+        "anaglyph_offset_10": lambda: create_anaglyph_processor(10),
+        "anaglyph_offset_30": lambda: create_anaglyph_processor(30),
+        "dm_correcter_window_10": lambda: create_dm_correcter(10, 500),
+        "ring_dm_correcter_window_10": lambda: create_ring_dm_correcter(10, 500),
+        "ring_dm_correcter_window_50": lambda: create_ring_dm_correcter(50, 500),
+    }
+    for name, factory in cases.items():
+        processor = factory()
+        # Первый вызов исключается из замера (JIT-компиляция, выделение буферов)
+        processor(ctx.frames[0], ctx.dms[0])
+
+        def run():
+            for img, dm in zip(ctx.frames, ctx.dms):
+                processor(img, dm)
+
+        yield name, _measure(run)
+
+
+def _reference_normalization(prediction: np.ndarray) -> np.ndarray:
+    """
+    Исходная реализация MidasDmWrapper._convert_to_uint8 (numpy, несколько проходов и временных массивов)
+    """
+    if not np.isfinite(prediction).all():
+        prediction = np.nan_to_num(prediction, nan=0.0, posinf=0.0, neginf=0.0)
+    depth_min = prediction.min()
+    depth_max = prediction.max()
+    if depth_max - depth_min > np.finfo("float").eps:
+        out = 255 * (prediction - depth_min) / (depth_max - depth_min)
+    else:
+        out = np.zeros(prediction.shape, dtype=prediction.dtype)
+    return out.astype("uint8")
+
+
+def _smoothed_normalization(ema: float) -> Callable[[np.ndarray], np.ndarray]:
+    """
+    Нормализация с последующим сглаживанием диапазона между кадрами (постпроцессор конвертера)
+    """
+    smoother = create_depth_range_smoother(ema)
+    return lambda prediction: smoother(None, normalize_prediction(prediction))[1]
+
+
+@benchmark("normalization")
+def bench_normalization(ctx: BenchmarkContext) -> Iterator[tuple[str, float]]:
+    # Предсказания сети - float32 размера кадра
+    predictions = [dm.astype(np.float32) * 12.5 + 100 for dm in ctx.dms]
+    cases = {
+        "numpy_reference": lambda: _reference_normalization,
+        "fused": lambda: normalize_prediction,
+        "fused_ema_0.9": lambda: _smoothed_normalization(0.9),
+    }
+    for name, factory in cases.items():
+        normalize = factory()
+        normalize(predictions[0])
+
+        def run():
+            for prediction in predictions:
+                normalize(prediction)
+
+        yield name, _measure(run)
+
+
+# Имитация времени работы сети, растущего с разрешением входа (мс на мегапиксель)
+_NETWORK_MS_PER_MEGAPIXEL = 40
+
+
+def _edge_band(depth: np.ndarray, distance: int = 4) -> np.ndarray:
+    """
+    Пиксели не дальше distance от границ (перепадов) карты глубины
+    """
+    edges = cv2.morphologyEx(depth, cv2.MORPH_GRADIENT, np.ones((3, 3), np.uint8)) > 8
+    return cv2.dilate(edges.astype(np.uint8), np.ones((2 * distance + 1,) * 2, np.uint8)) > 0
+
+
+@benchmark("upsampling")
+def bench_upsampling(ctx: BenchmarkContext) -> Iterator[tuple]:
+    """
+    Скорость и качество работы сети в уменьшенном разрешении или по частям кадра.
+    Эталон - сеть (заглушка), обрабатывающая кадр в исходном разрешении; время ее работы растет
+    с разрешением на _NETWORK_MS_PER_MEGAPIXEL;
+    error - средняя разница карты глубины с эталоном (уровней из 255).
+    Варианты edges_* используют карту глубины с резкими границами, совпадающими с границами фигур кадра
+    (как у объектов на реальном видео); edge_error - средняя разница у этих границ, по ней видно,
+    сохраняет ли увеличение карты границы объектов
+    """
+    def network(layers: bool = False):
+        return StubDmWrapper(net_size=None, ms_per_megapixel=_NETWORK_MS_PER_MEGAPIXEL, layers=layers)
+
+    def upsampled(layers: bool, **kwargs):
+        return DmGuidedUpsampleWrapper(network(layers), 512, **kwargs)
+
+    cases = {}
+    for prefix, layers in (("", False), ("edges_", True)):
+        cases[f"{prefix}full_resolution"] = partial(network, layers)
+        for method, guided in (("linear", False), ("guided", True)):
+            cases[f"{prefix}downscaled_512_{method}"] = partial(upsampled, layers, guided=guided)
+            cases[f"{prefix}tiled_2x2_512_{method}"] = partial(upsampled, layers, guided=guided, tiles=2)
+    references = {layers: [StubDmWrapper(net_size=None, layers=layers).process(frame) for frame in ctx.frames]
+                  for layers in (False, True)}
+    bands = [_edge_band(reference) for reference in references[True]]
+
+    for name, factory in cases.items():
+        layers = name.startswith("edges_")
+        wrapper = factory()
+        wrapper.process(ctx.frames[0])
+        dms = []
+
+        def run():
+            for frame in ctx.frames:
+                dms.append(wrapper.process(frame))
+
+        seconds = _measure(run)
+        errors = [np.abs(dm.astype(np.int16) - reference) for dm, reference in zip(dms, references[layers])]
+        metrics = {"error": round(float(np.mean([error.mean() for error in errors])), 3)}
+        if layers:
+            metrics["edge_error"] = round(float(np.mean([error[band].mean() for error, band in zip(errors, bands)])), 3)
+        yield name, seconds, metrics
+
+
+@benchmark("writers")
+def bench_writers(ctx: BenchmarkContext) -> Iterator[tuple[str, float]]:
+    cases = {
+        "images_dm": lambda directory: DmImageWriter(directory, write_dm=True),
+        "images_concat": lambda directory: DmImageWriter(directory, write_concat=True),
+        "images_concat_async_4": lambda directory: DmAsyncWriter(DmImageWriter(directory, write_concat=True),
+                                                                 workers=4),
+        "video_mp4v": lambda directory: DmVideoWriter(os.path.join(directory, "out.mp4")),
+    }
+    if shutil.which("ffmpeg") is not None:
+        cases["video_ffmpeg_x264"] = lambda directory: DmFfmpegWriter(os.path.join(directory, "out.mp4"),
+                                                                      preset="veryfast")
+    for name, factory in cases.items():
+        writer = factory(ctx.output_dir(name))
+
+        def run():
+            writer.prepare(ctx.media_params)
+            for img, dm in zip(ctx.frames, ctx.dms):
+                writer.write(img, dm)
+            writer.close()
+
+        yield name, _measure(run)
+
+
+@benchmark("readers")
+def bench_readers(ctx: BenchmarkContext) -> Iterator[tuple[str, float]]:
+    cases = {
+        "video": lambda: DmVideoReader(ctx.video_path),
+        # Время на кадр источника: прочитан каждый 4-й кадр
+        "video_stride4": lambda: DmVideoReader(ctx.video_path, stride=4),
+        "images": lambda: DmImagesReader(ctx.images_dir),
+        "images_prefetch": lambda: DmPrefetchReader(DmImagesReader(ctx.images_dir)),
+    }
+    if shutil.which("ffmpeg") is not None:
+        cases["video_ffmpeg"] = lambda: DmFfmpegReader(ctx.video_path)
+        cases["video_ffmpeg_half_size"] = lambda: DmFfmpegReader(ctx.video_path, width=ctx.width // 2)
+    for name, factory in cases.items():
+        reader = factory()
+
+        def run():
+            reader.prepare_and_get_params()
+            for _ in reader.data():
+                pass
+            reader.close()
+
+        yield name, _measure(run)
+
+
+@benchmark("seek")
+def bench_seek(ctx: BenchmarkContext) -> Iterator[tuple[str, float]]:
+    """
+    Переход к кадру и чтение кадра: произвольные кадры и кадры по возрастанию (перемотка вперед)
+    """
+    rng = np.random.default_rng(0)
+    random_frames = [int(frame) for frame in rng.integers(0, len(ctx.frames), len(ctx.frames))]
+    targets = {"random": random_frames, "forward": sorted(random_frames)}
+    # Индекс опорных кадров строится один раз до замеров
+    load_keyframe_index(ctx.gop_video_path)
+
+    for name, frames in targets.items():
+        cap = cv2.VideoCapture(ctx.gop_video_path)
+
+        def run_opencv():
+            for frame in frames:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+                cap.read()
+
+        yield f"opencv_{name}", _measure(run_opencv)
+        cap.release()
+
+        reader = DmVideoReader(ctx.gop_video_path)
+        reader.prepare_and_get_params()
+        reader.keyframe_index(wait=True)
+        reader_frames = reader.data()
+
+        def run_reader():
+            for frame in frames:
+                reader.seek_frame(frame)
+                next(reader_frames)
+
+        yield f"reader_{name}", _measure(run_reader)
+        reader.close()
+
+
+@benchmark("converter")
+def bench_converter(ctx: BenchmarkContext) -> Iterator[tuple[str, float]]:
+    cases = {
+        "serial": lambda reader: DmMediaConverter(STUB_MODEL, reader, StubDmWrapper()),
+        "pipelined": lambda reader: DmPipelinedMediaConverter(STUB_MODEL, reader, StubDmWrapper()),
+    }
+    for name, factory in cases.items():
+        converter = factory(DmVideoReader(ctx.video_path))
+        converter.preprocessors = []
+        converter.postprocessors = [create_anaglyph_processor(10)]
+        converter.writers = [DmCallbackWriter(lambda img, dm: None)]
+        yield f"video_anaglyph_{name}", _measure(converter.start)
+
+
+def find_regressions(results: list[dict], baseline: dict, tolerance: Optional[float] = None) -> list[str]:
+    """
+    Сравнивает результаты с базовыми (одинаковые группа, название и разрешение)
+    :param tolerance: допустимое замедление для всех групп (None - GROUP_TOLERANCE)
+    :return: описания регрессий
+    """
+    expected = {(r["group"], r["name"], r["resolution"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        base = expected.get((result["group"], result["name"], result["resolution"]))
+        if base is None:
+            continue
+        title = f"{result['resolution']} {result['group']}/{result['name']}"
+        allowed = tolerance if tolerance is not None else GROUP_TOLERANCE.get(result["group"], DEFAULT_TOLERANCE)
+        if base.get("ms_per_frame") and result["ms_per_frame"] > base["ms_per_frame"] * (1 + allowed):
+            regressions.append(f"{title}: {result['ms_per_frame']:.2f} ms/frame, baseline "
+                               f"{base['ms_per_frame']:.2f} (+{result['ms_per_frame'] / base['ms_per_frame'] - 1:.0%}, "
+                               f"allowed +{allowed:.0%})")
+        for metric, error in result["metrics"].items():
+            base_error = base.get("metrics", {}).get(metric)
+            if metric.endswith("error") and base_error is not None and error > base_error + ERROR_TOLERANCE:
+                regressions.append(f"{title}: {metric} {error}, baseline {base_error} (allowed +{ERROR_TOLERANCE})")
+    return regressions
+
+
+def machine_fingerprint() -> str:
+    """
+    Идентификатор машины для выбора базовых результатов: имя, система, процессор и количество ядер
+    """
+    description = "|".join(map(str, (platform.node(), platform.system(), platform.machine(),
+                                     platform.processor(), os.cpu_count())))
+    return f"{platform.node() or 'machine'}-{hashlib.sha1(description.encode()).hexdigest()[:12]}"
+
+
+def default_baseline_path() -> str:
+    return os.path.join(BASELINES_DIR, machine_fingerprint() + ".json")
+
+
+def _same_machine(environment: dict, baseline: dict) -> bool:
+    return baseline.get("environment", {}).get("machine") == environment.get("machine")
+
+
+def _parse_resolution(value: str) -> tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = ArgumentParser(prog='Depth map converter benchmarks')
+    parser.add_argument('-r', '--resolutions', nargs='+', default=['640x480', '1280x720', '1920x1080'],
+                        help='Frame sizes, WIDTHxHEIGHT')
+    parser.add_argument('-f', '--frames', type=int, default=30, help='Frames per benchmark')
+    parser.add_argument('-g', '--groups', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help='Benchmark groups to run')
+    parser.add_argument('-o', '--output', type=str, default='bench_results.json', help='JSON results file')
+    parser.add_argument('--baseline', type=str,
+                        help='Baseline results to compare with (default - benchmarks/baselines/<machine>.json)')
+    parser.add_argument('--tolerance', type=float,
+                        help='Allowed slowdown against the baseline for all groups, e.g. 0.2 (default - per group)')
+    parser.add_argument('--save-baseline', action='store_true', help='Save the results as the new baseline')
+    args = parser.parse_args()
+
+    results: list[BenchmarkResult] = []
+    workdir = tempfile.mkdtemp(prefix="dm_bench_")
+    try:
+        for width, height in map(_parse_resolution, args.resolutions):
+            ctx = BenchmarkContext(width, height, args.frames, workdir)
+            for group in args.groups:
+                for name, seconds, *metrics in BENCHMARKS[group](ctx):
+                    result = BenchmarkResult(group, name, ctx.resolution, args.frames, seconds, *metrics)
+                    results.append(result)
+                    extra = "".join(f"  {key}: {value}" for key, value in result.metrics.items())
+                    print(f"{ctx.resolution:>10} {group:<15} {name:<30} "
+                          f"{result.to_dict()['ms_per_frame']:>9.2f} ms/frame{extra}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "machine": machine_fingerprint(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "numba": numba.__version__,
+        },
+        "results": [result.to_dict() for result in results],
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results saved to {args.output}")
+
+    args.baseline = args.baseline or default_baseline_path()
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"No baseline for this machine at {args.baseline}, create it with --save-baseline")
+        return
+
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline = json.load(file)
+    if not _same_machine(report["environment"], baseline):
+        print("Warning: the baseline was recorded on a different machine, timings may not be comparable")
+    regressions = find_regressions(report["results"], baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import time
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from depthmap_wrappers.base import BaseDmWrapper
+from depthmap_wrappers.models import Model
+
+
+class StubDmWrapper(BaseDmWrapper):
+    """
+    Заменитель нейронной сети для бенчмарков: "карта глубины" - размытая яркость кадра,
+    рассчитанная на уменьшенной копии (как у сети с фиксированным размером входа).
+    Не требует файлов моделей
+    """
+
+    def __init__(self, net_size: Optional[int] = 256, delay: float = 0.0, ms_per_megapixel: float = 0.0,
+                 layers: bool = False):
+        """
+        :param net_size: размер стороны уменьшенной копии кадра (None - кадр обрабатывается в исходном размере,
+        и время обработки растет с разрешением)
+        :param delay: дополнительная задержка на кадр (сек) для имитации более тяжелой модели
+        :param ms_per_megapixel: дополнительная задержка (мс) на мегапиксель обрабатываемого изображения
+        для имитации сети, время работы которой растет с разрешением входа
+        :param layers: карта глубины - слои [layered_depth] с границами, совпадающими с границами фигур кадра
+        """
+        self._net_size = net_size
+        self._delay = delay
+        self._ms_per_megapixel = ms_per_megapixel
+        self._layers = layers
+
+    def prepare_model(self, model: Model, *args): ...
+
+    def process(self, image, *args):
+        small = image
+        if self._net_size is not None:
+            small = cv2.resize(image, (self._net_size, self._net_size), interpolation=cv2.INTER_AREA)
+        grey = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        depth = layered_depth(small) if self._layers else cv2.GaussianBlur(grey, (0, 0), 5)
+        delay = self._delay + self._ms_per_megapixel * grey.size / 1e9
+        if delay:
+            time.sleep(delay)
+        if depth.shape == image.shape[:2]:
+            return depth
+        return cv2.resize(depth, image.shape[1::-1], interpolation=cv2.INTER_CUBIC)
+
+
+STUB_MODEL = Model("stub", "")
+
+
+# Цвета фигур generate_frames (BGR) и их глубина в layered_depth
+_SHAPE_COLORS = ((40, 200, 90), (200, 60, 30))
+_SHAPE_DEPTHS = (230, 170)
+
+
+def layered_depth(frame: np.ndarray) -> np.ndarray:
+    """
+    Карта глубины кадра generate_frames с резкими границами, совпадающими с границами фигур в кадре:
+    фон - глубина, растущая слева направо, фигуры - постоянная глубина (определяются по цвету с учетом шума)
+    """
+    height, width = frame.shape[:2]
+    depth = np.broadcast_to(np.linspace(40, 120, width, dtype=np.float32), (height, width)).astype(np.uint8)
+    pixels = frame.astype(np.float32)
+    for color, value in zip(_SHAPE_COLORS, _SHAPE_DEPTHS):
+        depth[np.linalg.norm(pixels - np.array(color, np.float32), axis=2) < 60] = value
+    return depth
+
+
+def generate_frames(width: int, height: int, count: int, seed: int = 0) -> list[np.ndarray]:
+    """
+    Синтетическое видео: шум и движущиеся фигуры на градиентном фоне
+    """
+    rng = np.random.default_rng(seed)
+    background = np.linspace(0, 255, width, dtype=np.float32)[None, :, None].repeat(height, 0).repeat(3, 2)
+    frames = []
+    for i in range(count):
+        frame = (background + rng.normal(0, 8, background.shape)).clip(0, 255).astype(np.uint8)
+        shift = (i * 7) % width
+        cv2.circle(frame, (shift, height // 2), height // 6, _SHAPE_COLORS[0], -1)
+        cv2.rectangle(frame, (width - shift - width // 8, height // 8), (width - shift, height // 3), _SHAPE_COLORS[1],
+                      -1)
+        frames.append(frame)
+    return frames
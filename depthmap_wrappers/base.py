@@ -4,8 +4,38 @@ from depthmap_wrappers.models import Model
 
 
 class BaseDmWrapper(ABC):
+    @property
+    def variant(self) -> str:
+        """
+        Вариант загрузчика: загрузчики с одинаковым вариантом дают одинаковые карты глубины
+        """
+        return type(self).__name__
+
     @abstractmethod
     def prepare_model(self, model: Model, *args): ...
 
     @abstractmethod
     def process(self, image, *args): ...
+
+    def warm_up(self, model: Model):
+        """
+        Начинает загрузку модели в фоне, чтобы последующий prepare_model не ожидал ее
+        """
+
+    def release_model(self):
+        """
+        Отпускает модель после обработки (вызывается по завершении конвертации): модель остается в пуле
+        моделей, но может быть выгружена при нехватке памяти. Следующий prepare_model получает ее заново
+        """
+
+    def reset_state(self):
+        """
+        Сбрасывает состояние, накопленное между кадрами (вызывается перед обработкой новой последовательности)
+        """
+
+    def process_batch(self, images: list, *args) -> list:
+        """
+        Создает карты глубины для группы изображений, порядок результатов совпадает с порядком изображений.
+        Реализация по умолчанию обрабатывает изображения по одному
+        """
+        return [self.process(image, *args) for image in images]
@@ -0,0 +1,189 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+import numpy.typing as npt
+
+from depthmap_wrappers.base import BaseDmWrapper
+from depthmap_wrappers.models import Model
+
+
+class DmCache:
+    """
+    Хранилище карт глубины на диске (по файлу .npy на кадр) с ограничением размера.
+    При превышении размера удаляются карты, которые дольше всего не использовались.
+    Размер учитывается по картам, известным экземпляру (найденным при открытии и записанным им),
+    поэтому загрузчики одного процесса используют общий экземпляр для директории ([open_cache]).
+    Процессы (DmShardedMediaConverter) учитывают размер независимо: пока они работают, директория
+    может превысить ограничение не более чем в количество процессов раз; при следующем открытии кэша
+    учитываются все файлы, и лишние карты удаляются при следующей записи
+    """
+
+    def __init__(self, directory: str, max_size_mb: int):
+        self._directory = directory
+        self._max_size = max_size_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._size = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def get(self, key: str) -> Optional[npt.NDArray]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+
+        path = self._path(key)
+        try:
+            dm = np.load(path)
+            # Время изменения файла хранит порядок использования между запусками
+            os.utime(path)
+            return dm
+        except (OSError, ValueError):
+            self._forget(key)
+            return None
+
+    def put(self, key: str, dm: npt.NDArray):
+        path = self._path(key)
+        # Кэш может использоваться несколькими процессами: имя временного файла уникально для потока процесса
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as file:
+                np.save(file, dm)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        size = os.path.getsize(path)
+
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._size += size
+            evicted = []
+            while self._size > self._max_size and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._size -= old_size
+                evicted.append(old_key)
+
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def _forget(self, key: str):
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+
+    def _load_index(self):
+        files = []
+        for entry in os.scandir(self._directory):
+            if entry.is_file() and entry.name.endswith(".npy"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._size += size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, f"{key}.npy")
+
+
+# Открытые кэши процесса (по директории и ограничению размера)
+_caches: dict[tuple[str, int], DmCache] = {}
+_caches_lock = threading.Lock()
+
+
+def open_cache(directory: str, max_size_mb: int) -> DmCache:
+    """
+    Возвращает общий для процесса кэш директории: ограничение размера соблюдается для всех загрузчиков
+    """
+    key = (os.path.abspath(directory), max_size_mb)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = DmCache(directory, max_size_mb)
+        return cache
+
+
+class CachedDmWrapper(BaseDmWrapper):
+    """
+    Обертка над загрузчиком модели, сохраняющая карты глубины в [DmCache].
+    Ключ - хеш содержимого кадра после препроцессоров, типа и файла модели. Модель загружается
+    только при первом отсутствующем в кэше кадре, поэтому повторная обработка того же источника
+    с другими постпроцессорами не требует работы нейронной сети
+    """
+
+    def __init__(self, wrapper: BaseDmWrapper, directory: str, max_size_mb: int = 2048):
+        self._wrapper = wrapper
+        self._directory = directory
+        self._max_size_mb = max_size_mb
+        self._cache: Optional[DmCache] = None
+        self._model: Optional[Model] = None
+        self._model_prepared = False
+        self._salt = b""
+
+    def __getstate__(self):
+        # Для передачи в другие процессы: кэш открывается заново в prepare_model
+        state = self.__dict__.copy()
+        state["_cache"] = None
+        state["_model_prepared"] = False
+        return state
+
+    def prepare_model(self, model: Model, *args):
+        if self._cache is None:
+            self._cache = open_cache(self._directory, self._max_size_mb)
+        if model != self._model:
+            self._model_prepared = False
+        self._model = model
+        model_mtime = os.path.getmtime(model.path) if os.path.exists(model.path) else 0
+        self._salt = f"{self._wrapper.variant}:{model.type}:{os.path.abspath(model.path)}:{model_mtime}" \
+            .encode()
+
+    def warm_up(self, model: Model):
+        self._wrapper.warm_up(model)
+
+    def release_model(self):
+        self._wrapper.release_model()
+        self._model_prepared = False
+
+    def reset_state(self):
+        self._wrapper.reset_state()
+
+    def process(self, image, *args):
+        key = self._key(image)
+        dm = self._cache.get(key)
+        if dm is None:
+            self._prepare_wrapper()
+            dm = self._wrapper.process(image, *args)
+            self._cache.put(key, dm)
+        return dm
+
+    def process_batch(self, images: list, *args) -> list:
+        keys = [self._key(image) for image in images]
+        dms = [self._cache.get(key) for key in keys]
+        missing = [i for i, dm in enumerate(dms) if dm is None]
+        if missing:
+            self._prepare_wrapper()
+            new_dms = self._wrapper.process_batch([images[i] for i in missing], *args)
+            for i, dm in zip(missing, new_dms):
+                self._cache.put(keys[i], dm)
+                dms[i] = dm
+        return dms
+
+    def _prepare_wrapper(self):
+        if not self._model_prepared:
+            self._wrapper.prepare_model(self._model)
+            self._model_prepared = True
+
+    def _key(self, image: npt.NDArray) -> str:
+        digest = hashlib.blake2b(self._salt, digest_size=16)
+        digest.update(f"{image.shape}:{image.dtype}".encode())
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.hexdigest()
@@ -0,0 +1,119 @@
+import math
+import time
+from typing import Optional
+
+import cv2
+import numpy as np
+import numpy.typing as npt
+
+from depthmap_wrappers.base import BaseDmWrapper
+from depthmap_wrappers.models import Model
+
+# Вес нового замера при усреднении времени работы нейронной сети
+_TIMING_WEIGHT = 0.2
+
+
+class DmFrameSkipWrapper(BaseDmWrapper):
+    """
+    Обертка над загрузчиком для режима реального времени: нейронная сеть обрабатывает не каждый кадр.
+    Карта глубины промежуточного кадра получается из карты последнего обработанного (опорного) кадра
+    сдвигом по оптическому потоку (DIS на уменьшенных кадрах) или повторяется без изменений.
+    Поток считается от текущего кадра к опорному, поэтому ошибки сдвига не накапливаются между кадрами
+    """
+
+    def __init__(self, wrapper: BaseDmWrapper, infer_every: int = 1, target_fps: Optional[float] = None,
+                 warp: bool = True, flow_width: int = 160):
+        """
+        :param wrapper: загрузчик, выполняющий нейронную сеть
+        :param infer_every: нейронная сеть обрабатывает каждый infer_every кадр
+        :param target_fps: целевая частота кадров; если задана, интервал между обрабатываемыми кадрами
+        подбирается по времени работы нейронной сети (infer_every - минимальный интервал)
+        :param warp: сдвигать карту глубины по оптическому потоку (иначе - повторять карту опорного кадра)
+        :param flow_width: ширина кадров для расчета оптического потока
+        """
+        self._wrapper = wrapper
+        self._infer_every = max(1, infer_every)
+        self._target_fps = target_fps
+        self._warp = warp
+        self._flow_width = flow_width
+        self._flow: Optional[cv2.DISOpticalFlow] = None
+        self._grid: Optional[tuple[npt.NDArray, npt.NDArray]] = None
+        self._infer_time = 0.0
+        self.interpolated_frames = 0
+        self.reset_state()
+
+    @property
+    def variant(self) -> str:
+        # Промежуточные карты отличаются от карт загрузчика
+        return f"{self._wrapper.variant}-interpolated"
+
+    @property
+    def interval(self) -> int:
+        """
+        Текущий интервал между кадрами, обрабатываемыми нейронной сетью
+        """
+        if self._target_fps:
+            return max(self._infer_every, math.ceil(self._infer_time * self._target_fps))
+        return self._infer_every
+
+    def prepare_model(self, model: Model, *args):
+        self._wrapper.prepare_model(model, *args)
+
+    def warm_up(self, model: Model):
+        self._wrapper.warm_up(model)
+
+    def release_model(self):
+        self._wrapper.release_model()
+
+    def reset_state(self):
+        self._key_dm: Optional[npt.NDArray] = None
+        self._key_grey: Optional[npt.NDArray] = None
+        self._since_key = 0
+        self._wrapper.reset_state()
+
+    def process(self, image, *args):
+        if self._key_dm is not None and self._key_dm.shape == image.shape[:2] and \
+                self._since_key + 1 < self.interval:
+            self._since_key += 1
+            self.interpolated_frames += 1
+            return self._propagate(image)
+
+        start = time.perf_counter()
+        dm = self._wrapper.process(image, *args)
+        elapsed = time.perf_counter() - start
+        self._infer_time = elapsed if not self._infer_time else \
+            (1 - _TIMING_WEIGHT) * self._infer_time + _TIMING_WEIGHT * elapsed
+
+        self._key_dm = dm.copy()
+        self._key_grey = self._small_grey(image) if self._warp else None
+        self._since_key = 0
+        return dm
+
+    def _propagate(self, image: npt.NDArray) -> npt.NDArray:
+        if not self._warp:
+            return self._key_dm.copy()
+
+        grey = self._small_grey(image)
+        if self._flow is None:
+            self._flow = cv2.DISOpticalFlow_create(cv2.DISOPTICAL_FLOW_PRESET_ULTRAFAST)
+        flow = self._flow.calc(grey, self._key_grey, None)
+
+        height, width = self._key_dm.shape
+        flow = cv2.resize(flow, (width, height), interpolation=cv2.INTER_LINEAR)
+        grid_x, grid_y = self._get_grid(height, width)
+        # Для каждого пикселя текущего кадра - координаты соответствующего пикселя опорного кадра
+        map_x = cv2.scaleAdd(flow[..., 0], width / grey.shape[1], grid_x)
+        map_y = cv2.scaleAdd(flow[..., 1], height / grey.shape[0], grid_y)
+        return cv2.remap(self._key_dm, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+    def _small_grey(self, image: npt.NDArray) -> npt.NDArray:
+        height, width = image.shape[:2]
+        size = (min(width, self._flow_width), max(1, round(height * min(width, self._flow_width) / width)))
+        small = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+    def _get_grid(self, height: int, width: int) -> tuple[npt.NDArray, npt.NDArray]:
+        if self._grid is None or self._grid[0].shape != (height, width):
+            grid_x, grid_y = np.meshgrid(np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32))
+            self._grid = (grid_x, grid_y)
+        return self._grid
@@ -1,4 +1,4 @@
-from typing import Any
+from typing import Any, Optional
 
 import numpy as np
 import torch
@@ -6,6 +6,8 @@ from depthmap.MiDaS.midas.model_loader import load_model
 from depthmap.MiDaS.run import process as midas_process
 from depthmap_wrappers.base import BaseDmWrapper
 from depthmap_wrappers.models import Model
+from depthmap_wrappers.normalization import normalize_prediction
+from depthmap_wrappers.pool import MODEL_POOL
 
 
 class MidasDmWrapper(BaseDmWrapper):
@@ -14,12 +16,44 @@ class MidasDmWrapper(BaseDmWrapper):
     _net_size: Any
     _device: Any
     _model_type: Any
+    _loaded_model: Optional[Model] = None
 
     def prepare_model(self, model: Model, *args):
+        # Загруженные модели хранятся в общем пуле, поэтому повторная подготовка не перезагружает их
+        if self._loaded_model == model:
+            return
+        self.release_model()
         self._model_type = model.type
-        self._device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self._model, self._transform, *self._net_size \
-            = load_model(self._device, model.path, model.type, False, None, False)
+        self._device = self._get_device()
+        self._model, self._transform, *self._net_size = MODEL_POOL.get(model.type, lambda: self._load(model),
+                                                                       self._model_size)
+        self._loaded_model = model
+
+    def warm_up(self, model: Model):
+        MODEL_POOL.warm_up(model.type, lambda: self._load(model), self._model_size)
+
+    def release_model(self):
+        if self._loaded_model is None:
+            return
+        self._model = self._transform = None
+        MODEL_POOL.release(self._loaded_model.type)
+        self._loaded_model = None
+
+    @staticmethod
+    def _get_device():
+        return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    @classmethod
+    def _load(cls, model: Model):
+        return load_model(cls._get_device(), model.path, model.type, False, None, False)
+
+    @staticmethod
+    def _model_size(loaded) -> int:
+        net = loaded[0]
+        if not isinstance(net, torch.nn.Module):
+            return 0
+        tensors = list(net.parameters()) + list(net.buffers())
+        return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
 
     def process(self, image, *args):
         transformed_image = self._transform({"image": image})["image"]
@@ -28,19 +62,23 @@ class MidasDmWrapper(BaseDmWrapper):
                                        image.shape[1::-1], False, False)
         return self._convert_to_uint8(prediction)
 
-    @staticmethod
-    def _convert_to_uint8(prediction):
-        if not np.isfinite(prediction).all():
-            prediction = np.nan_to_num(prediction, nan=0.0, posinf=0.0, neginf=0.0)
-
-        depth_min = prediction.min()
-        depth_max = prediction.max()
-
-        max_val = (2 ** 8) - 1
+    def process_batch(self, images: list, *args) -> list:
+        # Объединить в один тензор можно только кадры одного размера
+        if len(images) < 2 or "openvino" in self._model_type or len({image.shape for image in images}) != 1:
+            return super().process_batch(images, *args)
 
-        if depth_max - depth_min > np.finfo("float").eps:
-            out = max_val * (prediction - depth_min) / (depth_max - depth_min)
-        else:
-            out = np.zeros(prediction.shape, dtype=prediction.dtype)
+        samples = np.stack([self._transform({"image": image})["image"] for image in images])
+        with torch.no_grad():
+            sample = torch.from_numpy(samples).to(self._device)
+            prediction = self._model.forward(sample)
+            prediction = torch.nn.functional.interpolate(
+                prediction.unsqueeze(1),
+                size=images[0].shape[:2],
+                mode="bicubic",
+                align_corners=False,
+            ).squeeze(1).cpu().numpy()
+        return [self._convert_to_uint8(dm) for dm in prediction]
 
-        return out.astype("uint8")
+    @staticmethod
+    def _convert_to_uint8(prediction):
+        return normalize_prediction(prediction)
@@ -0,0 +1,105 @@
+import os
+import threading
+from pathlib import Path
+from typing import Any
+
+import torch
+from depthmap_wrappers.midas import MidasDmWrapper
+from depthmap_wrappers.models import Model
+
+
+class _ExportedModel:
+    """
+    Заменяет модель MiDaS: при первом входе нового размера модель экспортируется в TorchScript
+    (или загружается ранее экспортированный файл), далее используется экспортированная модель.
+    Трассировка фиксирует размер входа, поэтому для каждого размера кадра (H×W) создается свой файл.
+    Модели MiDaS при трассировке фиксируют и размер пакета, поэтому модель экспортируется для пакета
+    из одного кадра, а кадры пакета обрабатываются по одному
+    """
+
+    def __init__(self, eager: torch.nn.Module, model_path: str, device, quantize: bool, max_error: float):
+        self._eager = eager
+        self._model_path = model_path
+        self._device = device
+        self._quantize = quantize
+        self._max_error = max_error
+        self._exported: dict[tuple, Any] = {}
+        # Модель используется несколькими потоками (конвейер, задания пакета): экспорт для одного
+        # размера должен выполняться один раз
+        self._lock = threading.Lock()
+
+    def forward(self, sample: torch.Tensor) -> torch.Tensor:
+        module = self._module(sample[:1])
+        if len(sample) == 1:
+            return module(sample)
+        return torch.cat([module(sample[i:i + 1]) for i in range(len(sample))])
+
+    __call__ = forward
+
+    def _module(self, sample: torch.Tensor):
+        size = tuple(sample.shape[-2:])
+        with self._lock:
+            module = self._exported.get(size)
+            if module is None:
+                module = self._exported[size] = self._load_or_export(sample)
+        return module
+
+    def _artifact_path(self, size: tuple) -> str:
+        path = Path(self._model_path)
+        suffix = ".int8" if self._quantize else ""
+        return str(path.with_name(f"{path.stem}.{'x'.join(map(str, size))}{suffix}.torchscript"))
+
+    def _load_or_export(self, sample: torch.Tensor):
+        path = self._artifact_path(tuple(sample.shape[-2:]))
+        if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(self._model_path):
+            return torch.jit.load(path, map_location=self._device)
+
+        net = self._eager
+        if self._quantize:
+            net = torch.ao.quantization.quantize_dynamic(net, {torch.nn.Linear}, dtype=torch.qint8)
+
+        with torch.no_grad():
+            exported = torch.jit.freeze(torch.jit.trace(net.eval(), sample, check_trace=False))
+            error = depth_error(self._eager.forward(sample), exported(sample))
+        if error > self._max_error:
+            raise RuntimeError(f"Экспортированная модель отличается от исходной: средняя ошибка {error:.2f} "
+                               f"(допустимо {self._max_error:.2f} уровней глубины из 255)")
+
+        exported.save(path)
+        return exported
+
+
+def depth_error(expected: torch.Tensor, actual: torch.Tensor) -> float:
+    """
+    Средняя абсолютная разница карт глубины в уровнях итоговой 8-битной карты (0..255)
+    """
+    depth_range = float(expected.max() - expected.min()) or 1.0
+    return float((expected - actual).abs().mean()) / depth_range * 255
+
+
+class MidasTorchScriptDmWrapper(MidasDmWrapper):
+    """
+    Загрузчик MiDaS, выполняющий модель, экспортированную в TorchScript, с опциональным динамическим
+    квантованием линейных слоев в int8. Экспортированные модели сохраняются рядом с файлом .pt и
+    при экспорте сравниваются с исходной моделью
+    """
+
+    def __init__(self, quantize: bool = False, max_error: float = 3.0):
+        """
+        :param quantize: квантовать линейные слои в int8 (меньше памяти и быстрее на CPU, ниже точность)
+        :param max_error: допустимая средняя ошибка экспортированной модели (уровней глубины из 255)
+        """
+        self._quantize = quantize
+        self._max_error = max_error
+
+    @property
+    def variant(self) -> str:
+        return f"{super().variant}{'-int8' if self._quantize else ''}"
+
+    def prepare_model(self, model: Model, *args):
+        if self._loaded_model == model:
+            return
+        super().prepare_model(model, *args)
+        # Модели OpenVINO не являются модулями PyTorch и выполняются как есть
+        if isinstance(self._model, torch.nn.Module):
+            self._model = _ExportedModel(self._model, model.path, self._device, self._quantize, self._max_error)
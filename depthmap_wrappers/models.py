@@ -5,7 +5,6 @@ from typing import Optional
 
 from aenum import extend_enum, Enum
 from pathlib import Path
-from settings import MODELS_DIR
 
 
 @dataclass
@@ -17,6 +16,9 @@ class Model:
 class Models(Enum):
     @classmethod
     def autodetect(cls):
+        # settings импортирует загрузчик по умолчанию, который импортирует этот модуль, поэтому
+        # settings читается при вызове (импорт на уровне модуля образует цикл)
+        from settings import MODELS_DIR
         files = glob.glob(os.path.join(MODELS_DIR, "*.pt"))
         models = map(lambda file: Model(Path(file).stem, file), files)
         for model in models:
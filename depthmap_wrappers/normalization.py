@@ -0,0 +1,96 @@
+from typing import Optional
+
+import numpy as np
+import numpy.typing as npt
+from numba import njit, prange, types, void, float32, float64, uint8
+
+# Ядра компилируются при импорте для карт float32 и float64 (C-непрерывных и произвольных)
+# и сохраняются в кэш numba на диске
+_FLOAT_TYPES = (float32, float64)
+_RANGE_KERNEL_SIGNATURES = [types.UniTuple(t, 2)(t[:, :]) for t in _FLOAT_TYPES]
+_SCALE_KERNEL_SIGNATURES = [void(t[:, ::1], t, t, uint8[:, ::1]) for t in _FLOAT_TYPES] + \
+                           [void(t[:, :], t, t, uint8[:, :]) for t in _FLOAT_TYPES]
+
+
+@njit(_RANGE_KERNEL_SIGNATURES, parallel=True, cache=True)
+def _depth_range_kernel(prediction: npt.NDArray) -> tuple[float, float]:
+    """
+    Минимум и максимум карты за один проход; нечисловые значения (nan, inf) считаются нулем
+    """
+    height, width = prediction.shape
+    lows = np.empty(height, prediction.dtype)
+    highs = np.empty(height, prediction.dtype)
+    for y in prange(height):
+        low = np.inf
+        high = -np.inf
+        for x in range(width):
+            value = prediction[y, x]
+            if not np.isfinite(value):
+                value = 0
+            low = min(low, value)
+            high = max(high, value)
+        lows[y] = low
+        highs[y] = high
+    return lows.min(), highs.max()
+
+
+@njit(_SCALE_KERNEL_SIGNATURES, parallel=True, cache=True)
+def _scale_kernel(prediction: npt.NDArray, low: float, depth_range: float, out: npt.NDArray):
+    """
+    Переводит значения карты в диапазон 0..255 с отсечением значений вне [low, low + depth_range]
+    """
+    height, width = prediction.shape
+    # Вычисления в типе карты (без приведения к float64), как в векторной реализации numpy
+    zero = prediction.dtype.type(0)
+    max_val = prediction.dtype.type(255)
+    for y in prange(height):
+        for x in range(width):
+            value = prediction[y, x]
+            if not np.isfinite(value):
+                value = zero
+            scaled = max_val * (value - low) / depth_range
+            out[y, x] = uint8(min(max(scaled, zero), max_val))
+
+
+def normalize_depth(prediction: npt.NDArray, low: float, high: float,
+                    out: Optional[npt.NDArray] = None) -> npt.NDArray:
+    """
+    Переводит карту глубины в 8-битную по заданному диапазону без промежуточных массивов
+    :param out: массив uint8 размера prediction для результата
+    """
+    if prediction.dtype not in (np.float32, np.float64):
+        prediction = prediction.astype(np.float32)
+    if out is None:
+        out = np.empty(prediction.shape, np.uint8)
+
+    depth_range = high - low
+    # Порог - машинный эпсилон float64, как в исходной реализации, независимо от типа карты
+    if depth_range > np.finfo(np.float64).eps:
+        _scale_kernel(prediction, prediction.dtype.type(low), prediction.dtype.type(depth_range), out)
+    else:
+        out.fill(0)
+    return out
+
+
+def depth_range(prediction: npt.NDArray) -> tuple[float, float]:
+    """
+    Минимум и максимум карты глубины; нечисловые значения (nan, inf) считаются нулем
+    """
+    low, high = prediction.min(), prediction.max()
+    # nan и inf попадают в минимум или максимум, поэтому проверка всей карты нужна только в этом случае
+    if np.isfinite(low) and np.isfinite(high):
+        return low, high
+    if prediction.dtype not in (np.float32, np.float64):
+        prediction = prediction.astype(np.float32)
+    return _depth_range_kernel(prediction)
+
+
+def normalize_prediction(prediction: npt.NDArray, out: Optional[npt.NDArray] = None) -> npt.NDArray:
+    """
+    Переводит предсказание нейронной сети в 8-битную карту глубины, растягивая его на весь диапазон 0..255
+    по собственным минимуму и максимуму. Не хранит состояния между кадрами (сглаживание диапазона между
+    кадрами выполняет постпроцессор dmconvert.postprocessors.create_depth_range_smoother)
+    :param out: массив uint8 размера prediction для результата
+    """
+    low, high = depth_range(prediction)
+    return normalize_depth(prediction, low, high, out)
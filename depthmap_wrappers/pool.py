@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from settings import MODEL_POOL_MAX_MB
+
+
+class ModelPool:
+    """
+    Хранилище загруженных моделей, общее для всех загрузчиков процесса.
+    Модель загружается при первом обращении (или заранее в фоне через warm_up) и остается в памяти.
+    Загрузчик удерживает полученную модель (get) до вызова release. При превышении лимита памяти
+    выгружаются модели, которые не удерживает ни один загрузчик, начиная с тех, что дольше всего
+    не запрашивались. Модели, используемые одновременно, не выгружаются, поэтому лимит может быть
+    превышен, пока их суммарный объем больше лимита
+    """
+
+    def __init__(self, max_size_mb: Optional[int] = None):
+        """
+        :param max_size_mb: лимит памяти загруженных моделей (МБ), None - без ограничения
+        """
+        self._max_size = max_size_mb * 1024 * 1024 if max_size_mb else None
+        self._lock = threading.Lock()
+        # Модель, ее объем (байт) и количество удерживающих ее загрузчиков
+        self._entries: OrderedDict[str, list] = OrderedDict()
+        self._loading: dict[str, threading.Lock] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def get(self, key: str, loader: Callable[[], Any], size: Optional[Callable[[Any], int]] = None) -> Any:
+        """
+        Возвращает загруженную модель, при отсутствии - загружает ее. Модель удерживается вызывающим
+        до вызова release(key) и до этого не выгружается
+        :param key: ключ модели (тип модели)
+        :param loader: загружает модель
+        :param size: оценивает объем памяти загруженной модели (байт)
+        """
+        return self._load(key, loader, size, acquire=True)
+
+    def warm_up(self, key: str, loader: Callable[[], Any], size: Optional[Callable[[Any], int]] = None) -> Future:
+        """
+        Загружает модель в фоновом потоке (не удерживая ее)
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(1, thread_name_prefix="dm-model-warm-up")
+        return self._executor.submit(self._load, key, loader, size, False)
+
+    def is_loaded(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def release(self, key: str):
+        """
+        Отпускает модель, полученную через get: модель, которую никто не удерживает,
+        может быть выгружена при превышении лимита памяти
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > 0:
+                entry[2] -= 1
+            self._evict()
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return sum(entry[1] for entry in self._entries.values())
+
+    def _load(self, key: str, loader: Callable[[], Any], size: Optional[Callable[[Any], int]], acquire: bool) -> Any:
+        with self._lock:
+            value = self._get_loaded(key, acquire)
+            if value is not None:
+                return value
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        # Одна и та же модель не загружается одновременно несколькими потоками
+        with key_lock:
+            with self._lock:
+                value = self._get_loaded(key, acquire)
+                if value is not None:
+                    return value
+
+            value = loader()
+            value_size = size(value) if size is not None else 0
+
+            with self._lock:
+                self._entries[key] = [value, value_size, int(acquire)]
+                self._loading.pop(key, None)
+                # Только что загруженная модель не выгружается, даже если ее никто не удерживает (warm_up)
+                self._evict(keep=key)
+        return value
+
+    def _get_loaded(self, key: str, acquire: bool) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        entry[2] += acquire
+        return entry[0]
+
+    def _evict(self, keep: Optional[str] = None):
+        if self._max_size is None:
+            return
+        total = sum(entry[1] for entry in self._entries.values())
+        for key, entry in list(self._entries.items()):
+            if total <= self._max_size:
+                break
+            if key != keep and entry[2] == 0:
+                total -= self._entries.pop(key)[1]
+
+
+MODEL_POOL = ModelPool(MODEL_POOL_MAX_MB)
@@ -0,0 +1,244 @@
+from typing import Optional
+
+import cv2
+import numpy as np
+import numpy.typing as npt
+from numba import njit, prange, void, uint8, float32, int64
+
+from depthmap_wrappers.base import BaseDmWrapper
+from depthmap_wrappers.models import Model
+
+
+def _box(img: npt.NDArray, radius: int) -> npt.NDArray:
+    return cv2.boxFilter(img, cv2.CV_32F, (2 * radius + 1, 2 * radius + 1), borderType=cv2.BORDER_REFLECT)
+
+
+def _grey(image: npt.NDArray) -> npt.NDArray:
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+
+# Ядро компилируется при импорте и сохраняется в кэш numba на диске
+_GUIDED_KERNEL_SIGNATURES = [
+    void(float32[:, ::1], float32[:, ::1], uint8[:, ::1], int64[::1], float32[::1], int64[::1], float32[::1],
+         uint8[:, ::1]),
+    void(float32[:, :], float32[:, :], uint8[:, :], int64[:], float32[:], int64[:], float32[:], uint8[:, :]),
+]
+
+
+@njit(_GUIDED_KERNEL_SIGNATURES, parallel=True, cache=True)
+def _guided_apply_kernel(a: npt.NDArray, b: npt.NDArray, guide: npt.NDArray, rows: npt.NDArray,
+                         row_weights: npt.NDArray, columns: npt.NDArray, column_weights: npt.NDArray,
+                         out: npt.NDArray):
+    """
+    out = a * guide + b, где коэффициенты a и b билинейно интерполируются из уменьшенного размера.
+    Интерполяция и расчет выполняются за один проход без промежуточных массивов полного размера
+    """
+    height, width = out.shape
+    last_row = a.shape[0] - 1
+    low_width = a.shape[1]
+    last_column = low_width - 1
+    for y in prange(height):
+        y0 = rows[y]
+        y1 = min(y0 + 1, last_row)
+        wy = row_weights[y]
+        # Сначала коэффициенты интерполируются по вертикали в строку уменьшенной ширины
+        row_a = np.empty(low_width, np.float32)
+        row_b = np.empty(low_width, np.float32)
+        for x in range(low_width):
+            row_a[x] = a[y0, x] + (a[y1, x] - a[y0, x]) * wy
+            row_b[x] = b[y0, x] + (b[y1, x] - b[y0, x]) * wy
+        for x in range(width):
+            x0 = columns[x]
+            x1 = min(x0 + 1, last_column)
+            wx = column_weights[x]
+            value = (row_a[x0] + (row_a[x1] - row_a[x0]) * wx) * guide[y, x] + \
+                row_b[x0] + (row_b[x1] - row_b[x0]) * wx
+            out[y, x] = uint8(min(max(value + np.float32(0.5), np.float32(0)), np.float32(255)))
+
+
+def _linear_coords(size: int, low_size: int) -> tuple[npt.NDArray, npt.NDArray]:
+    """
+    Индексы и веса билинейной интерполяции из low_size в size (центры пикселей, как в cv2.resize)
+    """
+    coords = np.clip((np.arange(size, dtype=np.float32) + 0.5) * (low_size / size) - 0.5, 0, low_size - 1)
+    indices = coords.astype(np.int64)
+    return indices, (coords - indices).astype(np.float32)
+
+
+# Минимальное увеличение карты глубины, при котором используется управляемый фильтр: при меньшем
+# увеличении он не уточняет границы (бенчмарк upsampling), и карта увеличивается билинейно
+MIN_GUIDED_SCALE = 2
+
+
+def guided_upsample(dm: npt.NDArray, image: npt.NDArray, radius: int = 2, eps: float = 1e-3,
+                    subsample: Optional[int] = None) -> npt.NDArray:
+    """
+    Увеличивает карту глубины до размера кадра с сохранением границ объектов (управляемый фильтр
+    по яркости кадра). Коэффициенты фильтра рассчитываются на кадре, уменьшенном в subsample раз,
+    и интерполируются до полного размера (быстрый управляемый фильтр)
+    :param dm: карта глубины uint8 меньшего размера
+    :param image: исходный кадр (направляющее изображение)
+    :param radius: радиус окна фильтра (пикселей уменьшенного кадра)
+    :param eps: регуляризация: чем больше, тем сильнее сглаживание вместо переноса границ
+    :param subsample: во сколько раз уменьшается кадр (None - до размера карты глубины: при большем
+    размере коэффициенты не точнее, при меньшем теряются детали карты)
+    :return: карта глубины uint8 размера кадра
+    """
+    height, width = image.shape[:2]
+    guide = _grey(image)
+    if subsample is None:
+        subsample = int(min(width / dm.shape[1], height / dm.shape[0]))
+    subsample = max(1, subsample)
+    low_size = (max(1, width // subsample), max(1, height // subsample))
+    low_radius = max(1, radius)
+
+    guide_low = cv2.resize(guide, low_size, interpolation=cv2.INTER_AREA).astype(np.float32) / 255
+    src_low = cv2.resize(dm, low_size, interpolation=cv2.INTER_LINEAR).astype(np.float32) / 255
+
+    mean_guide = _box(guide_low, low_radius)
+    mean_src = _box(src_low, low_radius)
+    var_guide = _box(guide_low * guide_low, low_radius) - mean_guide * mean_guide
+    cov = _box(guide_low * src_low, low_radius) - mean_guide * mean_src
+    a = cov / (var_guide + eps)
+    b = mean_src - a * mean_guide
+
+    # q = mean_a * I + mean_b в шкале 0..255: I берется в исходной шкале, mean_b умножается на 255
+    mean_a = _box(a, low_radius)
+    mean_b = _box(b, low_radius) * 255
+    rows, row_weights = _linear_coords(height, low_size[1])
+    columns, column_weights = _linear_coords(width, low_size[0])
+    out = np.empty((height, width), np.uint8)
+    _guided_apply_kernel(mean_a, mean_b, np.ascontiguousarray(guide), rows, row_weights, columns, column_weights,
+                         out)
+    return out
+
+
+def _fit_size(width: int, height: int, max_side: int) -> tuple[int, int]:
+    scale = min(1.0, max_side / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _ramp(length: int, overlap: int) -> npt.NDArray:
+    """
+    Вес пикселей части вдоль одной оси: линейно растет в зоне перекрытия у краев
+    """
+    position = np.arange(length, dtype=np.float32)
+    return np.minimum(1, np.minimum(position + 1, length - position) / (overlap + 1))
+
+
+class DmGuidedUpsampleWrapper(BaseDmWrapper):
+    """
+    Обертка над загрузчиком для кадров высокого разрешения: нейронная сеть обрабатывает кадр,
+    уменьшенный до inference_size по большей стороне, или (tiles > 1) сетку перекрывающихся частей кадра.
+    Карты глубины частей приводятся к общей шкале по карте всего кадра (масштаб и сдвиг по методу
+    наименьших квадратов) и смешиваются с плавными весами в зонах перекрытия.
+    Итоговая карта увеличивается до размера кадра управляемым фильтром по исходному кадру
+    (при увеличении меньше MIN_GUIDED_SCALE или guided=False - билинейно)
+    """
+
+    def __init__(self, wrapper: BaseDmWrapper, inference_size: int = 512, tiles: int = 1, overlap: float = 0.25,
+                 guided: bool = True, radius: int = 2, eps: float = 1e-3):
+        """
+        :param wrapper: загрузчик, выполняющий нейронную сеть
+        :param inference_size: большая сторона кадра (или части кадра), передаваемого нейронной сети
+        :param tiles: количество частей по каждой стороне кадра (1 - кадр целиком)
+        :param overlap: перекрытие соседних частей (доля размера части)
+        :param guided: увеличивать карту управляемым фильтром (иначе - билинейной интерполяцией)
+        :param radius: радиус окна управляемого фильтра (пикселей карты глубины)
+        :param eps: регуляризация управляемого фильтра
+        """
+        self._wrapper = wrapper
+        self._inference_size = inference_size
+        self._tiles = max(1, tiles)
+        self._overlap = overlap
+        self._guided = guided
+        self._radius = radius
+        self._eps = eps
+
+    @property
+    def variant(self) -> str:
+        method = "guided" if self._guided else "linear"
+        return f"{self._wrapper.variant}-{method}{self._inference_size}x{self._tiles}"
+
+    def prepare_model(self, model: Model, *args):
+        self._wrapper.prepare_model(model, *args)
+
+    def warm_up(self, model: Model):
+        self._wrapper.warm_up(model)
+
+    def release_model(self):
+        self._wrapper.release_model()
+
+    def reset_state(self):
+        self._wrapper.reset_state()
+
+    def process(self, image, *args):
+        if self._tiles > 1:
+            return self._upsample(self._process_tiled(image, *args), image)
+        return self._upsample(self._wrapper.process(self._downscale(image, self._inference_size), *args), image)
+
+    def process_batch(self, images: list, *args) -> list:
+        if self._tiles > 1:
+            return [self.process(image, *args) for image in images]
+        dms = self._wrapper.process_batch([self._downscale(image, self._inference_size) for image in images], *args)
+        return [self._upsample(dm, image) for dm, image in zip(dms, images)]
+
+    def _upsample(self, dm: npt.NDArray, image: npt.NDArray) -> npt.NDArray:
+        if dm.shape == image.shape[:2]:
+            return dm
+        if not self._guided or image.shape[1] < dm.shape[1] * MIN_GUIDED_SCALE:
+            return cv2.resize(dm, image.shape[1::-1], interpolation=cv2.INTER_LINEAR)
+        return guided_upsample(dm, image, self._radius, self._eps)
+
+    @staticmethod
+    def _downscale(image: npt.NDArray, max_side: int) -> npt.NDArray:
+        height, width = image.shape[:2]
+        size = _fit_size(width, height, max_side)
+        if size == (width, height):
+            return image
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+    def _process_tiled(self, image: npt.NDArray, *args) -> npt.NDArray:
+        work = self._downscale(image, self._inference_size * self._tiles)
+        height, width = work.shape[:2]
+
+        # Карта всего кадра задает общую шкалу глубины для частей
+        coarse = self._wrapper.process(self._downscale(work, self._inference_size), *args)
+        coarse = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_LINEAR).astype(np.float32)
+
+        boxes = list(self._tile_boxes(width, height))
+        dms = self._wrapper.process_batch([work[y0:y1, x0:x1] for x0, y0, x1, y1 in boxes], *args)
+
+        result = np.zeros((height, width), np.float32)
+        weights = np.zeros((height, width), np.float32)
+        for (x0, y0, x1, y1), dm in zip(boxes, dms):
+            tile = dm.astype(np.float32)
+            scale, shift = self._align(tile, coarse[y0:y1, x0:x1])
+            overlap_x = round((x1 - x0) * self._overlap / 2)
+            overlap_y = round((y1 - y0) * self._overlap / 2)
+            weight = np.outer(_ramp(y1 - y0, overlap_y), _ramp(x1 - x0, overlap_x))
+            result[y0:y1, x0:x1] += (tile * scale + shift) * weight
+            weights[y0:y1, x0:x1] += weight
+        return cv2.convertScaleAbs(result / weights)
+
+    def _tile_boxes(self, width: int, height: int):
+        tile_width = min(width, round(width / self._tiles * (1 + self._overlap)))
+        tile_height = min(height, round(height / self._tiles * (1 + self._overlap)))
+        for row in range(self._tiles):
+            y0 = round((height - tile_height) * row / (self._tiles - 1))
+            for column in range(self._tiles):
+                x0 = round((width - tile_width) * column / (self._tiles - 1))
+                yield x0, y0, x0 + tile_width, y0 + tile_height
+
+    @staticmethod
+    def _align(tile: npt.NDArray, target: npt.NDArray) -> tuple[float, float]:
+        """
+        Масштаб и сдвиг, приводящие карту части к карте всего кадра (метод наименьших квадратов)
+        """
+        tile_mean = float(tile.mean())
+        target_mean = float(target.mean())
+        variance = float((tile * tile).mean()) - tile_mean * tile_mean
+        if variance < 1e-6:
+            return 0.0, target_mean
+        scale = (float((tile * target).mean()) - tile_mean * target_mean) / variance
+        return scale, target_mean - scale * tile_mean
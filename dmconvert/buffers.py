@@ -0,0 +1,135 @@
+import threading
+import weakref
+from typing import Optional
+
+import numpy as np
+import numpy.typing as npt
+
+
+class _Lease:
+    """
+    Выданный массив пула: владелец и количество удерживающих его участников
+    """
+    __slots__ = ("pool", "key", "ref", "count")
+
+    def __init__(self, pool: "DmFramePool", key: tuple, ref: weakref.ref):
+        self.pool = pool
+        self.key = key
+        self.ref = ref
+        self.count = 1
+
+
+# Выданные массивы всех пулов (по id массива). Ссылки слабые: массив, который не вернули в пул,
+# удаляется сборщиком мусора как обычно. RLock - удаление массива (и вызов weakref) может произойти
+# в потоке, уже удерживающем блокировку
+_leases: dict[int, _Lease] = {}
+_leases_lock = threading.RLock()
+
+
+def _find_lease(array) -> Optional[_Lease]:
+    lease = _leases.get(id(array))
+    return lease if lease is not None and lease.ref() is array else None
+
+
+def _forget_lease(key: int, ref: weakref.ref):
+    with _leases_lock:
+        lease = _leases.get(key)
+        if lease is not None and lease.ref is ref:
+            del _leases[key]
+
+
+def retain(array: Optional[npt.NDArray]):
+    """
+    Отмечает, что массив пула удерживается еще одним участником (например, очередью асинхронной записи).
+    Каждый вызов должен сопровождаться вызовом release. Для массивов не из пула ничего не делает
+    """
+    with _leases_lock:
+        lease = _find_lease(array)
+        if lease is not None:
+            lease.count += 1
+
+
+def release(array: Optional[npt.NDArray]):
+    """
+    Отпускает массив пула: когда его отпустят все участники, массив может быть выдан повторно.
+    После вызова массив (и его срезы) использовать нельзя. Для массивов не из пула ничего не делает
+    """
+    with _leases_lock:
+        lease = _find_lease(array)
+        if lease is None:
+            return
+        lease.count -= 1
+        if lease.count > 0:
+            return
+        del _leases[id(array)]
+    lease.pool._put(lease.key, array)
+
+
+class DmFramePool:
+    """
+    Пул заранее выделенных массивов кадров, общий для читателей, пре- и постпроцессоров.
+    Выданный массив принадлежит получателю и возвращается в пул явно (release), когда кадр больше
+    не нужен: конвертер отпускает кадры после записи, а участники, хранящие кадр дольше вызова
+    (очереди асинхронной записи, интерфейс), удерживают его через retain. Массив, который не вернули,
+    просто удаляется сборщиком мусора, поэтому пропущенный release не приводит к порче кадров
+    """
+
+    def __init__(self, max_buffers: int = 16):
+        """
+        :param max_buffers: максимальное количество хранимых свободных массивов одного размера и типа
+        """
+        self._max_buffers = max_buffers
+        self._free: dict[tuple, list[npt.NDArray]] = {}
+        self._lock = threading.Lock()
+        # Количество выделенных массивов (в установившемся режиме не растет)
+        self.allocations = 0
+
+    def get(self, shape: tuple, dtype=np.uint8) -> npt.NDArray:
+        dtype = np.dtype(dtype)
+        key = (tuple(shape), dtype)
+        with self._lock:
+            free = self._free.get(key)
+            array = free.pop() if free else None
+            if array is None:
+                self.allocations += 1
+        if array is None:
+            array = np.empty(shape, dtype)
+
+        with _leases_lock:
+            ref = weakref.ref(array, lambda dead, array_id=id(array): _forget_lease(array_id, dead))
+            _leases[id(array)] = _Lease(self, key, ref)
+        return array
+
+    def like(self, array: npt.NDArray) -> npt.NDArray:
+        return self.get(array.shape, array.dtype)
+
+    def release(self, array: Optional[npt.NDArray]):
+        release(array)
+
+    def clear(self):
+        with self._lock:
+            self._free.clear()
+
+    def _put(self, key: tuple, array: npt.NDArray):
+        with self._lock:
+            free = self._free.setdefault(key, [])
+            if len(free) < self._max_buffers:
+                free.append(array)
+
+
+# Пул, используемый по умолчанию
+FRAME_POOL = DmFramePool()
+
+
+def pool_or_default(pool: Optional[DmFramePool]) -> DmFramePool:
+    return FRAME_POOL if pool is None else pool
+
+
+def release_replaced(old: Optional[npt.NDArray], *new: Optional[npt.NDArray]):
+    """
+    Отпускает массив, замененный результатом обработки, если результат не использует его память
+    (срез или тот же массив)
+    """
+    if old is None or any(array is not None and np.may_share_memory(old, array) for array in new):
+        return
+    release(old)
@@ -0,0 +1,90 @@
+import json
+import os
+import time
+from dataclasses import dataclass, asdict, field
+from typing import Optional
+
+# Версия формата файла контрольной точки
+_CHECKPOINT_VERSION = 1
+
+
+@dataclass
+class DmCheckpoint:
+    """
+    Состояние конвертации: количество полностью записанных кадров и состояние writer-ов (в порядке
+    converter.writers; None - writer не поддерживает продолжение записи)
+    """
+    frames: int
+    writers: list[Optional[dict]] = field(default_factory=list)
+    source: Optional[str] = None
+
+
+class DmCheckpointer:
+    """
+    Периодическое сохранение контрольных точек конвертации в файл и их загрузка для продолжения
+    прерванной конвертации. Файл записывается атомарно (через временный файл), поэтому
+    аварийное завершение при сохранении не портит предыдущую контрольную точку
+    """
+
+    def __init__(self, path: str, interval: float = 60.0, resume: bool = False, source: Optional[str] = None):
+        """
+        :param path: файл контрольной точки
+        :param interval: период сохранения (сек)
+        :param resume: продолжить конвертацию с сохраненной контрольной точки (если файл существует)
+        :param source: идентификатор источника (например, путь к видео) для проверки при продолжении
+        """
+        self._path = path
+        self._interval = interval
+        self._resume = resume
+        self._source = source
+        self._last_save = time.monotonic()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def resume(self) -> bool:
+        return self._resume
+
+    def load(self) -> Optional[DmCheckpoint]:
+        """
+        :return: сохраненная контрольная точка или None, если файла нет
+        """
+        try:
+            with open(self._path, encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            raise ValueError(f"Не удалось прочитать контрольную точку {self._path}: {e}") from e
+
+        if data.get("version") != _CHECKPOINT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия контрольной точки {self._path}: {data.get('version')}")
+        checkpoint = DmCheckpoint(data["frames"], data.get("writers", []), data.get("source"))
+        if self._source is not None and checkpoint.source not in (None, self._source):
+            raise ValueError(f"Контрольная точка {self._path} относится к другому источнику: {checkpoint.source}")
+        return checkpoint
+
+    def due(self) -> bool:
+        return time.monotonic() - self._last_save >= self._interval
+
+    def save(self, checkpoint: DmCheckpoint):
+        if checkpoint.source is None:
+            checkpoint.source = self._source
+        data = {"version": _CHECKPOINT_VERSION, **asdict(checkpoint)}
+        directory = os.path.dirname(os.path.abspath(self._path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self._path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self._path)
+        self._last_save = time.monotonic()
+
+    def remove(self):
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
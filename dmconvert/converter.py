@@ -1,19 +1,27 @@
 import numpy.typing as npt
 from dataclasses import dataclass
-from typing import Callable, Optional
+from typing import Callable, Iterable, Iterator, Optional, Sequence
 
 from depthmap_wrappers.base import BaseDmWrapper
 from abc import ABC, abstractmethod
 from depthmap_wrappers.models import Model
+from .buffers import release, release_replaced
+from .checkpoint import DmCheckpoint, DmCheckpointer
+from .scenes import DmSceneCutDetector
+from .stats import DmConverterStats
+from .threads import apply_stage_threads
 
 RED = 2
 GREEN = 1
 BLUE = 0
 
+# Маркер окончания кадров источника
+_NO_FRAME = object()
+
 
 @dataclass
 class DmMediaParams:
-    fps: Optional[int] = None
+    fps: Optional[float] = None
     width: Optional[int] = None
     height: Optional[int] = None
     frame_count: Optional[int] = None
@@ -23,6 +31,10 @@ class ReaderError(RuntimeError):
     pass
 
 
+class WriterError(RuntimeError):
+    pass
+
+
 class DmMediaReader(ABC):
     def is_ready(self) -> bool:
         return True
@@ -39,11 +51,49 @@ class DmMediaReader(ABC):
 
     def close(self): ...
 
+    @property
+    def dropped_frames(self) -> int:
+        """
+        Количество кадров источника, пропущенных без обработки (например, устаревших кадров камеры)
+        """
+        return 0
+
+    def skip(self, frames: int) -> bool:
+        """
+        Пропускает первые кадры источника без чтения (продолжение прерванной конвертации).
+        Вызывается после prepare_and_get_params и до data
+        :return: False, если источник не поддерживает пропуск (кадры пропускаются чтением)
+        """
+        return False
+
+    def split(self, shard_size: int, cuts: Sequence[int] = (),
+              frame_count: Optional[int] = None) -> Optional[list[Callable[[], "DmMediaReader"]]]:
+        """
+        Разбивает источник на последовательные части для параллельной обработки.
+        Границы частей определяются dmconvert.scenes.split_at_cuts(0, количество кадров, shard_size, cuts).
+        Количество кадров видео в параметрах файла может быть неточным, поэтому последняя часть
+        читается до конца источника
+        :param shard_size: количество кадров в одной части
+        :param cuts: номера кадров (от начала источника), начинающих новую сцену, - границы частей
+        переносятся на ближайшие из них
+        :param frame_count: количество читаемых кадров, если оно известно точнее параметров источника
+        (например, после просмотра всех частей)
+        :return: фабрики источников частей в исходном порядке (должны сериализоваться pickle)
+        или None, если источник не поддерживает разбиение
+        """
+        return None
+
 
 class DmMediaSeekableReader(DmMediaReader):
     @abstractmethod
     def seek(self, position_ms: int): ...
 
+    @abstractmethod
+    def seek_frame(self, frame: int):
+        """
+        Переходит точно к кадру с номером frame
+        """
+
     @property
     @abstractmethod
     def duration(self) -> int: ...
@@ -52,6 +102,17 @@ class DmMediaSeekableReader(DmMediaReader):
     @abstractmethod
     def progress(self) -> int: ...
 
+    @property
+    @abstractmethod
+    def position(self) -> int:
+        """
+        Номер следующего читаемого кадра
+        """
+
+    @property
+    @abstractmethod
+    def frame_count(self) -> int: ...
+
     def replay(self):
         self.seek(0)
 
@@ -66,50 +127,283 @@ class DmMediaWriter(ABC):
     @abstractmethod
     def write(self, img: npt.NDArray, dm: npt.NDArray): ...
 
+    def flush(self):
+        """
+        Дожидается записи всех переданных кадров
+        """
+
+    def checkpoint(self) -> Optional[dict]:
+        """
+        Завершает запись переданных кадров и возвращает состояние для продолжения записи
+        после перезапуска (сериализуемое в JSON)
+        :return: состояние или None, если writer не поддерживает продолжение записи
+        """
+        self.flush()
+        return {}
+
+    def restore(self, state: dict):
+        """
+        Восстанавливает состояние, возвращенное checkpoint (вызывается после prepare)
+        """
+
+    def finish(self):
+        """
+        Вызывается перед close, если переданы все кадры источника (конвертация не прервана)
+        """
+
     def close(self): ...
 
 
-class DmMediaConverter:
-    preprocessors: list[Callable[[npt.NDArray], npt.NDArray]] = []
-    postprocessors: list[Callable[[npt.NDArray, npt.NDArray], tuple[npt.NDArray, npt.NDArray]]] = []
-    writers: list[DmMediaWriter] = []
+class DmMediaIndexedWriter(DmMediaWriter):
+    """
+    Writer, сохраняющий каждый кадр независимо под своим номером.
+    Номер выдается при передаче кадра, поэтому сами кадры можно записывать параллельно
+    """
 
-    def __init__(self, model: Model, reader: DmMediaReader, model_loader: BaseDmWrapper):
+    @abstractmethod
+    def next_index(self) -> int: ...
+
+    @abstractmethod
+    def write_indexed(self, index: int, img: npt.NDArray, dm: npt.NDArray): ...
+
+    def write(self, img: npt.NDArray, dm: npt.NDArray):
+        self.write_indexed(self.next_index(), img, dm)
+
+
+class DmMediaConverter:
+    preprocessors: list[Callable[[npt.NDArray], npt.NDArray]]
+    postprocessors: list[Callable[[npt.NDArray, npt.NDArray], tuple[npt.NDArray, npt.NDArray]]]
+    writers: list[DmMediaWriter]
+
+    def __init__(self, model: Model, reader: DmMediaReader, model_loader: BaseDmWrapper, batch_size: int = 1):
+        """
+        :param batch_size: количество кадров, обрабатываемых нейронной сетью за один проход
+        """
         self._reader = reader
         self._model = model
         self._is_running = False
         self._wrapper = model_loader
+        self._batch_size = max(1, batch_size)
+        self.preprocessors = []
+        self.postprocessors = []
+        self.writers = []
+        # Определение смены сцены: на склейке сбрасывается состояние загрузчика и постпроцессоров
+        self.scene_detector: Optional[DmSceneCutDetector] = None
+        # Сохранение контрольных точек и продолжение прерванной конвертации
+        self.checkpointer: Optional[DmCheckpointer] = None
+        self.stats = DmConverterStats()
+        # Кадры, записанные до продолжения конвертации, и кадры, пропускаемые чтением
+        self._resumed_frames = 0
+        self._discard_frames = 0
+        self._completed = False
 
     def start(self):
         self._is_running = True
+        self.stats.reset()
+        apply_stage_threads()
+        self.scene_detector and self.scene_detector.reset()
 
         media_params = self._reader.prepare_and_get_params()
         for writer in self.writers:
             writer.prepare(media_params)
+        self._resume()
 
-        self._wrapper.prepare_model(self._model)
+        with self.stats.measure("load_model"):
+            self._prepare_model()
 
+        self._completed = False
+        # Конвертация прервана пользователем (stop или Ctrl+C), а не ошибкой
+        interrupted = False
         try:
-            for img in self._reader.data():
-                if not self._is_running:
-                    break
-
-                for preprocessor in self.preprocessors:
-                    img = preprocessor(img)
-
-                dm = self._wrapper.process(img)
-
-                for postprocessor in self.postprocessors:
-                    img, dm = postprocessor(img, dm)
-
-                for writer in self.writers:
-                    writer.write(img, dm)
-        except KeyboardInterrupt:
-            pass
+            try:
+                self._convert()
+                interrupted = not self._completed
+            except KeyboardInterrupt:
+                interrupted = True
+            self._finish_checkpoints(interrupted)
+        except BaseException:
+            # Ошибка конвертации передается дальше, ошибки закрытия не заменяют ее
+            self._close(raise_error=False)
+            raise
+        self._close()
+
+    def _close(self, raise_error: bool = True):
+        """
+        Закрывает источник и writer-ы и отпускает модель. Ошибка закрытия (например, ошибка фоновой записи
+        или процесса ffmpeg) не мешает закрыть остальные; первая ошибка передается дальше после закрытия всех
+        :param raise_error: передать первую ошибку закрытия дальше
+        """
+        error: Optional[Exception] = None
+        try:
+            for close in [self._reader.close, *(writer.close for writer in self.writers)]:
+                try:
+                    close()
+                except Exception as e:
+                    error = error or e
         finally:
-            self._reader.close()
+            # Модель остается в пуле моделей, но может быть выгружена ради моделей других заданий
+            self._wrapper.release_model()
+            self.stats.finish()
+        if error is not None and raise_error:
+            raise error
+
+    def _resume(self):
+        """
+        Восстанавливает состояние writer-ов по контрольной точке и пропускает записанные кадры источника
+        """
+        self._resumed_frames = 0
+        self._discard_frames = 0
+        if self.checkpointer is None or not self.checkpointer.resume:
+            return
+        checkpoint = self.checkpointer.load()
+        if checkpoint is None:
+            return
+        if len(checkpoint.writers) != len(self.writers):
+            raise WriterError(f"Количество writer-ов не совпадает с контрольной точкой: "
+                              f"{len(self.writers)} вместо {len(checkpoint.writers)}")
+        for writer, state in zip(self.writers, checkpoint.writers):
+            if state is None:
+                raise WriterError(f"Writer не поддерживает продолжение записи: {writer.display_name()}")
+            writer.restore(state)
+
+        self._resumed_frames = checkpoint.frames
+        if not self._reader.skip(checkpoint.frames):
+            self._discard_frames = checkpoint.frames
+
+    def _save_checkpoint(self):
+        frames = self._resumed_frames + self.stats.frames
+        self.checkpointer.save(DmCheckpoint(frames, [writer.checkpoint() for writer in self.writers]))
+
+    def _finish_checkpoints(self, interrupted: bool):
+        """
+        После полной конвертации завершает запись и удаляет контрольную точку,
+        после прерывания пользователем - сохраняет контрольную точку.
+        После ошибки состояние writer-ов может быть неполным, поэтому контрольная точка не сохраняется
+        (остается последняя сохраненная), а ошибка передается дальше без изменений
+        :param interrupted: конвертация прервана пользователем
+        """
+        if self._completed:
+            for writer in self.writers:
+                writer.finish()
+            if self.checkpointer is not None:
+                self.checkpointer.remove()
+        elif interrupted and self.checkpointer is not None and self.stats.frames:
+            self._save_checkpoint()
+
+    def _prepare_model(self):
+        self._wrapper.prepare_model(self._model)
+        self._wrapper.reset_state()
+
+    def _convert(self):
+        for imgs, scene_cut in self._batches(self._scenes(map(self._preprocess, self._frames()))):
+            for i, (img, dm) in enumerate(zip(imgs, self._process(imgs, scene_cut))):
+                img, dm = self._postprocess(img, dm, scene_cut and i == 0)
+                self._write(img, dm)
+        self._completed = self._is_running
+
+    def _frames(self) -> Iterator[npt.NDArray]:
+        frames = iter(self._reader.data())
+        # Кадры, записанные до продолжения конвертации, если источник не умеет их пропускать
+        for _ in range(self._discard_frames):
+            with self.stats.measure("read"):
+                img = next(frames, _NO_FRAME)
+            if img is _NO_FRAME:
+                return
+            release(img)
+        while self._is_running:
+            with self.stats.measure("read"):
+                img = next(frames, _NO_FRAME)
+            if img is _NO_FRAME:
+                break
+            self.stats.dropped = self._reader.dropped_frames
+            yield img
+
+    def _scenes(self, imgs: Iterable[npt.NDArray]) -> Iterator[tuple[npt.NDArray, bool]]:
+        """
+        Отмечает кадры, начинающие новую сцену
+        """
+        for img in imgs:
+            scene_cut = False
+            if self.scene_detector is not None:
+                with self.stats.measure("scene"):
+                    scene_cut = self.scene_detector(img)
+                self.stats.scene_cuts += scene_cut
+            yield img, scene_cut
+
+    def _batches(self, items: Iterable[tuple[npt.NDArray, bool]]) -> Iterator[tuple[list, bool]]:
+        """
+        Собирает кадры в пакеты для нейронной сети; кадр новой сцены всегда начинает новый пакет
+        :param items: кадры и признаки начала новой сцены
+        :return: кадры пакета и признак того, что пакет начинает новую сцену
+        """
+        batch = []
+        batch_cut = False
+        for img, scene_cut in items:
+            if scene_cut and batch:
+                yield batch, batch_cut
+                batch = []
+            if not batch:
+                batch_cut = scene_cut
+            batch.append(img)
+            if len(batch) >= self._batch_size:
+                yield batch, batch_cut
+                batch = []
+        if batch:
+            yield batch, batch_cut
+
+    def _preprocess(self, img: npt.NDArray) -> npt.NDArray:
+        with self.stats.measure("preprocess"):
+            for preprocessor in self.preprocessors:
+                result = preprocessor(img)
+                release_replaced(img, result)
+                img = result
+        return img
+
+    def _process(self, imgs: list[npt.NDArray], scene_cut: bool = False) -> list[npt.NDArray]:
+        with self.stats.measure("process", len(imgs)):
+            if scene_cut:
+                self._wrapper.reset_state()
+            if len(imgs) == 1:
+                return [self._wrapper.process(imgs[0])]
+            return self._wrapper.process_batch(imgs)
+
+    def _postprocess(self, img: npt.NDArray, dm: npt.NDArray,
+                     scene_cut: bool = False) -> tuple[npt.NDArray, npt.NDArray]:
+        with self.stats.measure("postprocess"):
+            if scene_cut:
+                self._reset_postprocessors()
+            for postprocessor in self.postprocessors:
+                new_img, new_dm = postprocessor(img, dm)
+                release_replaced(img, new_img, new_dm)
+                if dm is not img:
+                    release_replaced(dm, new_img, new_dm)
+                img, dm = new_img, new_dm
+        return img, dm
+
+    def _reset_postprocessors(self):
+        """
+        Сбрасывает накопленное состояние постпроцессоров (метод reset), например окно усреднения карт глубины
+        """
+        for postprocessor in self.postprocessors:
+            reset = getattr(postprocessor, "reset", None)
+            if reset is not None:
+                reset()
+
+    def _write(self, img: npt.NDArray, dm: npt.NDArray):
+        """
+        Передает кадр writer-ам и возвращает его массивы в пул: writer, хранящий кадр после вызова write,
+        удерживает его через buffers.retain
+        """
+        with self.stats.measure("write"):
             for writer in self.writers:
-                writer.close()
+                writer.write(img, dm)
+        release(img)
+        if dm is not img:
+            release(dm)
+        self.stats.frame_done()
+        if self.checkpointer is not None and self.checkpointer.due():
+            with self.stats.measure("checkpoint"):
+                self._save_checkpoint()
 
     def stop(self):
         self._is_running = False
@@ -0,0 +1,227 @@
+"""
+    Пакетная обработка по файлу задания (JSON или YAML).
+
+    Пример задания:
+    {
+        "workers": 2,
+        "defaults": {"model": "dpt_swin2_tiny_256", "batch_size": 2},
+        "jobs": [
+            {
+                "reader": {"type": "video", "file_path": "input/a.mp4"},
+                "preprocessors": [{"type": "resize", "width": 640, "height": 480}],
+                "postprocessors": [{"type": "anaglyph", "max_offset": 10}],
+                "scene_cuts": {"method": "histogram", "threshold": 0.4},
+                "checkpoint": {"path": "output/a.checkpoint.json", "interval": 60, "resume": true},
+                "writers": [{"type": "ffmpeg", "file_name": "output/a.mp4", "layout": "color"},
+                            {"type": "ffmpeg", "file_name": "output/a_sbs.mp4", "layout": "side-by-side", "crf": 20}]
+            },
+            {
+                "reader": {"type": "images", "directory": "input/b", "prefetch": 8},
+                "writers": [{"type": "images", "directory": "output/b", "write_concat": true, "async_workers": 4},
+                            {"type": "video", "file_name": "output/b.mp4"}]
+            }
+        ]
+    }
+
+    Параметры reader-ов и writer-ов, кроме служебных ("type", "prefetch", "async_workers"),
+    передаются в конструкторы соответствующих классов.
+    Параметры "scene_cuts" передаются в DmSceneCutDetector (true - параметры по умолчанию).
+    Параметры "checkpoint" передаются в DmCheckpointer (строка - путь к файлу контрольной точки).
+    Продолжение записи (resume) поддерживают writer-ы "ffmpeg" и "images"; writer "video" (OpenCV)
+    дописать нельзя, поэтому задание с ним продолжить не получится
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Callable, Optional
+
+import cv2
+
+from .checkpoint import DmCheckpointer
+from .converter import DmMediaConverter, DmMediaReader, DmMediaWriter
+from .pipeline import DmPipelinedMediaConverter
+from .postprocessors import create_anaglyph_processor, create_ring_dm_correcter, create_dm_blur_processor, \
+    create_depth_range_smoother
+from .preprocessors import create_resize_preprocessor
+from .readers import DmVideoReader, DmCameraReader, DmImagesReader, DmPrefetchReader, DmFfmpegReader
+from .scenes import DmSceneCutDetector
+from .writers import DmVideoWriter, DmImageWriter, DmScreenWriter, DmAsyncWriter, DmFfmpegWriter
+from depthmap_wrappers.base import BaseDmWrapper
+from depthmap_wrappers.models import Model, Models
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+READERS: dict[str, type[DmMediaReader]] = {
+    "video": DmVideoReader,
+    "ffmpeg": DmFfmpegReader,
+    "camera": DmCameraReader,
+    "images": DmImagesReader,
+}
+
+WRITERS: dict[str, type[DmMediaWriter]] = {
+    "video": DmVideoWriter,
+    "ffmpeg": DmFfmpegWriter,
+    "images": DmImageWriter,
+    "screen": DmScreenWriter,
+}
+
+PREPROCESSORS: dict[str, Callable[..., Callable]] = {
+    "resize": create_resize_preprocessor,
+    "rotate180": lambda: partial(cv2.rotate, rotateCode=cv2.ROTATE_180),
+    "blur": lambda factor: partial(cv2.blur, ksize=(factor, factor)),
+}
+
+POSTPROCESSORS: dict[str, Callable[..., Callable]] = {
+    "anaglyph": create_anaglyph_processor,
+    "dm_correcter": create_ring_dm_correcter,
+    "dm_blur": create_dm_blur_processor,
+    "depth_ema": create_depth_range_smoother,
+}
+
+
+@dataclass
+class DmJobResult:
+    name: str
+    converter: Optional[DmMediaConverter] = None
+    error: Optional[BaseException] = None
+
+
+@dataclass
+class DmJobManifest:
+    jobs: list[dict]
+    workers: int = 1
+    defaults: dict = field(default_factory=dict)
+
+    def job(self, index: int) -> dict:
+        return {**self.defaults, **self.jobs[index]}
+
+
+def load_manifest(path: str) -> DmJobManifest:
+    with open(path, encoding="utf-8") as file:
+        if path.lower().endswith((".yml", ".yaml")):
+            if yaml is None:
+                raise ValueError("Для чтения заданий в формате YAML необходимо установить пакет PyYAML")
+            data = yaml.safe_load(file)
+        else:
+            data = json.load(file)
+
+    if not isinstance(data, dict) or not isinstance(data.get("jobs"), list):
+        raise ValueError(f"Файл задания {path} должен содержать список jobs")
+    return DmJobManifest(jobs=data["jobs"], workers=data.get("workers", 1), defaults=data.get("defaults", {}))
+
+
+def _split_spec(spec: dict, registry: dict[str, Any], kind: str) -> tuple[Any, dict]:
+    params = dict(spec)
+    type_name = params.pop("type", None)
+    if type_name not in registry:
+        raise ValueError(f"Неизвестный тип {kind}: {type_name}, допустимые: {', '.join(registry)}")
+    return registry[type_name], params
+
+
+def build_reader(spec: dict) -> DmMediaReader:
+    reader_type, params = _split_spec(spec, READERS, "reader")
+    prefetch = params.pop("prefetch", 0)
+    reader = reader_type(**params)
+    return DmPrefetchReader(reader, queue_size=prefetch) if prefetch else reader
+
+
+def build_writer(spec: dict) -> DmMediaWriter:
+    writer_type, params = _split_spec(spec, WRITERS, "writer")
+    async_workers = params.pop("async_workers", 0)
+    writer = writer_type(**params)
+    return DmAsyncWriter(writer, workers=async_workers) if async_workers else writer
+
+
+def build_converter(job: dict, model: Model, wrapper: BaseDmWrapper) -> DmMediaConverter:
+    reader = build_reader(job["reader"])
+    batch_size = job.get("batch_size", 1)
+    if job.get("pipeline"):
+        converter = DmPipelinedMediaConverter(model, reader, wrapper, batch_size, job.get("queue_size", 4))
+    else:
+        converter = DmMediaConverter(model, reader, wrapper, batch_size)
+
+    for spec in job.get("preprocessors", []):
+        builder, params = _split_spec(spec, PREPROCESSORS, "preprocessor")
+        converter.preprocessors.append(builder(**params))
+    for spec in job.get("postprocessors", []):
+        builder, params = _split_spec(spec, POSTPROCESSORS, "postprocessor")
+        converter.postprocessors.append(builder(**params))
+    for spec in job.get("writers", []):
+        converter.writers.append(build_writer(spec))
+
+    scene_cuts = job.get("scene_cuts")
+    if scene_cuts:
+        converter.scene_detector = DmSceneCutDetector(**(scene_cuts if isinstance(scene_cuts, dict) else {}))
+
+    checkpoint = job.get("checkpoint")
+    if checkpoint:
+        params = checkpoint if isinstance(checkpoint, dict) else {"path": checkpoint}
+        converter.checkpointer = DmCheckpointer(**{"source": _job_source(job), **params})
+    return converter
+
+
+def _find_model(job: dict) -> Model:
+    models = [m.value for m in Models]
+    if not models:
+        raise ValueError("Нет доступных моделей")
+    model_type = job.get("model")
+    if model_type is None:
+        return models[0]
+    model = Models.find_by_model_type(model_type)
+    if model is None:
+        raise ValueError(f"Модель {model_type} не найдена")
+    return model
+
+
+def _job_source(job: dict) -> str:
+    reader = job.get("reader", {})
+    return next((str(v) for k, v in reader.items() if k != "type"), "")
+
+
+def _job_name(index: int, job: dict) -> str:
+    source = _job_source(job)
+    return job.get("name", f"#{index + 1} {os.path.basename(source)}".strip())
+
+
+def run_manifest(manifest: DmJobManifest, wrapper_factory: Callable[[], BaseDmWrapper],
+                 workers: Optional[int] = None,
+                 on_done: Optional[Callable[[DmJobResult], None]] = None) -> list[DmJobResult]:
+    """
+    Выполняет задания параллельно (не более workers одновременно).
+    Каждое задание получает свой загрузчик (загрузчики хранят состояние между кадрами: кэш, сглаживание),
+    а веса каждой модели загружаются один раз и используются загрузчиками всех заданий через общий пул
+    моделей. При запуске задания в фоне загружается модель следующего по порядку задания; модели
+    завершенных заданий выгружаются из пула моделей при превышении его лимита памяти
+    :param wrapper_factory: создает загрузчик модели
+    :param workers: количество одновременно выполняемых заданий (по умолчанию - из файла задания)
+    :param on_done: вызывается по завершении каждого задания
+    :return: результаты в порядке заданий
+    """
+    def warm_up(index: int):
+        # Модель загружается в фоне, пока выполняются предыдущие задания
+        if index < len(manifest.jobs):
+            try:
+                wrapper_factory().warm_up(_find_model(manifest.job(index)))
+            except ValueError:
+                pass
+
+    def run(index: int) -> DmJobResult:
+        job = manifest.job(index)
+        result = DmJobResult(_job_name(index, job))
+        warm_up(index + 1)
+        try:
+            model = _find_model(job)
+            result.converter = build_converter(job, model, wrapper_factory())
+            result.converter.start()
+        except Exception as e:
+            result.error = e
+        on_done and on_done(result)
+        return result
+
+    with ThreadPoolExecutor(max(1, workers or manifest.workers), thread_name_prefix="dm-job") as executor:
+        return list(executor.map(run, range(len(manifest.jobs))))
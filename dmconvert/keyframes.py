@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import tempfile
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+
+# Версия формата файла индекса (индексы других версий строятся заново)
+_INDEX_VERSION = 1
+
+# Расширение файла индекса, сохраняемого рядом с видео
+INDEX_SUFFIX = ".keyframes.json"
+
+# Директория индексов видео, рядом с которыми нельзя записывать файлы
+_FALLBACK_DIR = os.path.join(tempfile.gettempdir(), "dmconvert-keyframes")
+
+
+@dataclass
+class DmKeyframeIndex:
+    """
+    Номера опорных кадров видео: с них декодирование начинается без предыдущих кадров
+    """
+    frame_count: int
+    keyframes: list[int]
+
+    def keyframe_before(self, frame: int) -> int:
+        """
+        Ближайший опорный кадр не после frame
+        """
+        position = bisect_right(self.keyframes, frame)
+        return self.keyframes[position - 1] if position else 0
+
+    def next_keyframe(self, frame: int) -> Optional[int]:
+        """
+        Ближайший опорный кадр после frame (None - таких нет)
+        """
+        position = bisect_right(self.keyframes, frame)
+        return self.keyframes[position] if position < len(self.keyframes) else None
+
+
+def build_keyframe_index(path: str) -> Optional[DmKeyframeIndex]:
+    """
+    Строит индекс чтением пакетов видео без декодирования (интерфейс FFMPEG OpenCV)
+    :return: индекс или None, если интерфейс не сообщает об опорных кадрах
+    """
+    cap = cv2.VideoCapture(path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    try:
+        if not cap.isOpened():
+            return None
+        keyframes = []
+        count = 0
+        while cap.grab():
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME) > 0:
+                keyframes.append(count)
+            count += 1
+    finally:
+        cap.release()
+    if not keyframes or keyframes[0] != 0:
+        return None
+    return DmKeyframeIndex(count, keyframes)
+
+
+def _index_paths(path: str) -> list[str]:
+    name = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+    return [path + INDEX_SUFFIX, os.path.join(_FALLBACK_DIR, name + INDEX_SUFFIX)]
+
+
+def _source_stamp(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_keyframe_index(path: str, cache: bool = True) -> Optional[DmKeyframeIndex]:
+    """
+    Возвращает индекс опорных кадров видео. Индекс строится один раз и сохраняется рядом с видео
+    (или во временной директории, если рядом с видео записывать нельзя); при изменении видео строится заново
+    :param cache: читать и сохранять индекс в файл
+    """
+    stamp = _source_stamp(path)
+    if cache:
+        for index_path in _index_paths(path):
+            try:
+                with open(index_path) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+            if data.get("version") == _INDEX_VERSION and data.get("source") == stamp:
+                return DmKeyframeIndex(data["frame_count"], data["keyframes"])
+
+    index = build_keyframe_index(path)
+    if index is None or not cache:
+        return index
+
+    data = {"version": _INDEX_VERSION, "source": stamp, "frame_count": index.frame_count,
+            "keyframes": index.keyframes}
+    for index_path in _index_paths(path):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+            with open(index_path, "w") as file:
+                json.dump(data, file)
+            break
+        except OSError:
+            continue
+    return index
@@ -0,0 +1,113 @@
+import queue
+import threading
+from typing import Any, Callable, Generator, Iterable, Optional
+
+from .converter import DmMediaConverter, DmMediaReader
+from .threads import apply_stage_threads
+from depthmap_wrappers.base import BaseDmWrapper
+from depthmap_wrappers.models import Model
+
+# Маркер завершения потока данных между этапами
+_END = object()
+
+# Период проверки флага остановки при ожидании очереди (сек)
+_POLL_INTERVAL = 0.1
+
+
+class DmPipelinedMediaConverter(DmMediaConverter):
+    """
+    Конвертер, в котором чтение (вместе с препроцессорами), нейросеть, постпроцессоры и запись
+    выполняются одновременно в отдельных потоках.
+    Этапы связаны ограниченными очередями: порядок кадров сохраняется, а быстрый этап ожидает
+    медленный, не накапливая кадры в памяти.
+    Количество потоков вычислений каждого этапа задается в DmThreadConfig.stages (dmconvert.threads)
+    """
+
+    def __init__(self, model: Model, reader: DmMediaReader, model_loader: BaseDmWrapper, batch_size: int = 1,
+                 queue_size: int = 4):
+        """
+        :param queue_size: максимальное количество кадров в очереди между соседними этапами
+        """
+        super().__init__(model, reader, model_loader, batch_size)
+        self._queue_size = queue_size
+        self._error: Optional[BaseException] = None
+
+    def _convert(self):
+        self._error = None
+        read_queue = queue.Queue(self._queue_size)
+        dm_queue = queue.Queue(self._queue_size)
+        out_queue = queue.Queue(self._queue_size)
+
+        stages = [
+            self._create_stage("read", self._read_stage, None, read_queue),
+            self._create_stage("process", self._process_stage, read_queue, dm_queue),
+            self._create_stage("postprocess", self._postprocess_stage, dm_queue, out_queue),
+        ]
+        for stage in stages:
+            stage.start()
+
+        # Запись выполняется в вызывающем потоке (часть writer-ов, например cv2.imshow, требует этого)
+        try:
+            for img, dm in self._receive(out_queue):
+                self._write(img, dm)
+            self._completed = self._is_running and self._error is None
+        finally:
+            self._is_running = False
+            for stage in stages:
+                stage.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def _read_stage(self, _) -> Generator[Any, None, None]:
+        yield from self._scenes(map(self._preprocess, self._frames()))
+
+    def _process_stage(self, items: Iterable) -> Generator[Any, None, None]:
+        for imgs, scene_cut in self._batches(items):
+            for i, (img, dm) in enumerate(zip(imgs, self._process(imgs, scene_cut))):
+                yield img, dm, scene_cut and i == 0
+
+    def _postprocess_stage(self, items: Iterable) -> Generator[Any, None, None]:
+        for img, dm, scene_cut in items:
+            yield self._postprocess(img, dm, scene_cut)
+
+    def _create_stage(self, name: str, stage: Callable[[Optional[Iterable]], Iterable],
+                      source: Optional[queue.Queue], target: queue.Queue) -> threading.Thread:
+        return threading.Thread(target=self._run_stage, args=(name, stage, source, target), name=f"dm-{name}",
+                                daemon=True)
+
+    def _run_stage(self, name: str, stage: Callable[[Optional[Iterable]], Iterable],
+                   source: Optional[queue.Queue], target: queue.Queue):
+        try:
+            apply_stage_threads(name)
+            items = self._receive(source) if source is not None else None
+            for item in stage(items):
+                # Заполненность очереди после этапа: полная очередь означает, что этап ожидает следующие
+                self.stats.record_queue(name, target.qsize())
+                if not self._put(target, item):
+                    break
+        except BaseException as e:
+            if self._error is None:
+                self._error = e
+            self._is_running = False
+        finally:
+            self._put(target, _END)
+
+    def _put(self, target: queue.Queue, item) -> bool:
+        while True:
+            try:
+                target.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                if not self._is_running:
+                    return False
+
+    def _receive(self, source: queue.Queue) -> Generator[Any, None, None]:
+        while self._is_running:
+            try:
+                item = source.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if item is _END:
+                return
+            yield item
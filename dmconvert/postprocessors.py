@@ -1,35 +1,174 @@
+from typing import Optional
+
 import cv2
-from numba import njit
+from numba import njit, prange, void, uint8, int64
+from .buffers import DmFramePool, pool_or_default
 from .converter import RED, GREEN, BLUE
 import math
 import numpy as np
 import numpy.typing as npt
 
 
-def create_anaglyph_processor(max_offset: int, direction: int = 1):
+# Ядро компилируется один раз при импорте (для C-непрерывных и произвольных массивов) и сохраняется в кэш numba
+# на диске, поэтому ни первый кадр, ни изменение параметров не вызывают повторной JIT-компиляции
+_ANAGLYPH_KERNEL_SIGNATURES = [
+    void(uint8[:, :, ::1], uint8[:, ::1], int64, int64, uint8[:, :, ::1]),
+    void(uint8[:, :, :], uint8[:, :], int64, int64, uint8[:, :, :]),
+]
+
+
+@njit(_ANAGLYPH_KERNEL_SIGNATURES, parallel=True, cache=True)
+def _anaglyph_kernel(img: npt.NDArray, dm: npt.NDArray, max_offset: int, direction: int, out: npt.NDArray):
+    """
+    Строки кадра обрабатываются параллельно. Пиксель красного канала получает значение первого (слева)
+    ненулевого пикселя, сдвиг которого его покрывает. Все позиции до [filled] уже заняты,
+    поэтому каждая позиция строки записывается не более одного раза
+    """
+    height, width = dm.shape
+    for x in prange(height):
+        for y in range(width):
+            for c in range(out.shape[2]):
+                out[x, y, c] = 0
+            out[x, y, GREEN] = img[x, y, GREEN]
+            out[x, y, BLUE] = img[x, y, BLUE]
+
+        filled = -1
+        for y in range(width):
+            value = img[x, y, RED]
+            if value == 0:
+                continue
+            end = min(y + math.floor((dm[x, y] / 255) * max_offset * direction), width - 1)
+            for k in range(max(y, filled + 1), end + 1):
+                out[x, k, RED] = value
+            filled = max(filled, end)
+
+
+def anaglyph(img: npt.NDArray, dm: npt.NDArray, max_offset: int, direction: int = 1,
+             out: Optional[npt.NDArray] = None) -> npt.NDArray:
+    """
+    Конвертирует 2D кадр в анаглифный формат по карте глубины
+    :param out: массив для результата (размера img, не должен совпадать с img)
+    """
+    if out is None:
+        out = np.empty(img.shape, np.uint8)
+    _anaglyph_kernel(img, dm, int(max_offset), int(direction), out)
+    return out
+
+
+def create_anaglyph_processor(max_offset: int, direction: int = 1, pool: Optional[DmFramePool] = None):
     """
     Создает конвертор 2D кадра в анаглифный формат по карте глубины
     :param max_offset: Максимальное значение параллакса (пикселей)
     :param direction: направление сдвига
+    :param pool: пул массивов для результата (по умолчанию - общий FRAME_POOL)
     """
 
-    @njit
+    pool = pool_or_default(pool)
+    max_offset = int(max_offset)
+    direction = int(direction)
+
     def convert(img: npt.NDArray, dm: npt.NDArray):
-        anaglyph: npt.NDArray = np.zeros(img.shape).astype(np.uint8)
+        return anaglyph(img, dm, max_offset, direction, pool.get(img.shape, np.uint8)), dm
+
+    return convert
 
-        anaglyph[:, :, GREEN] = img[:, :, GREEN]
-        anaglyph[:, :, BLUE] = img[:, :, BLUE]
 
-        for x in range(dm.shape[0]):
-            for y in range(dm.shape[1]):
-                offset = math.floor((dm[x][y] / 255) * max_offset * direction)
-                for k in range(min(offset + 1, dm.shape[1] - y)):
-                    if not anaglyph[x, y + k, RED]:
-                        anaglyph[x, y + k, RED] = img[x, y, RED]
+def create_dm_blur_processor(factor: int, pool: Optional[DmFramePool] = None):
+    """
+    Создает постпроцессор размытия карты глубины. Карта загрузчика может принадлежать ему или кэшу,
+    поэтому результат записывается в массив пула, а не на место исходной карты
+    :param factor: размер окна размытия
+    :param pool: пул массивов для результата (по умолчанию - общий FRAME_POOL)
+    """
 
-        return anaglyph, dm
+    pool = pool_or_default(pool)
+    ksize = (int(factor), int(factor))
 
-    return convert
+    def blur(img: npt.NDArray, dm: npt.NDArray):
+        return img, cv2.blur(dm, ksize, dst=pool.like(dm))
+
+    return blur
+
+
+# Ширина уменьшенных карт глубины для сопоставления шкал соседних кадров
+_RANGE_THUMB_WIDTH = 64
+
+
+class _DepthRangeSmoother:
+    """
+    Сглаживание диапазона карты глубины между кадрами (экспоненциальное скользящее среднее границ диапазона).
+    Загрузчик растягивает каждую карту на весь диапазон 0..255, поэтому шкала предыдущего результата
+    переводится в шкалу текущей карты масштабом и сдвигом, найденными методом наименьших квадратов
+    по уменьшенным картам. Границы диапазона усредняются в шкале предыдущего результата, и карта
+    растягивается по усредненному диапазону. Состояние принадлежит конвертеру и сбрасывается при смене сцены
+    """
+
+    def __init__(self, ema: float, pool: Optional[DmFramePool] = None):
+        if not 0 <= ema < 1:
+            raise ValueError(f"Коэффициент сглаживания должен быть в диапазоне [0, 1): {ema}")
+        self._ema = ema
+        self._pool = pool_or_default(pool)
+        self._previous: Optional[npt.NDArray] = None
+
+    def reset(self):
+        self._previous = None
+
+    def __call__(self, img: npt.NDArray, dm: npt.NDArray):
+        thumb = self._thumbnail(dm)
+        scale, shift = self._fit(thumb)
+        if scale is None:
+            self._previous = thumb
+            return img, dm
+
+        # Границы диапазона текущей карты в шкале предыдущего результата (его диапазон - 0..255)
+        low, high = cv2.minMaxLoc(dm)[:2]
+        low = (1 - self._ema) * (scale * low + shift)
+        high = self._ema * 255 + (1 - self._ema) * (scale * high + shift)
+        if high - low <= np.finfo(np.float32).eps:
+            self._previous = thumb
+            return img, dm
+
+        alpha = 255 * scale / (high - low)
+        beta = 255 * (shift - low) / (high - low)
+        new_dm = self._pool.get(dm.shape, np.uint8)
+        cv2.addWeighted(dm, alpha, dm, 0, beta, dst=new_dm)
+        self._previous = np.clip(thumb * alpha + beta, 0, 255)
+        return img, new_dm
+
+    @staticmethod
+    def _thumbnail(dm: npt.NDArray) -> npt.NDArray:
+        height, width = dm.shape[:2]
+        thumb_width = min(width, _RANGE_THUMB_WIDTH)
+        size = (thumb_width, max(1, round(height * thumb_width / width)))
+        return cv2.resize(dm, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def _fit(self, thumb: npt.NDArray) -> tuple[Optional[float], float]:
+        """
+        Масштаб и сдвиг, переводящие текущую карту в шкалу предыдущего результата
+        :return: (None, 0) - предыдущего результата нет или карты не связаны (сглаживание пропускается)
+        """
+        previous = self._previous
+        if previous is None or previous.shape != thumb.shape:
+            return None, 0.0
+        thumb_mean = float(thumb.mean())
+        previous_mean = float(previous.mean())
+        variance = float((thumb * thumb).mean()) - thumb_mean * thumb_mean
+        if variance < 1e-6:
+            return None, 0.0
+        scale = (float((thumb * previous).mean()) - thumb_mean * previous_mean) / variance
+        if scale <= 0:
+            return None, 0.0
+        return scale, previous_mean - scale * thumb_mean
+
+
+def create_depth_range_smoother(ema: float, pool: Optional[DmFramePool] = None):
+    """
+    Создает постпроцессор, сглаживающий диапазон карты глубины между кадрами видео: яркость карт глубины
+    соседних кадров не колеблется. Должен быть первым постпроцессором (работает с картами загрузчика)
+    :param ema: вес диапазона предыдущих кадров (0 - без сглаживания, ближе к 1 - сильнее)
+    :param pool: пул массивов для результата (по умолчанию - общий FRAME_POOL)
+    """
+    return _DepthRangeSmoother(ema, pool)
 
 
 def create_dm_correcter(windows_size: int, move_factor: int, return_num: int = -1):
@@ -69,4 +208,124 @@ def create_dm_correcter(windows_size: int, move_factor: int, return_num: int = -
 
         return img_frame_holder[result_num], new_dm
 
+    def reset():
+        dm_frame_holder.clear()
+        img_frame_holder.clear()
+
+    # Вызывается конвертером при смене сцены
+    convert.reset = reset
     return convert
+
+
+class _RingDmCorrecter:
+    """
+    Постпроцессор для устранения колебания карты глубины на основе кольцевого буфера.
+    Для каждой ячейки буфера хранится признак "статичности" относительно текущего кадра, а сумма
+    статичных карт глубины - в накопителе float32. Добавление и вытеснение кадра стоят O(H×W),
+    накопитель пересчитывается только для ячеек, у которых признак изменился.
+    Кадры сравниваются по полным картам глубины, как в [create_dm_correcter], поэтому сравнение текущей
+    карты со всеми картами окна стоит O(windows_size×H×W) (без промежуточных массивов, через cv2.norm):
+    на уменьшенных копиях мелкое движение усредняется и разница занижается относительно порога move_factor
+    """
+
+    def __init__(self, windows_size: int, move_factor: int, return_num: int = -1,
+                 pool: Optional[DmFramePool] = None):
+        if return_num < -1:
+            raise ValueError(f"Номер возвращаемого кадра должен быть не меньше -1: {return_num}")
+        self._windows_size = max(1, windows_size)
+        self._move_factor = move_factor
+        self._return_num = return_num
+        self._pool = pool_or_default(pool)
+        self._dms: Optional[npt.NDArray] = None
+        self._imgs: Optional[npt.NDArray] = None
+        self._static = np.zeros(self._windows_size, dtype=bool)
+        self._accumulator: Optional[npt.NDArray] = None
+        self._sum: Optional[npt.NDArray] = None
+        self._head = 0
+        self._used = 0
+
+    def reset(self):
+        """
+        Очищает окно усреднения (например, при смене сцены), сохраняя выделенные буферы
+        """
+        if self._accumulator is not None:
+            self._accumulator.fill(0)
+        self._static[:] = False
+        self._head = 0
+        self._used = 0
+
+    def __call__(self, img: npt.NDArray, dm: npt.NDArray):
+        if self._dms is None or self._dms.shape[1:] != dm.shape or \
+                (self._imgs is not None and self._imgs.shape[1:] != img.shape):
+            self._allocate(img, dm)
+
+        self._update_static(dm)
+
+        # Среднее текущей карты и статичных карт из буфера
+        count = np.count_nonzero(self._static[:self._used]) + 1
+        np.add(self._accumulator, dm, out=self._sum)
+        new_dm = self._pool.get(dm.shape, np.uint8)
+        np.divide(self._sum, count, out=new_dm, casting="unsafe")
+
+        result_img = self._push(img, dm)
+        return result_img, new_dm
+
+    def _allocate(self, img: npt.NDArray, dm: npt.NDArray):
+        height, width = dm.shape
+        self._dms = np.empty((self._windows_size, height, width), dtype=np.uint8)
+        self._imgs = np.empty((self._windows_size, *img.shape), dtype=img.dtype) if self._return_num != -1 else None
+        self._accumulator = np.zeros((height, width), dtype=np.float32)
+        self._sum = np.empty((height, width), dtype=np.float32)
+        self._static[:] = False
+        self._head = 0
+        self._used = 0
+
+    def _update_static(self, dm: npt.NDArray):
+        used = self._used
+        if used == 0:
+            return
+
+        # Средняя абсолютная разница карт (cv2.norm считает сумму без промежуточного массива)
+        static = np.array([cv2.norm(self._dms[slot], dm, cv2.NORM_L1) / dm.size * 100 < self._move_factor
+                           for slot in range(used)])
+        for slot in np.flatnonzero(static != self._static[:used]):
+            if static[slot]:
+                np.add(self._accumulator, self._dms[slot], out=self._accumulator)
+            else:
+                np.subtract(self._accumulator, self._dms[slot], out=self._accumulator)
+        self._static[:used] = static
+
+    def _push(self, img: npt.NDArray, dm: npt.NDArray) -> npt.NDArray:
+        head = self._head
+        if self._used == self._windows_size and self._static[head]:
+            np.subtract(self._accumulator, self._dms[head], out=self._accumulator)
+
+        self._dms[head] = dm
+        self._static[head] = False
+        self._head = (head + 1) % self._windows_size
+        self._used = min(self._used + 1, self._windows_size)
+
+        if self._imgs is None:
+            return img
+
+        self._imgs[head] = img
+        oldest = self._head if self._used == self._windows_size else 0
+        slot = (oldest + min(self._used - 1, self._return_num)) % self._windows_size
+        result = self._pool.like(self._imgs[slot])
+        np.copyto(result, self._imgs[slot])
+        return result
+
+
+def create_ring_dm_correcter(windows_size: int, move_factor: int, return_num: int = -1,
+                             pool: Optional[DmFramePool] = None):
+    """
+    Создает постпроцессор для устранения колебания карты глубины в соседних кадрах.
+    В отличие от [create_dm_correcter] хранит кадры в заранее выделенном кольцевом буфере
+    и не пересчитывает среднее по всему окну на каждом кадре
+    :param windows_size: размер окна усреднения
+    :param move_factor: порог для определения движения в кадре
+    :param return_num: номер кадра для возврата (позволяет выбирать: усреднять кадр с предыдущими или следующими);
+    -1 - текущий кадр, другие отрицательные значения не допускаются
+    :param pool: пул массивов для результата (по умолчанию - общий FRAME_POOL)
+    """
+    return _RingDmCorrecter(windows_size, move_factor, return_num, pool)
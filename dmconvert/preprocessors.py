@@ -0,0 +1,26 @@
+from functools import partial
+from typing import Optional
+
+import cv2
+import numpy.typing as npt
+
+from .buffers import DmFramePool, pool_or_default
+
+
+def resize(img: npt.NDArray, width: int, height: int, interpolation: int = cv2.INTER_AREA,
+           pool: Optional[DmFramePool] = None) -> npt.NDArray:
+    """
+    Изменяет размер кадра; результат записывается в массив из пула
+    :param pool: пул массивов кадров (по умолчанию - общий FRAME_POOL)
+    """
+    out = pool_or_default(pool).get((height, width, *img.shape[2:]), img.dtype)
+    return cv2.resize(img, (width, height), dst=out, interpolation=interpolation)
+
+
+def create_resize_preprocessor(width: int, height: int, interpolation: int = cv2.INTER_AREA,
+                               pool: Optional[DmFramePool] = None):
+    """
+    Создает препроцессор изменения размера кадра.
+    Без собственного пула препроцессор сериализуется pickle и может передаваться в процессы обработки
+    """
+    return partial(resize, width=int(width), height=int(height), interpolation=interpolation, pool=pool)
@@ -1,87 +1,484 @@
 import glob
+import math
 import os
+import queue
+import shutil
+import subprocess
+import tempfile
 import threading
 import cv2
 
-from functools import cached_property
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import replace
+from functools import cached_property, partial
+from itertools import islice
 from cv2 import VideoCapture
 from numpy import typing as npt
-from typing import Optional, Generator
+from typing import Callable, Optional, Generator, Sequence
+from .buffers import DmFramePool, pool_or_default, release
 from .converter import DmMediaReader, DmMediaParams, DmMediaSeekableReader, ReaderError
+from .keyframes import DmKeyframeIndex, load_keyframe_index
+from .scenes import split_at_cuts
+
+
+# Программные интерфейсы OpenCV для чтения видео
+VIDEO_BACKENDS = {
+    "any": cv2.CAP_ANY,
+    "ffmpeg": cv2.CAP_FFMPEG,
+    "gstreamer": cv2.CAP_GSTREAMER,
+    "msmf": cv2.CAP_MSMF,
+    "avfoundation": cv2.CAP_AVFOUNDATION,
+}
+
+
+# Запас кадров, с которым OpenCV (интерфейс FFMPEG) переходит к кадру: переход выполняется к опорному кадру
+# не позже чем за это количество кадров до нужного, затем кадры декодируются до нужного
+_OPENCV_SEEK_DELTA = 16
 
 
 def _create_media_params(cap: VideoCapture) -> DmMediaParams:
     return DmMediaParams(
-        fps=int(cap.get(cv2.CAP_PROP_FPS)),
+        # Точная частота кадров (например, 29.97): по ней вычисляется время кадра при переходе
+        fps=cap.get(cv2.CAP_PROP_FPS),
         width=int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
         height=int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
         frame_count=int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
     )
 
 
+def _open_video(source: str, backend: Optional[str] = None, threads: Optional[int] = None,
+                hw_acceleration: bool = False) -> VideoCapture:
+    """
+    Открывает видео с выбранным программным интерфейсом и параметрами декодирования
+    :param backend: название интерфейса из VIDEO_BACKENDS (None - выбор OpenCV)
+    :param threads: количество потоков декодирования (None - значение интерфейса по умолчанию)
+    :param hw_acceleration: использовать аппаратное декодирование, если оно доступно
+    """
+    if backend is not None and backend not in VIDEO_BACKENDS:
+        raise ReaderError(f"Неизвестный интерфейс чтения видео: {backend}")
+    params = []
+    if threads is not None:
+        params += [cv2.CAP_PROP_N_THREADS, threads]
+    if hw_acceleration:
+        params += [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+    return cv2.VideoCapture(source, VIDEO_BACKENDS[backend or "any"], params)
+
+
+def _stride_params(params: DmMediaParams, stride: int) -> DmMediaParams:
+    """
+    Параметры видео при чтении каждого stride-го кадра
+    """
+    return replace(params, fps=params.fps and params.fps / stride,
+                   frame_count=params.frame_count and math.ceil(params.frame_count / stride))
+
+
+def read_frames(cap: VideoCapture, pool: DmFramePool, lock: Optional[threading.Lock] = None, stride: int = 1,
+                advance: Optional[Callable[[int], None]] = None) -> Generator[npt.NDArray, any, None]:
+    """
+    Читает кадры, декодируя их в массивы из пула (размер кадра известен после первого чтения)
+    :param stride: читается каждый stride-й кадр, остальные пропускаются без преобразования в массив
+    :param advance: вызывается (под lock) с количеством кадров источника, пройденных при чтении кадра
+    """
+    shape = None
+    while cap.isOpened():
+        buffer = pool.get(shape) if shape is not None else None
+        with lock or nullcontext():
+            ret, img = cap.read(image=buffer)
+            if ret and img is not None:
+                frames = 1
+                for _ in range(stride - 1):
+                    if not cap.grab():
+                        break
+                    frames += 1
+                advance and advance(frames)
+
+        if not ret or img is None:
+            break
+
+        shape = img.shape
+        yield img
+
+
+def _split_count(source_count: Optional[int], start_frame: int, stride: int, limit: Optional[int],
+                 frame_count: Optional[int]) -> int:
+    """
+    Количество читаемых кадров видео для разбиения на части
+    :param source_count: количество кадров по параметрам файла (может быть неточным)
+    :param limit: ограничение количества читаемых кадров (None - до конца файла)
+    :param frame_count: точное количество читаемых кадров, если известно
+    """
+    count = frame_count if frame_count is not None else math.ceil(max(0, source_count - start_frame) / stride)
+    return min(count, limit) if limit is not None else count
+
+
+def _split_ranges(count: int, shard_size: int, cuts: Sequence[int],
+                  limit: Optional[int]) -> list[tuple[int, Optional[int]]]:
+    """
+    Части видео: количество кадров в файле (CAP_PROP_FRAME_COUNT) вычисляется по длительности и
+    может быть меньше действительного, поэтому последняя часть читается до конца файла
+    (если количество читаемых кадров не ограничено)
+    :return: список (первый кадр, количество кадров или None - до конца файла)
+    """
+    ranges: list[tuple[int, Optional[int]]] = list(split_at_cuts(0, count, shard_size, cuts))
+    if limit is None:
+        ranges[-1:] = [(start, None) for start, _ in ranges[-1:]]
+    return ranges
+
+
 def raise_if_path_not_existed(path: str):
     if not os.path.exists(path):
         raise ReaderError(f"Путь {path} не существует")
 
 
 class DmVideoReader(DmMediaSeekableReader):
+    """
+    Чтение видео через OpenCV. Номер текущего кадра отслеживается счетчиком прочитанных кадров.
+    Для точного перехода к кадру используется индекс опорных кадров (dmconvert.keyframes),
+    который строится при первом переходе и сохраняется рядом с видео
+    """
+
     @property
     def progress(self) -> int:
-        params = self.prepare_and_get_params()
-        return int(self._cap.get(cv2.CAP_PROP_POS_FRAMES) / params.fps)
+        """
+        Позиция чтения (сек)
+        """
+        fps = self._source_params and self._source_params.fps
+        return int(self._position / fps) if fps else 0
+
+    @property
+    def position(self) -> int:
+        return self._position
+
+    @property
+    def frame_count(self) -> int:
+        self.prepare_and_get_params()
+        return self._source_params.frame_count
 
     @staticmethod
     def display_name() -> str:
         return "Чтение видео из файла"
 
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, start_frame: int = 0, frame_count: Optional[int] = None,
+                 pool: Optional[DmFramePool] = None, backend: Optional[str] = None, threads: Optional[int] = None,
+                 hw_acceleration: bool = False, stride: int = 1, keyframe_index: bool = True):
+        """
+        :param start_frame: номер кадра, с которого начинается чтение
+        :param frame_count: количество читаемых кадров (по умолчанию - до конца файла)
+        :param pool: пул массивов для декодирования кадров (по умолчанию - общий FRAME_POOL)
+        :param backend: программный интерфейс OpenCV из VIDEO_BACKENDS (None - выбор OpenCV)
+        :param threads: количество потоков декодирования (None - значение интерфейса по умолчанию)
+        :param hw_acceleration: использовать аппаратное декодирование, если оно доступно
+        :param stride: читать каждый stride-й кадр (частота кадров результата уменьшается в stride раз)
+        :param keyframe_index: строить в фоне индекс опорных кадров для точного и быстрого перехода (seek_frame)
+        """
         raise_if_path_not_existed(file_path)
         self._source = file_path
+        self._start_frame = start_frame
+        self._frame_count = frame_count
+        self._pool = pool_or_default(pool)
+        self._backend = backend
+        self._threads = threads
+        self._hw_acceleration = hw_acceleration
+        self._stride = max(1, stride)
         self._cap: Optional[VideoCapture] = None
+        self._source_params: Optional[DmMediaParams] = None
         self._media_param: Optional[DmMediaParams] = None
+        self._position = start_frame
+        self._use_index = keyframe_index
+        self._index: Optional[DmKeyframeIndex] = None
+        self._index_thread: Optional[threading.Thread] = None
         self.lock = threading.Lock()
 
     def prepare_and_get_params(self) -> DmMediaParams:
         if not self.is_ready():
-            self._cap = cv2.VideoCapture(self._source)
-            self._media_param = _create_media_params(self._cap)
+            self._cap = _open_video(self._source, self._backend, self._threads, self._hw_acceleration)
+            self._source_params = _create_media_params(self._cap)
+            self._media_param = _stride_params(self._source_params, self._stride)
+            if self._start_frame:
+                self._cap.set(cv2.CAP_PROP_POS_FRAMES, self._start_frame)
+            self._position = self._start_frame
+            if self._use_index and self._index_thread is None:
+                self._index_thread = threading.Thread(target=self._load_keyframe_index, daemon=True,
+                                                      name="dm-keyframes")
+                self._index_thread.start()
         return self._media_param
 
     def data(self) -> Generator[npt.NDArray, any, None]:
-        while self._cap is not None and self._cap.isOpened():
-            self.lock.acquire()
-            ret, img = self._cap.read()
-            self.lock.release()
-
-            if not ret or img is None:
-                break
-
-            yield img
+        if self._cap is not None:
+            yield from islice(read_frames(self._cap, self._pool, self.lock, self._stride, self._advance),
+                              self._frame_count)
+
+    def _advance(self, frames: int):
+        self._position += frames
+
+    def skip(self, frames: int) -> bool:
+        self.prepare_and_get_params()
+        self._start_frame += frames * self._stride
+        if self._frame_count is not None:
+            self._frame_count = max(0, self._frame_count - frames)
+        self.seek_frame(self._start_frame)
+        return True
+
+    def split(self, shard_size: int, cuts: Sequence[int] = (),
+              frame_count: Optional[int] = None) -> Optional[list[partial]]:
+        self.prepare_and_get_params()
+        source_count = self._source_params.frame_count
+        if frame_count is None and (not source_count or source_count <= 0):
+            return None
+        # Номера кадров частей и склеек - в прочитанных кадрах (с учетом stride)
+        count = _split_count(source_count, self._start_frame, self._stride, self._frame_count, frame_count)
+        return [partial(DmVideoReader, self._source, start_frame=self._start_frame + start * self._stride,
+                        frame_count=shard_count, backend=self._backend, threads=self._threads,
+                        hw_acceleration=self._hw_acceleration, stride=self._stride, keyframe_index=False)
+                for start, shard_count in _split_ranges(count, shard_size, cuts, self._frame_count)]
 
     def close(self):
         self._cap and self._cap.release()
 
-    def seek(self, position_sec: int):
-        self.lock.acquire()
-        self._cap.set(cv2.CAP_PROP_POS_MSEC, position_sec * 1000)
-        self.lock.release()
+    def seek(self, position_sec: float):
+        self.prepare_and_get_params()
+        self.seek_frame(round(position_sec * (self._source_params.fps or 0)))
+
+    def seek_frame(self, frame: int):
+        self.prepare_and_get_params()
+        # Пока индекс строится, переход выполняется средствами OpenCV
+        index = self.keyframe_index()
+        with self.lock:
+            last_frame = (index.frame_count if index is not None else self._source_params.frame_count) - 1
+            frame = max(0, min(frame, last_frame)) if last_frame >= 0 else max(0, frame)
+            if index is None:
+                self._cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+                self._position = frame
+                return
+
+            # OpenCV декодирует кадры от опорного кадра, предшествующего нужному не менее чем на
+            # _OPENCV_SEEK_DELTA кадров. Если текущая позиция уже дальше этого опорного кадра,
+            # дочитать кадры вперед без перехода дешевле
+            start = index.keyframe_before(max(0, frame - _OPENCV_SEEK_DELTA))
+            if not start <= self._position <= frame:
+                # Переход к позиции, которую OpenCV декодирует от опорного кадра перед нужным,
+                # остальные кадры дочитываются вперед: номер кадра после перехода точный
+                keyframe = index.keyframe_before(frame)
+                position = min(frame, keyframe + _OPENCV_SEEK_DELTA) if keyframe else 0
+                self._cap.set(cv2.CAP_PROP_POS_FRAMES, position)
+                self._position = position
+            while self._position < frame and self._cap.grab():
+                self._position += 1
+
+    def keyframe_index(self, wait: bool = False) -> Optional[DmKeyframeIndex]:
+        """
+        Индекс опорных кадров, построенный в фоне после открытия файла
+        :param wait: дождаться построения индекса
+        :return: индекс или None, если он еще не построен или не поддерживается
+        """
+        thread = self._index_thread
+        if thread is not None and wait:
+            thread.join()
+        return self._index
+
+    def _load_keyframe_index(self):
+        try:
+            self._index = load_keyframe_index(self._source)
+        except OSError:
+            self._index = None
 
     @cached_property
     def duration(self) -> (int, int):
-        params = self.prepare_and_get_params()
-        return int(params.frame_count / params.fps)
+        self.prepare_and_get_params()
+        return int(self._source_params.frame_count / self._source_params.fps)
 
     def is_ready(self) -> bool:
         return self._cap and self._cap.isOpened()
 
 
+# Объем вывода ffmpeg, сохраняемый в тексте ошибки (символов)
+_FFMPEG_ERROR_TAIL = 2000
+
+
+class DmFfmpegReader(DmMediaReader):
+    """
+    Чтение видео внешним процессом ffmpeg: кадры передаются через канал в формате BGR.
+    Ненужные кадры отбрасываются и кадры уменьшаются в процессе ffmpeg, поэтому в программу не попадают
+    кадры полного размера: только опорные кадры (keyframes_only, остальные кадры не декодируются),
+    каждый stride-й кадр и уменьшение до заданного размера (scale).
+    Параметры видео (размер, частота кадров) определяются через OpenCV
+    """
+
+    @staticmethod
+    def display_name() -> str:
+        return "Чтение видео через ffmpeg"
+
+    def __init__(self, file_path: str, width: Optional[int] = None, height: Optional[int] = None,
+                 stride: int = 1, keyframes_only: bool = False, threads: int = 0, hwaccel: Optional[str] = None,
+                 start_frame: int = 0, frame_count: Optional[int] = None, ffmpeg: str = "ffmpeg",
+                 pool: Optional[DmFramePool] = None):
+        """
+        :param width: ширина кадров (если задана только высота - по пропорциям кадра, None - исходная)
+        :param height: высота кадров (если задана только ширина - по пропорциям кадра, None - исходная)
+        :param stride: читать каждый stride-й кадр
+        :param keyframes_only: декодировать только опорные кадры
+        :param threads: количество потоков декодирования (0 - по числу ядер)
+        :param hwaccel: способ аппаратного декодирования ffmpeg, например "auto" (None - без него)
+        :param start_frame: номер кадра, с которого начинается чтение
+        :param frame_count: количество читаемых кадров (по умолчанию - до конца файла)
+        :param ffmpeg: путь к исполняемому файлу ffmpeg
+        :param pool: пул массивов для кадров (по умолчанию - общий FRAME_POOL)
+        """
+        raise_if_path_not_existed(file_path)
+        self._source = file_path
+        self._width = width
+        self._height = height
+        self._stride = max(1, stride)
+        self._keyframes_only = keyframes_only
+        self._threads = threads
+        self._hwaccel = hwaccel
+        self._start_frame = start_frame
+        self._frame_count = frame_count
+        self._ffmpeg = ffmpeg
+        self._pool = pool_or_default(pool)
+        self._source_params: Optional[DmMediaParams] = None
+        self._media_param: Optional[DmMediaParams] = None
+        self._process: Optional[subprocess.Popen] = None
+        self._log = None
+
+    def prepare_and_get_params(self) -> DmMediaParams:
+        if self._media_param is None:
+            if shutil.which(self._ffmpeg) is None:
+                raise ReaderError(f"Не найден ffmpeg: {self._ffmpeg}")
+            cap = cv2.VideoCapture(self._source)
+            try:
+                if not cap.isOpened():
+                    raise ReaderError(f"Не удалось открыть видео: {self._source}")
+                self._source_params = _create_media_params(cap)
+            finally:
+                cap.release()
+            params = _stride_params(self._source_params, self._stride)
+            params.width, params.height = self._output_size()
+            if self._keyframes_only:
+                params.frame_count = None
+            self._media_param = params
+        return self._media_param
+
+    def is_ready(self) -> bool:
+        return self._media_param is not None
+
+    def data(self) -> Generator[npt.NDArray, any, None]:
+        params = self.prepare_and_get_params()
+        shape = (params.height, params.width, 3)
+        self._start()
+        stdout = self._process.stdout
+        frames = 0
+        while self._frame_count is None or frames < self._frame_count:
+            buffer = self._pool.get(shape)
+            if stdout.readinto(buffer.data.cast("B")) != buffer.nbytes:
+                # Конец видео или ошибка декодирования
+                if self._process.wait() != 0:
+                    raise ReaderError(f"ffmpeg завершился с ошибкой: {self._read_log()}")
+                break
+            frames += 1
+            yield buffer
+
+    def skip(self, frames: int) -> bool:
+        # Номера кадров при чтении только опорных кадров неизвестны
+        if self._keyframes_only or self._process is not None:
+            return False
+        self._start_frame += frames * self._stride
+        if self._frame_count is not None:
+            self._frame_count = max(0, self._frame_count - frames)
+        return True
+
+    def split(self, shard_size: int, cuts: Sequence[int] = (),
+              frame_count: Optional[int] = None) -> Optional[list[partial]]:
+        params = self.prepare_and_get_params()
+        # Номера опорных кадров заранее неизвестны
+        if self._keyframes_only or not (params.frame_count or frame_count) or not self._source_params.fps:
+            return None
+        count = _split_count(self._source_params.frame_count, self._start_frame, self._stride, self._frame_count,
+                             frame_count)
+        return [partial(DmFfmpegReader, self._source, self._width, self._height, self._stride, threads=self._threads,
+                        hwaccel=self._hwaccel, start_frame=self._start_frame + start * self._stride,
+                        frame_count=shard_count, ffmpeg=self._ffmpeg)
+                for start, shard_count in _split_ranges(count, shard_size, cuts, self._frame_count)]
+
+    def close(self):
+        if self._process is not None:
+            process, self._process = self._process, None
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def _output_size(self) -> tuple[int, int]:
+        width, height = self._source_params.width, self._source_params.height
+        if self._width and self._height:
+            return self._width, self._height
+        if self._width:
+            # Четная высота, как у фильтра scale с параметром -2
+            return self._width, max(2, round(height * self._width / width / 2) * 2)
+        if self._height:
+            return max(2, round(width * self._height / height / 2) * 2), self._height
+        return width, height
+
+    def _command(self) -> list[str]:
+        params = self._media_param
+        command = [self._ffmpeg, "-hide_banner", "-loglevel", "error", "-nostdin"]
+        if self._keyframes_only:
+            command += ["-skip_frame", "nokey"]
+        command += ["-threads", str(self._threads)]
+        if self._hwaccel:
+            command += ["-hwaccel", self._hwaccel]
+        if self._start_frame and self._source_params.fps:
+            # Переход к середине интервала между предыдущим и нужным кадром: ffmpeg отбрасывает кадры
+            # до этого времени, поэтому первым читается ровно start_frame и округление времени
+            # (или неточная частота кадров) не приводит к повтору или пропуску кадра на границе частей
+            command += ["-ss", f"{(self._start_frame - 0.5) / self._source_params.fps:.6f}"]
+        command += ["-i", self._source]
+
+        filters = []
+        if self._stride > 1:
+            filters.append(f"select=not(mod(n\\,{self._stride}))")
+        if (params.width, params.height) != (self._source_params.width, self._source_params.height):
+            filters.append(f"scale={params.width}:{params.height}:flags=area")
+        if filters:
+            command += ["-vf", ",".join(filters)]
+        if self._frame_count is not None:
+            command += ["-frames:v", str(self._frame_count)]
+        # Кадры передаются без повторов и пропусков для выравнивания частоты кадров
+        return command + ["-vsync", "0", "-f", "rawvideo", "-pix_fmt", "bgr24", "-"]
+
+    def _start(self):
+        self.close()
+        # Вывод ffmpeg сохраняется во временный файл: канал мог бы заполниться и остановить ffmpeg
+        self._log = tempfile.TemporaryFile()
+        try:
+            self._process = subprocess.Popen(self._command(), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                             stderr=self._log)
+        except OSError as e:
+            raise ReaderError(f"Не удалось запустить ffmpeg: {e}") from e
+
+    def _read_log(self) -> str:
+        if self._log is None:
+            return ""
+        self._log.seek(0)
+        return self._log.read().decode(errors="replace")[-_FFMPEG_ERROR_TAIL:].strip()
+
+
 class DmCameraReader(DmMediaReader):
     @staticmethod
     def display_name() -> str:
         return "Чтение видеопотока с камеры"
 
-    def __init__(self, cam_number: str):
+    def __init__(self, cam_number: str, pool: Optional[DmFramePool] = None):
+        """
+        :param pool: пул массивов для декодирования кадров (по умолчанию - общий FRAME_POOL)
+        """
         self._source = int(cam_number)
+        self._pool = pool_or_default(pool)
         self._cap: Optional[VideoCapture] = None
         self._media_param: Optional[DmMediaParams] = None
 
@@ -92,13 +489,8 @@ class DmCameraReader(DmMediaReader):
         return self._media_param
 
     def data(self) -> Generator[npt.NDArray, any, None]:
-        while self._cap is not None and self._cap.isOpened():
-            ret, img = self._cap.read()
-
-            if not ret or img is None:
-                break
-
-            yield img
+        if self._cap is not None:
+            yield from read_frames(self._cap, self._pool)
 
     def close(self):
         self._cap and self._cap.release()
@@ -112,19 +504,253 @@ class DmImagesReader(DmMediaReader):
     def display_name() -> str:
         return "Чтение изображений из директории"
 
-    def __init__(self, directory: str):
+    def __init__(self, directory: str, files: Optional[list[str]] = None):
+        """
+        :param files: список файлов для чтения (по умолчанию - все файлы директории)
+        """
         raise_if_path_not_existed(directory)
         self._directory = directory
+        self._selected_files = files
         self._files: Optional[list[str]] = None
 
     def prepare_and_get_params(self) -> DmMediaParams:
-        self._files = glob.glob(os.path.join(self._directory, "*"))
+        if self._selected_files is not None:
+            self._files = list(self._selected_files)
+        else:
+            self._files = glob.glob(os.path.join(self._directory, "*"))
         return DmMediaParams(
             frame_count=len(self._files)
         )
 
     def data(self) -> Generator[npt.NDArray, any, None]:
-        return (cv2.imread(file) for file in self._files)
+        return (self.read_file(file) for file in self._files)
 
     def is_ready(self) -> bool:
         return self._files and len(self._files) != 0
+
+    @property
+    def files(self) -> Optional[list[str]]:
+        return self._files
+
+    def skip(self, frames: int) -> bool:
+        if self._files is None:
+            return False
+        self._files = self._files[frames:]
+        return True
+
+    def split(self, shard_size: int, cuts: Sequence[int] = (),
+              frame_count: Optional[int] = None) -> Optional[list[partial]]:
+        # Количество файлов известно точно
+        if self._files is None:
+            self.prepare_and_get_params()
+        return [partial(DmImagesReader, self._directory, files=self._files[start:start + count])
+                for start, count in split_at_cuts(0, len(self._files), shard_size, cuts)]
+
+    @staticmethod
+    def read_file(file: str) -> Optional[npt.NDArray]:
+        return cv2.imread(file)
+
+
+# Маркер окончания данных в очереди предварительной загрузки
+_END = object()
+
+
+class DmPrefetchReader(DmMediaReader):
+    """
+    Обертка над любым источником: кадры декодируются заранее в фоновом потоке и складываются
+    в ограниченную очередь. Изображения из директории декодируются пулом потоков (cv2 освобождает GIL)
+    """
+
+    @staticmethod
+    def display_name() -> str:
+        return "Чтение с предварительной загрузкой"
+
+    def __init__(self, reader: DmMediaReader, queue_size: int = 8, workers: Optional[int] = None):
+        """
+        :param reader: источник кадров
+        :param queue_size: максимальное количество заранее декодированных кадров
+        :param workers: количество потоков для декодирования изображений (по умолчанию - по числу ядер)
+        """
+        self._reader = reader
+        self._queue_size = max(1, queue_size)
+        self._workers = workers or os.cpu_count()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+
+    @property
+    def reader(self) -> DmMediaReader:
+        return self._reader
+
+    def is_ready(self) -> bool:
+        return self._reader.is_ready()
+
+    def prepare_and_get_params(self) -> DmMediaParams:
+        return self._reader.prepare_and_get_params()
+
+    def skip(self, frames: int) -> bool:
+        return self._reader.skip(frames)
+
+    def split(self, shard_size: int, cuts: Sequence[int] = (),
+              frame_count: Optional[int] = None) -> Optional[list[partial]]:
+        return self._reader.split(shard_size, cuts, frame_count)
+
+    @property
+    def dropped_frames(self) -> int:
+        return self._reader.dropped_frames
+
+    def data(self) -> Generator[npt.NDArray, any, None]:
+        frames = queue.Queue(self._queue_size)
+        self._stop.clear()
+        self._error = None
+        self._thread = threading.Thread(target=self._prefetch, args=(frames,), name="dm-prefetch", daemon=True)
+        self._thread.start()
+
+        try:
+            while True:
+                try:
+                    img = frames.get(timeout=0.1)
+                except queue.Empty:
+                    if self._stop.is_set():
+                        break
+                    continue
+                if img is _END:
+                    break
+                yield img
+        finally:
+            self._stop.set()
+            self._thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._reader.close()
+
+    def _prefetch(self, frames: queue.Queue):
+        try:
+            if isinstance(self._reader, DmImagesReader):
+                source = self._decode_in_pool(self._reader.files or [])
+            else:
+                source = self._reader.data()
+
+            for img in source:
+                if not self._put(frames, img):
+                    break
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._put(frames, _END)
+
+    def _decode_in_pool(self, files: list[str]) -> Generator[npt.NDArray, any, None]:
+        pool = ThreadPoolExecutor(self._workers, thread_name_prefix="dm-decode")
+        pending = deque()
+        try:
+            for file in files:
+                if self._stop.is_set():
+                    break
+                pending.append(pool.submit(DmImagesReader.read_file, file))
+                if len(pending) >= self._queue_size:
+                    yield pending.popleft().result()
+            while pending and not self._stop.is_set():
+                yield pending.popleft().result()
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _put(self, frames: queue.Queue, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+
+class DmLatestFrameReader(DmMediaReader):
+    """
+    Обертка над источником реального времени (камерой): фоновый поток непрерывно забирает кадры,
+    не давая им накапливаться в буфере захвата, а конвертер всегда получает самый новый кадр.
+    Кадры, замененные более новыми до обработки, пропускаются и учитываются в dropped_frames,
+    поэтому задержка изображения не растет, даже если обработка медленнее камеры
+    """
+
+    @staticmethod
+    def display_name() -> str:
+        return "Чтение последнего кадра в реальном времени"
+
+    def __init__(self, reader: DmMediaReader):
+        self._reader = reader
+        self._condition = threading.Condition()
+        self._frame: Optional[npt.NDArray] = None
+        self._ended = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+        self._dropped = 0
+
+    @property
+    def reader(self) -> DmMediaReader:
+        return self._reader
+
+    @property
+    def dropped_frames(self) -> int:
+        return self._dropped
+
+    def is_ready(self) -> bool:
+        return self._reader.is_ready()
+
+    def prepare_and_get_params(self) -> DmMediaParams:
+        return self._reader.prepare_and_get_params()
+
+    def data(self) -> Generator[npt.NDArray, any, None]:
+        self._stop.clear()
+        self._frame = None
+        self._ended = False
+        self._error = None
+        self._dropped = 0
+        self._thread = threading.Thread(target=self._grab, name="dm-grab", daemon=True)
+        self._thread.start()
+
+        try:
+            while True:
+                with self._condition:
+                    while self._frame is None and not self._ended and not self._stop.is_set():
+                        self._condition.wait(0.1)
+                    img, self._frame = self._frame, None
+                if img is None:
+                    break
+                yield img
+        finally:
+            self._stop.set()
+            self._thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._reader.close()
+
+    def _grab(self):
+        try:
+            for img in self._reader.data():
+                with self._condition:
+                    if self._frame is not None:
+                        self._dropped += 1
+                        release(self._frame)
+                    self._frame = img
+                    self._condition.notify()
+                if self._stop.is_set():
+                    break
+        except BaseException as e:
+            self._error = e
+        finally:
+            with self._condition:
+                self._ended = True
+                self._condition.notify()
@@ -0,0 +1,127 @@
+from typing import Optional, Sequence
+
+import cv2
+import numpy as np
+import numpy.typing as npt
+
+HISTOGRAM = "histogram"
+THUMBNAIL = "thumbnail"
+
+# Порог по умолчанию: доля гистограммы, изменившейся между кадрами, или средняя разница уменьшенных кадров
+_DEFAULT_THRESHOLDS = {HISTOGRAM: 0.4, THUMBNAIL: 0.12}
+
+# Количество интервалов гистограммы каждого канала
+_HISTOGRAM_BINS = 16
+
+
+class DmSceneCutDetector:
+    """
+    Определение смены сцены (монтажной склейки) по уменьшенной копии кадра: сравниваются
+    гистограммы цветов (устойчиво к движению в кадре) или сами уменьшенные кадры.
+    Склейка - кадр, сильно отличающийся от предыдущего; после склейки следующая определяется
+    не раньше, чем через min_scene_length кадров (вспышки и быстрое движение камеры)
+    """
+
+    def __init__(self, method: str = HISTOGRAM, threshold: Optional[float] = None, min_scene_length: int = 8,
+                 thumb_width: int = 64):
+        """
+        :param method: способ сравнения кадров: HISTOGRAM или THUMBNAIL
+        :param threshold: порог отличия кадров в диапазоне 0..1 (None - значение по умолчанию для способа)
+        :param min_scene_length: минимальное количество кадров между склейками
+        :param thumb_width: ширина уменьшенной копии кадра
+        """
+        if method not in _DEFAULT_THRESHOLDS:
+            raise ValueError(f"Неизвестный способ определения смены сцены: {method}")
+        self._method = method
+        self._threshold = _DEFAULT_THRESHOLDS[method] if threshold is None else threshold
+        self._min_scene_length = max(1, min_scene_length)
+        self._thumb_width = thumb_width
+        self.reset()
+
+    def reset(self):
+        self._previous: Optional[npt.NDArray] = None
+        self._since_cut = 0
+
+    @property
+    def last_signature(self) -> Optional[npt.NDArray]:
+        """
+        Признаки последнего проверенного кадра
+        """
+        return self._previous
+
+    def __call__(self, img: npt.NDArray) -> bool:
+        """
+        :return: True, если кадр начинает новую сцену (первый кадр после reset - не склейка)
+        """
+        signature = self.signature(img)
+        is_cut = self._previous is not None and self._since_cut >= self._min_scene_length and \
+            self.is_different(self._previous, signature)
+        self._previous = signature
+        self._since_cut = 1 if is_cut else self._since_cut + 1
+        return is_cut
+
+    def signature(self, img: npt.NDArray) -> npt.NDArray:
+        """
+        Признаки кадра для сравнения: нормированная гистограмма или уменьшенная копия кадра
+        """
+        height, width = img.shape[:2]
+        thumb_width = min(width, self._thumb_width)
+        size = (thumb_width, max(1, round(height * thumb_width / width)))
+        thumb = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+        if self._method == THUMBNAIL:
+            return thumb.astype(np.float32) / 255
+
+        channels = 1 if thumb.ndim == 2 else thumb.shape[2]
+        histogram = np.concatenate([cv2.calcHist([thumb], [c], None, [_HISTOGRAM_BINS], [0, 256])
+                                    for c in range(channels)]).ravel()
+        return histogram / (thumb.shape[0] * thumb.shape[1] * channels)
+
+    def distance(self, first: npt.NDArray, second: npt.NDArray) -> float:
+        """
+        Отличие кадров по признакам в диапазоне 0..1
+        """
+        if first.shape != second.shape:
+            return 1.0
+        if self._method == THUMBNAIL:
+            return float(cv2.norm(first, second, cv2.NORM_L1)) / first.size
+        return float(np.abs(first - second).sum()) / 2
+
+    def is_different(self, first: npt.NDArray, second: npt.NDArray) -> bool:
+        """
+        Относятся ли кадры с указанными признаками к разным сценам
+        """
+        return self.distance(first, second) > self._threshold
+
+    def find_cuts(self, frames) -> list[int]:
+        """
+        Номера кадров, начинающих новую сцену
+        """
+        self.reset()
+        return [i for i, img in enumerate(frames) if self(img)]
+
+
+def split_at_cuts(start: int, end: int, shard_size: int, cuts: Sequence[int] = ()) -> list[tuple[int, int]]:
+    """
+    Разбивает диапазон кадров [start, end) на части примерно по shard_size кадров.
+    Граница части переносится на ближайшую склейку, если та находится в пределах половины размера части,
+    поэтому размер части - от 1/2 до 3/2 shard_size
+    :param cuts: номера кадров, начинающих новую сцену, по возрастанию
+    :return: список (первый кадр, количество кадров)
+    """
+    shard_size = max(1, shard_size)
+    cuts = [cut for cut in cuts if start < cut < end]
+    ranges = []
+    position = start
+    while position < end:
+        target = position + shard_size
+        if target >= end:
+            ranges.append((position, end - position))
+            break
+        low = position + max(1, shard_size // 2)
+        high = target + shard_size // 2
+        nearby = [cut for cut in cuts if low <= cut <= high]
+        boundary = min(nearby, key=lambda cut: abs(cut - target)) if nearby else target
+        boundary = min(boundary, end)
+        ranges.append((position, boundary - position))
+        position = boundary
+    return ranges
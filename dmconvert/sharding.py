@@ -0,0 +1,228 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Callable, Optional, Sequence
+
+import numpy.typing as npt
+
+from .buffers import release, release_replaced
+from .converter import DmMediaConverter, DmMediaReader
+from .scenes import DmSceneCutDetector, split_at_cuts
+from .threads import DmThreadConfig, apply_thread_config, current_thread_config
+from depthmap_wrappers.base import BaseDmWrapper
+from depthmap_wrappers.models import Model
+
+# Состояние процесса-обработчика: своя копия модели, пре- и постпроцессоров
+_worker_wrapper: Optional[BaseDmWrapper] = None
+_worker_preprocessors: list[Callable[[npt.NDArray], npt.NDArray]] = []
+_worker_postprocessors: list[Callable[[npt.NDArray, npt.NDArray], tuple[npt.NDArray, npt.NDArray]]] = []
+_worker_batch_size = 1
+_worker_scene_detector: Optional[DmSceneCutDetector] = None
+
+# Результат обработки кадра части: кадр и карта глубины после постпроцессоров
+ShardFrame = tuple[npt.NDArray, npt.NDArray]
+
+
+def _init_worker(wrapper: BaseDmWrapper, model: Model,
+                 preprocessors: list[Callable[[npt.NDArray], npt.NDArray]],
+                 postprocessors: list[Callable[[npt.NDArray, npt.NDArray], tuple[npt.NDArray, npt.NDArray]]],
+                 batch_size: int, threads: DmThreadConfig, scene_detector: Optional[DmSceneCutDetector]):
+    global _worker_wrapper, _worker_preprocessors, _worker_postprocessors, _worker_batch_size, \
+        _worker_scene_detector
+    apply_thread_config(threads)
+    _worker_wrapper = wrapper
+    _worker_wrapper.prepare_model(model)
+    _worker_preprocessors = preprocessors
+    _worker_postprocessors = postprocessors
+    _worker_batch_size = batch_size
+    _worker_scene_detector = scene_detector
+
+
+def _scan_shard(reader_factory: Callable[[], DmMediaReader]) -> tuple[int, list[int], Optional[npt.NDArray],
+                                                                       Optional[npt.NDArray]]:
+    """
+    Ищет смены сцены в части источника
+    :return: количество кадров, номера кадров новых сцен внутри части,
+    признаки первого и последнего кадров (для проверки смены сцены на границе частей)
+    """
+    reader = reader_factory()
+    reader.prepare_and_get_params()
+    _worker_scene_detector.reset()
+    count = 0
+    cuts = []
+    first = None
+    try:
+        for img in reader.data():
+            if _worker_scene_detector(img):
+                cuts.append(count)
+            if count == 0:
+                first = _worker_scene_detector.last_signature
+            count += 1
+            release(img)
+    finally:
+        reader.close()
+    return count, cuts, first, _worker_scene_detector.last_signature
+
+
+def _reset_postprocessors():
+    for postprocessor in _worker_postprocessors:
+        reset = getattr(postprocessor, "reset", None)
+        if reset is not None:
+            reset()
+
+
+def _postprocess(img: npt.NDArray, dm: npt.NDArray) -> ShardFrame:
+    for postprocessor in _worker_postprocessors:
+        new_img, new_dm = postprocessor(img, dm)
+        release_replaced(img, new_img, new_dm)
+        if dm is not img:
+            release_replaced(dm, new_img, new_dm)
+        img, dm = new_img, new_dm
+    return img, dm
+
+
+def _convert_shard(reader_factory: Callable[[], DmMediaReader], cuts: Sequence[int] = ()) -> list[ShardFrame]:
+    """
+    Обрабатывает кадры части целиком: препроцессоры, нейронная сеть и постпроцессоры.
+    Состояние загрузчика и постпроцессоров сбрасывается в начале части и на сменах сцены
+    :param cuts: номера кадров части, начинающих новую сцену
+    :return: готовые к записи кадры и карты глубины в порядке кадров части
+    """
+    reader = reader_factory()
+    reader.prepare_and_get_params()
+    _worker_wrapper.reset_state()
+    _reset_postprocessors()
+    cuts = set(cuts)
+    result = []
+    batch = []
+
+    def process_batch():
+        start = len(result)
+        if start in cuts:
+            _worker_wrapper.reset_state()
+        dms = _worker_wrapper.process_batch(batch) if len(batch) > 1 else [_worker_wrapper.process(batch[0])]
+        for i, (img, dm) in enumerate(zip(batch, dms)):
+            if start + i in cuts:
+                _reset_postprocessors()
+            # Готовые кадры передаются в основной процесс и в пул не возвращаются
+            result.append(_postprocess(img, dm))
+        batch.clear()
+
+    try:
+        for img in reader.data():
+            for preprocessor in _worker_preprocessors:
+                processed = preprocessor(img)
+                release_replaced(img, processed)
+                img = processed
+            # Кадр новой сцены начинает новый пакет
+            if batch and len(result) + len(batch) in cuts:
+                process_batch()
+            batch.append(img)
+            if len(batch) >= _worker_batch_size:
+                process_batch()
+        if batch:
+            process_batch()
+    finally:
+        reader.close()
+    return result
+
+
+class DmShardedMediaConverter(DmMediaConverter):
+    """
+    Конвертер, разбивающий источник на части (по списку файлов или диапазонам кадров видео)
+    и обрабатывающий их пулом процессов, каждый из которых загружает свою копию модели.
+    Процессы выполняют препроцессоры, нейронную сеть и постпроцессоры и возвращают готовые кадры
+    с картами глубины, основной процесс только записывает их в исходном порядке кадров.
+    Состояние постпроцессоров (например, окно усреднения карт глубины) сбрасывается в начале каждой части.
+    Количество частей в работе ограничено, поэтому в памяти хранятся кадры не более чем workers + 1 частей.
+    Загрузчик модели (до загрузки), пре- и постпроцессоры передаются в процессы, поэтому при запуске процессов
+    через spawn (Windows) они должны сериализоваться pickle (например, functools.partial вместо lambda).
+    Потоки вычислений, не заданные явно (dmconvert.threads), делятся между процессами поровну.
+    Если задано определение смены сцены, источник сначала просматривается процессами целиком,
+    и границы частей переносятся на ближайшие смены сцены
+    """
+
+    def __init__(self, model: Model, reader: DmMediaReader, model_loader: BaseDmWrapper, batch_size: int = 1,
+                 workers: Optional[int] = None, shard_size: int = 32):
+        """
+        :param workers: количество процессов (по умолчанию - по числу ядер)
+        :param shard_size: количество кадров в одной части
+        """
+        super().__init__(model, reader, model_loader, batch_size)
+        self._workers = workers or os.cpu_count()
+        self._shard_size = max(1, shard_size)
+        self._shards: Optional[list[Callable[[], DmMediaReader]]] = None
+
+    def _prepare_model(self):
+        self._shards = self._reader.split(self._shard_size)
+        # Источник без поддержки разбиения (камера) обрабатывается в текущем процессе
+        if self._shards is None:
+            super()._prepare_model()
+
+    def _convert(self):
+        if self._shards is None:
+            super()._convert()
+            return
+
+        threads = current_thread_config().for_workers(self._workers)
+        executor = ProcessPoolExecutor(self._workers, initializer=_init_worker,
+                                       initargs=(self._wrapper, self._model, self.preprocessors,
+                                                 self.postprocessors, self._batch_size, threads,
+                                                 self.scene_detector))
+        # Ограничение количества частей в работе, чтобы результаты не накапливались в памяти
+        pending: deque[Future] = deque()
+        try:
+            shards = [(shard, ()) for shard in self._shards]
+            if self.scene_detector is not None:
+                shards = self._split_at_cuts(executor)
+
+            for shard, cuts in shards:
+                if not self._is_running:
+                    break
+                pending.append(executor.submit(_convert_shard, shard, cuts))
+                if len(pending) > self._workers:
+                    self._write_shard(self._wait_shard(pending))
+
+            while pending and self._is_running:
+                self._write_shard(self._wait_shard(pending))
+            self._completed = self._is_running
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _split_at_cuts(self, executor: ProcessPoolExecutor) -> list[tuple[Callable[[], DmMediaReader], list[int]]]:
+        """
+        Находит смены сцены во всем источнике и разбивает его заново с границами частей на сменах сцены
+        :return: фабрики источников частей и номера кадров новых сцен внутри каждой части
+        """
+        cuts = []
+        total = 0
+        previous = None
+        with self.stats.measure("scene"):
+            for count, shard_cuts, first, last in executor.map(_scan_shard, self._shards):
+                if previous is not None and first is not None and self.scene_detector.is_different(previous, first):
+                    cuts.append(total)
+                cuts.extend(total + cut for cut in shard_cuts)
+                total += count
+                previous = last if last is not None else previous
+        self.stats.scene_cuts = len(cuts)
+
+        # Количество кадров после просмотра известно точно
+        shards = self._reader.split(self._shard_size, cuts, total)
+        ranges = split_at_cuts(0, total, self._shard_size, cuts)
+        return [(shard, [cut - start for cut in cuts if start <= cut < start + count])
+                for shard, (start, count) in zip(shards, ranges)]
+
+    def _wait_shard(self, pending: deque[Future]) -> list[ShardFrame]:
+        self.stats.record_queue("shards", len(pending))
+        # Время ожидания результата части - это время, на которое запись ожидает процессы
+        start = time.perf_counter()
+        frames = pending.popleft().result()
+        self.stats.add("process", time.perf_counter() - start, len(frames))
+        return frames
+
+    def _write_shard(self, frames: list[ShardFrame]):
+        for img, dm in frames:
+            if not self._is_running:
+                break
+            self._write(img, dm)
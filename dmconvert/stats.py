@@ -0,0 +1,211 @@
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Этапы, выполняемые не для каждого кадра (не учитываются при поиске медленного этапа)
+SETUP_STAGES = ("load_model", "checkpoint")
+
+# Границы интервалов гистограммы задержки этапов (мс)
+LATENCY_BUCKETS_MS = (1, 2, 3, 5, 7, 10, 15, 20, 30, 50, 70, 100, 150, 200, 300, 500, 700, 1000, 2000, 5000)
+
+
+@dataclass
+class DmStageStats:
+    name: str
+    frames: int = 0
+    total: float = 0.0
+    min: float = float("inf")
+    max: float = 0.0
+    # Количество кадров в интервалах LATENCY_BUCKETS_MS, последний элемент - свыше последней границы
+    histogram: list[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))
+
+    def add(self, seconds: float, frames: int = 1):
+        per_frame = seconds / frames
+        self.frames += frames
+        self.total += seconds
+        self.min = min(self.min, per_frame)
+        self.max = max(self.max, per_frame)
+        self.histogram[bisect_left(LATENCY_BUCKETS_MS, per_frame * 1000)] += frames
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.frames if self.frames else 0.0
+
+    def percentile(self, q: float) -> float:
+        """
+        Оценка перцентиля задержки кадра (сек) по гистограмме - верхняя граница интервала
+        """
+        if not self.frames:
+            return 0.0
+        threshold = q / 100 * self.frames
+        count = 0
+        for i, bucket in enumerate(self.histogram):
+            count += bucket
+            if count >= threshold:
+                return LATENCY_BUCKETS_MS[i] / 1000 if i < len(LATENCY_BUCKETS_MS) else self.max
+        return self.max
+
+
+@dataclass
+class DmQueueStats:
+    name: str
+    last: int = 0
+    max: int = 0
+    total: int = 0
+    samples: int = 0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.samples if self.samples else 0.0
+
+
+def _memory_usage() -> Optional[int]:
+    """
+    Текущий объем памяти процесса (байт); если он недоступен - пиковый, если и он недоступен - None
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux возвращает КБ, macOS - байты
+        return peak if sys.platform == "darwin" else peak * 1024
+    return None
+
+
+class DmConverterStats:
+    """
+    Статистика работы конвертера: задержки этапов, количество кадров в секунду,
+    заполненность очередей между этапами и пиковый объем памяти за запуск
+    """
+
+    def __init__(self, update_interval: float = 1.0):
+        """
+        :param update_interval: период вызова on_update (сек)
+        """
+        self.on_update: Optional[Callable[["DmConverterStats"], None]] = None
+        self._update_interval = update_interval
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages: dict[str, DmStageStats] = {}
+            self.queues: dict[str, DmQueueStats] = {}
+            self.frames = 0
+            # Кадры, пропущенные источником (режим реального времени)
+            self.dropped = 0
+            # Найденные смены сцены
+            self.scene_cuts = 0
+            self.peak_memory: Optional[int] = None
+            self._started = time.perf_counter()
+            self._finished: Optional[float] = None
+            self._last_update = self._started
+
+    def finish(self):
+        self._finished = time.perf_counter()
+        self._sample_memory()
+        self.on_update and self.on_update(self)
+
+    @property
+    def elapsed(self) -> float:
+        return (self._finished or time.perf_counter()) - self._started
+
+    @property
+    def fps(self) -> float:
+        elapsed = self.elapsed
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+    @contextmanager
+    def measure(self, stage: str, frames: int = 1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, frames)
+
+    def add(self, stage: str, seconds: float, frames: int = 1):
+        if frames <= 0:
+            return
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = DmStageStats(stage)
+            stats.add(seconds, frames)
+
+    def record_queue(self, name: str, depth: int):
+        with self._lock:
+            stats = self.queues.get(name)
+            if stats is None:
+                stats = self.queues[name] = DmQueueStats(name)
+            stats.last = depth
+            stats.max = max(stats.max, depth)
+            stats.total += depth
+            stats.samples += 1
+
+    def frame_done(self):
+        with self._lock:
+            self.frames += 1
+        self._sample_memory()
+
+        now = time.perf_counter()
+        if self.on_update is not None and now - self._last_update >= self._update_interval:
+            self._last_update = now
+            self.on_update(self)
+
+    def _sample_memory(self):
+        memory = _memory_usage()
+        if memory is not None:
+            self.peak_memory = max(self.peak_memory or 0, memory)
+
+    @property
+    def slowest_stage(self) -> Optional[DmStageStats]:
+        stages = [s for s in self.stages.values() if s.name not in SETUP_STAGES]
+        return max(stages, key=lambda s: s.mean) if stages else None
+
+    def short_summary(self) -> str:
+        text = f"{self.fps:.1f} кадр/с"
+        if self.dropped:
+            text += f", пропущено кадров: {self.dropped}"
+        if self.scene_cuts:
+            text += f", смен сцены: {self.scene_cuts}"
+        slowest = self.slowest_stage
+        if slowest is not None:
+            text += f", медленный этап: {slowest.name} ({slowest.mean * 1000:.1f} мс/кадр)"
+        return text
+
+    def summary(self) -> str:
+        """
+        Подробная сводка для командной строки (на английском, как остальной вывод main.py);
+        интерфейс показывает short_summary
+        """
+        lines = [f"Frames: {self.frames}, time: {self.elapsed:.2f} s, FPS: {self.fps:.2f}"]
+        if self.dropped:
+            lines.append(f"Dropped frames: {self.dropped}")
+        if self.scene_cuts:
+            lines.append(f"Scene cuts: {self.scene_cuts}")
+        if self.peak_memory is not None:
+            lines.append(f"Peak memory: {self.peak_memory / 2 ** 20:.0f} MB")
+
+        lines.append(f"{'stage':<14}{'frames':>8}{'mean ms':>10}{'min ms':>10}{'p50 ms':>10}{'p95 ms':>10}"
+                     f"{'max ms':>10}{'total s':>10}")
+        for s in self.stages.values():
+            lines.append(f"{s.name:<14}{s.frames:>8}{s.mean * 1000:>10.2f}{s.min * 1000:>10.2f}"
+                         f"{s.percentile(50) * 1000:>10.0f}{s.percentile(95) * 1000:>10.0f}{s.max * 1000:>10.2f}"
+                         f"{s.total:>10.2f}")
+
+        for q in self.queues.values():
+            lines.append(f"queue {q.name}: mean {q.mean:.1f}, max {q.max}")
+        return "\n".join(lines)
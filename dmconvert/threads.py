@@ -0,0 +1,122 @@
+"""
+    Управление количеством потоков вычислений.
+    torch, OpenCV и numba по умолчанию используют все ядра процессора и при одновременной работе
+    (например, в этапах DmPipelinedMediaConverter) вытесняют друг друга.
+    Количество потоков torch и OpenCV задается для всего процесса, numba - для каждого потока отдельно,
+    поэтому ограничения этапов конвейера применяются в потоках этапов (apply_stage_threads)
+"""
+import os
+from dataclasses import dataclass, field, replace
+from typing import Optional
+
+import cv2
+import numba
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+
+@dataclass
+class DmThreadConfig:
+    # Потоки внутри операций torch (None - значение библиотеки по умолчанию)
+    torch_threads: Optional[int] = None
+    # Потоки для параллельного выполнения операций torch
+    interop_threads: Optional[int] = None
+    # Потоки OpenCV (0 - без распараллеливания)
+    opencv_threads: Optional[int] = None
+    # Потоки ядер numba (постпроцессоры)
+    numba_threads: Optional[int] = None
+    # Номера ядер процессора, на которых выполняется процесс (None - все)
+    affinity: Optional[list[int]] = None
+    # Потоки отдельных этапов конвейера ("read", "process", "postprocess")
+    stages: dict[str, int] = field(default_factory=dict)
+
+    def for_workers(self, workers: int) -> "DmThreadConfig":
+        """
+        Настройки для одного из workers процессов, работающих одновременно:
+        не заданные явно количества потоков делят доступные ядра поровну между процессами
+        """
+        share = max(1, cpu_count() // max(1, workers))
+        return replace(self,
+                       torch_threads=self.torch_threads or share,
+                       interop_threads=self.interop_threads or 1,
+                       opencv_threads=self.opencv_threads if self.opencv_threads is not None else share,
+                       numba_threads=self.numba_threads or share,
+                       stages={})
+
+
+# Настройки, примененные apply_thread_config
+_config = DmThreadConfig()
+
+
+def cpu_count() -> int:
+    """
+    Количество ядер, доступных процессу (с учетом привязки к ядрам)
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def parse_cpu_list(value: str) -> list[int]:
+    """
+    Разбирает список ядер вида "0-7,16,18-19"
+    """
+    cpus = []
+    for part in value.split(","):
+        first, _, last = part.strip().partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def set_numba_threads(threads: int):
+    """
+    Задает количество потоков numba для вызывающего потока
+    (не больше количества потоков, запущенных numba - NUMBA_NUM_THREADS)
+    """
+    numba.set_num_threads(max(1, min(threads, numba.config.NUMBA_NUM_THREADS)))
+
+
+def apply_thread_config(config: DmThreadConfig):
+    """
+    Применяет настройки потоков к текущему процессу и сохраняет их для apply_stage_threads
+    """
+    global _config
+    _config = config
+
+    if config.affinity and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, config.affinity)
+    if torch is not None:
+        if config.torch_threads:
+            torch.set_num_threads(config.torch_threads)
+        if config.interop_threads:
+            try:
+                torch.set_num_interop_threads(config.interop_threads)
+            except RuntimeError:
+                # Может быть задано только до первого параллельного вызова torch в процессе
+                pass
+    if config.opencv_threads is not None:
+        cv2.setNumThreads(config.opencv_threads)
+    if config.numba_threads:
+        set_numba_threads(config.numba_threads)
+
+
+def current_thread_config() -> DmThreadConfig:
+    return _config
+
+
+def apply_stage_threads(stage: Optional[str] = None):
+    """
+    Применяет ограничение потоков этапа к вызывающему потоку.
+    Потоки numba задаются для вызывающего потока, потоки torch - для этапа "process",
+    в котором выполняется нейронная сеть; без ограничения этапа используются общие настройки
+    :param stage: название этапа или None для последовательной конвертации
+    """
+    threads = _config.stages.get(stage) if stage is not None else None
+    numba_threads = threads or _config.numba_threads
+    if numba_threads:
+        set_numba_threads(numba_threads)
+    if threads and stage == "process" and torch is not None:
+        torch.set_num_threads(threads)
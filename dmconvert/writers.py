@@ -1,14 +1,42 @@
 import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
 from dataclasses import dataclass
-from typing import Optional, Callable
+from typing import Optional, Callable, Sequence
 
 import cv2
 import numpy as np
 from numpy import typing as npt
-from .converter import DmMediaWriter, DmMediaParams
+from .buffers import retain, release
+from .converter import DmMediaWriter, DmMediaParams, DmMediaIndexedWriter, WriterError
+
+# Варианты расположения изображений при записи объединенного кадра
+CONCAT_TOP_BOTTOM = "top-bottom"
+CONCAT_SIDE_BY_SIDE = "side-by-side"
+
+
+# Дополнительные варианты расположения для записи видео через ffmpeg
+LAYOUT_COLOR = "color"
+LAYOUT_DEPTH = "depth"
+LAYOUT_ALPHA = "alpha"
+FFMPEG_LAYOUTS = (LAYOUT_COLOR, LAYOUT_DEPTH, CONCAT_SIDE_BY_SIDE, CONCAT_TOP_BOTTOM, LAYOUT_ALPHA)
+
+# Частота кадров, если источник ее не сообщает (изображения из директории)
+_DEFAULT_FPS = 25
+
+# Объем вывода ffmpeg, сохраняемый в тексте ошибки (символов)
+_FFMPEG_ERROR_TAIL = 2000
 
 
 class DmVideoWriter(DmMediaWriter):
+    """
+    Запись видео через OpenCV. Файл открывается при записи первого кадра: размер кадра после
+    препроцессоров (например, уменьшения) может отличаться от размера кадров источника
+    """
+
     @staticmethod
     def display_name() -> str:
         return "Запись видеофайла"
@@ -16,62 +44,298 @@ class DmVideoWriter(DmMediaWriter):
     def __init__(self, file_name: str, codec: str = 'mp4v'):
         self._file_name = file_name
         self._codec = codec
+        self._fps = _DEFAULT_FPS
         self._cap: Optional[cv2.VideoWriter] = None
+        self._frame_size: Optional[tuple[int, int]] = None
 
     def prepare(self, media_params: DmMediaParams):
-        fourcc = cv2.VideoWriter_fourcc(*self._codec)
-        self._cap = cv2.VideoWriter(self._file_name, fourcc, media_params.fps,
-                                    (media_params.width, media_params.height))
+        self._fps = media_params.fps or _DEFAULT_FPS
 
     def write(self, img: npt.NDArray, dm: npt.NDArray):
+        frame_size = img.shape[1::-1]
         if self._cap is None:
-            return
+            fourcc = cv2.VideoWriter_fourcc(*self._codec)
+            self._cap = cv2.VideoWriter(self._file_name, fourcc, self._fps, frame_size)
+            self._frame_size = frame_size
+        elif frame_size != self._frame_size:
+            raise WriterError(f"Размер кадра изменился: {frame_size} вместо {self._frame_size}")
 
         self._cap.write(img)
 
+    def checkpoint(self) -> Optional[dict]:
+        # Дописать видео OpenCV после перезапуска нельзя (продолжение записи поддерживает DmFfmpegWriter)
+        return None
+
     def close(self):
-        self._cap.release() if self._cap is not None else None
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+
+class DmFfmpegWriter(DmMediaWriter):
+    """
+    Запись видео внешним процессом ffmpeg: кадры передаются в его стандартный ввод без сжатия,
+    кодирование выполняется многопоточным кодеком в отдельном процессе.
+    Процесс запускается при записи первого кадра (размер кадра определяется после препроцессоров).
+    Варианты расположения:
+    LAYOUT_COLOR - только кадр, LAYOUT_DEPTH - только карта глубины,
+    CONCAT_SIDE_BY_SIDE / CONCAT_TOP_BOTTOM - кадр слева (сверху) и карта глубины справа (снизу), формат 2D+Z,
+    LAYOUT_ALPHA - карта глубины в альфа-канале (нужны кодек и pix_fmt с альфа-каналом,
+    например libvpx-vp9 и yuva420p в файле .webm).
+    При сохранении контрольной точки (checkpoint) текущий процесс ffmpeg завершается, и запись продолжается
+    в следующую часть (<имя>.part0001<расширение>, ...). Части объединяются в file_name без перекодирования
+    после записи всех кадров (finish); при прерывании конвертации остаются на диске для продолжения записи
+    """
+
+    @staticmethod
+    def display_name() -> str:
+        return "Запись видеофайла через ffmpeg"
+
+    def __init__(self, file_name: str, layout: str = CONCAT_SIDE_BY_SIDE, codec: str = "libx264",
+                 crf: Optional[int] = 18, preset: Optional[str] = "veryfast", threads: int = 0,
+                 pix_fmt: Optional[str] = None, extra_args: Sequence[str] = (), ffmpeg: str = "ffmpeg"):
+        """
+        :param layout: расположение кадра и карты глубины (FFMPEG_LAYOUTS)
+        :param codec: кодек ffmpeg
+        :param crf: качество сжатия (меньше - лучше; None - значение кодека по умолчанию)
+        :param preset: скорость сжатия кодека (None - значение кодека по умолчанию)
+        :param threads: количество потоков кодека (0 - по числу ядер)
+        :param pix_fmt: формат пикселей результата (по умолчанию yuv420p, для LAYOUT_ALPHA - yuva420p)
+        :param extra_args: дополнительные параметры ffmpeg перед именем файла
+        :param ffmpeg: путь к исполняемому файлу ffmpeg
+        """
+        if layout not in FFMPEG_LAYOUTS:
+            raise ValueError(f"Неизвестное расположение изображений: {layout}")
+        self._file_name = file_name
+        self._layout = layout
+        self._codec = codec
+        self._crf = crf
+        self._preset = preset
+        self._threads = threads
+        self._pix_fmt = pix_fmt or ("yuva420p" if layout == LAYOUT_ALPHA else "yuv420p")
+        self._extra_args = list(extra_args)
+        self._ffmpeg = ffmpeg
+        self._fps = _DEFAULT_FPS
+        self._process: Optional[subprocess.Popen] = None
+        self._log = None
+        self._frame: Optional[npt.NDArray] = None
+        self._frame_shape: Optional[tuple[int, ...]] = None
+        # Записанные части видео (имена файлов в директории file_name); пусто - запись в file_name
+        self._segments: list[str] = []
+        self._segmented = False
+        self._finished = False
+
+    def prepare(self, media_params: DmMediaParams):
+        if shutil.which(self._ffmpeg) is None:
+            raise WriterError(f"Не найден ffmpeg: {self._ffmpeg}")
+        self._fps = media_params.fps or _DEFAULT_FPS
+        self._segments = []
+        self._segmented = False
+        self._finished = False
+
+    def write(self, img: npt.NDArray, dm: npt.NDArray):
+        frame = self._compose(img, dm)
+        if self._process is None:
+            self._start(frame)
+        elif frame.shape != self._frame_shape:
+            raise WriterError(f"Размер кадра изменился: {frame.shape[1::-1]} вместо {self._frame_shape[1::-1]}")
+        try:
+            self._process.stdin.write(frame.data)
+        except (BrokenPipeError, OSError) as e:
+            raise WriterError(f"ffmpeg завершился с ошибкой: {self._read_log()}") from e
+
+    def checkpoint(self) -> Optional[dict]:
+        if self._process is not None:
+            self._close_process()
+            if not self._segmented:
+                # Видео, записанное до первой контрольной точки, становится первой частью
+                os.replace(self._file_name, self._segment_path(0))
+                self._segmented = True
+            self._segments.append(os.path.basename(self._segment_path(len(self._segments))))
+        return {"segments": list(self._segments)}
+
+    def restore(self, state: dict):
+        segments = state.get("segments", [])
+        directory = os.path.dirname(self._file_name)
+        for segment in segments:
+            if not os.path.isfile(os.path.join(directory, segment)):
+                raise WriterError(f"Не найдена часть видео: {os.path.join(directory, segment)}")
+        self._segments = list(segments)
+        self._segmented = bool(segments)
+
+    def finish(self):
+        self._finished = True
+
+    def close(self):
+        self._close_process()
+        if self._finished and self._segmented:
+            self._concat_segments()
+
+    def _segment_path(self, number: int) -> str:
+        root, ext = os.path.splitext(self._file_name)
+        return f"{root}.part{number:04}{ext}"
+
+    def _concat_segments(self):
+        """
+        Объединяет части в file_name без перекодирования (формат concat ffmpeg) и удаляет их
+        """
+        directory = os.path.dirname(self._file_name)
+        paths = [os.path.join(directory, segment) for segment in self._segments]
+        self._segments = []
+        self._segmented = False
+        if len(paths) == 1:
+            os.replace(paths[0], self._file_name)
+            return
+
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False, encoding="utf-8") as file:
+            for path in paths:
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                file.write(f"file '{escaped}'\n")
+        try:
+            result = subprocess.run([self._ffmpeg, "-hide_banner", "-loglevel", "error", "-nostdin", "-y",
+                                     "-f", "concat", "-safe", "0", "-i", file.name, "-c", "copy", self._file_name],
+                                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except OSError as e:
+            raise WriterError(f"Не удалось запустить ffmpeg: {e}") from e
+        finally:
+            os.remove(file.name)
+        if result.returncode != 0:
+            log = result.stderr.decode(errors="replace")[-_FFMPEG_ERROR_TAIL:].strip()
+            raise WriterError(f"Не удалось объединить части видео {', '.join(paths)}: {log}")
+        for path in paths:
+            os.remove(path)
+
+    def _close_process(self):
+        if self._process is None:
+            return
+        process, self._process = self._process, None
+        try:
+            process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        code = process.wait()
+        log = self._read_log()
+        self._log.close()
+        if code != 0:
+            raise WriterError(f"ffmpeg завершился с кодом {code}: {log}")
+
+    def _compose(self, img: npt.NDArray, dm: npt.NDArray) -> npt.NDArray:
+        """
+        Собирает кадр для ffmpeg в переиспользуемом массиве (для кадра или карты глубины без изменений -
+        сам массив)
+        """
+        if self._layout == LAYOUT_COLOR:
+            return np.ascontiguousarray(img)
+        if self._layout == LAYOUT_DEPTH:
+            return np.ascontiguousarray(dm if dm.ndim == 2 else dm[..., 0])
+
+        height, width = img.shape[:2]
+        if self._layout == LAYOUT_ALPHA:
+            shape = (height, width, 4)
+        elif self._layout == CONCAT_SIDE_BY_SIDE:
+            shape = (height, width * 2, 3)
+        else:
+            shape = (height * 2, width, 3)
+        if self._frame is None or self._frame.shape != shape:
+            self._frame = np.empty(shape, np.uint8)
+        frame = self._frame
+
+        dm_grey = dm if dm.ndim == 2 else dm[..., 0]
+        if self._layout == LAYOUT_ALPHA:
+            frame[..., :3] = img
+            frame[..., 3] = dm_grey
+        elif self._layout == CONCAT_SIDE_BY_SIDE:
+            frame[:, :width] = img
+            frame[:, width:] = dm_grey[..., None]
+        else:
+            frame[:height] = img
+            frame[height:] = dm_grey[..., None]
+        return frame
+
+    def _start(self, frame: npt.NDArray):
+        height, width = frame.shape[:2]
+        input_format = {1: "gray", 3: "bgr24", 4: "bgra"}[1 if frame.ndim == 2 else frame.shape[2]]
+        command = [self._ffmpeg, "-hide_banner", "-loglevel", "error", "-nostats", "-y",
+                   "-f", "rawvideo", "-pix_fmt", input_format, "-s", f"{width}x{height}", "-r", str(self._fps),
+                   "-i", "-"]
+        # Форматы с уменьшенным разрешением цвета требуют четных размеров кадра
+        if (width % 2 or height % 2) and self._pix_fmt.startswith(("yuv420", "yuva420")):
+            command += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2"]
+        command += ["-c:v", self._codec, "-pix_fmt", self._pix_fmt, "-threads", str(self._threads)]
+        if self._crf is not None:
+            command += ["-crf", str(self._crf)]
+        if self._preset is not None:
+            command += ["-preset", self._preset]
+        output = self._segment_path(len(self._segments)) if self._segmented else self._file_name
+        command += self._extra_args + [output]
+
+        # Вывод ffmpeg сохраняется во временный файл: канал мог бы заполниться и остановить ffmpeg
+        self._log = tempfile.TemporaryFile()
+        try:
+            self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                             stderr=self._log)
+        except OSError as e:
+            self._log.close()
+            raise WriterError(f"Не удалось запустить ffmpeg: {e}") from e
+        self._frame_shape = frame.shape
+
+    def _read_log(self) -> str:
+        if self._log is None:
+            return ""
+        self._log.seek(0)
+        return self._log.read().decode(errors="replace")[-_FFMPEG_ERROR_TAIL:].strip()
 
 
 @dataclass
-class DmImageWriter(DmMediaWriter):
+class DmImageWriter(DmMediaIndexedWriter):
     @staticmethod
     def display_name() -> str:
         return "Запись в виде набора изображений"
 
     def __init__(self, directory: str, name_rule: Callable[[int], str] = None, write_dm: bool = False,
-                 write_img: bool = False, write_concat: bool = False):
+                 write_img: bool = False, write_concat: bool = False, concat_layout: str = CONCAT_TOP_BOTTOM):
+        """
+        :param concat_layout: расположение карты глубины и кадра в объединенном изображении
+        (CONCAT_TOP_BOTTOM - карта глубины сверху, CONCAT_SIDE_BY_SIDE - карта глубины слева)
+        """
+        if concat_layout not in (CONCAT_TOP_BOTTOM, CONCAT_SIDE_BY_SIDE):
+            raise ValueError(f"Неизвестное расположение изображений: {concat_layout}")
         self._directory = directory
         self._name_rule = name_rule
         self._img_num = 0
         self._write_dm = write_dm
         self._write_img = write_img
         self._write_concat = write_concat
+        self._concat_axis = 0 if concat_layout == CONCAT_TOP_BOTTOM else 1
 
     def prepare(self, media_params: DmMediaParams):
         os.makedirs(self._directory, exist_ok=True)
 
-    def write(self, img: npt.NDArray, dm: npt.NDArray):
+    def next_index(self) -> int:
         self._img_num += 1
+        return self._img_num
+
+    def checkpoint(self) -> Optional[dict]:
+        return {"img_num": self._img_num}
 
-        name = self._name_rule(self._img_num) if self._name_rule else str(self._img_num)
+    def restore(self, state: dict):
+        # Продолжение нумерации файлов, иначе записанные изображения перезаписываются
+        self._img_num = state["img_num"]
+
+    def write_indexed(self, index: int, img: npt.NDArray, dm: npt.NDArray):
+        name = self._name_rule(index) if self._name_rule else str(index)
         file = os.path.join(self._directory, name)
 
-        if self._write_dm or self._write_concat:
+        if self._write_dm:
             cv2.imwrite(f"{file}_dm.png", dm)
 
-        if self._write_img or self._write_concat:
+        if self._write_img:
             cv2.imwrite(f"{file}_img.png", img)
 
         if self._write_concat:
-            f_dm = cv2.imread(f"{file}_dm.png")
-            f_img = cv2.imread(f"{file}_img.png")
-            concat = np.concatenate((f_dm, f_img))
+            dm_bgr = cv2.cvtColor(dm, cv2.COLOR_GRAY2BGR) if dm.ndim == 2 else dm
+            concat = np.concatenate((dm_bgr, img), axis=self._concat_axis)
             cv2.imwrite(f"{file}_concat.png", concat)
-            if not self._write_dm:
-                os.remove(f"{file}_dm.png")
-            if not self._write_img:
-                os.remove(f"{file}_img.png")
 
 
 class DmScreenWriter(DmMediaWriter):
@@ -98,3 +362,103 @@ class DmCallbackWriter(DmMediaWriter):
 
     def write(self, img: npt.NDArray, dm: npt.NDArray):
         self._callback(img, dm)
+
+
+# Маркер завершения работы потоков асинхронной записи
+_END = object()
+
+
+class DmAsyncWriter(DmMediaWriter):
+    """
+    Обертка над любым writer-ом: кадры передаются потокам записи через ограниченную очередь,
+    и кодирование/запись на диск не задерживают конвертацию.
+    Writer-ы с независимой записью кадров ([DmMediaIndexedWriter]) записываются несколькими потоками,
+    остальные - одним потоком в исходном порядке. Ошибки записи передаются в конвертер
+    при следующей записи кадра или при закрытии
+    """
+
+    @staticmethod
+    def display_name() -> str:
+        return "Асинхронная запись"
+
+    def __init__(self, writer: DmMediaWriter, queue_size: int = 8, workers: int = 1):
+        """
+        :param writer: writer, выполняющий запись
+        :param queue_size: максимальное количество кадров, ожидающих записи
+        :param workers: количество потоков записи (больше одного только для [DmMediaIndexedWriter])
+        """
+        self._writer = writer
+        self._queue = queue.Queue(max(1, queue_size))
+        self._workers_count = max(1, workers) if isinstance(writer, DmMediaIndexedWriter) else 1
+        self._workers: list[threading.Thread] = []
+        self._error: Optional[BaseException] = None
+
+    @property
+    def writer(self) -> DmMediaWriter:
+        return self._writer
+
+    def prepare(self, media_params: DmMediaParams):
+        self._writer.prepare(media_params)
+        self._error = None
+        self._workers = [threading.Thread(target=self._work, name=f"dm-write-{i}", daemon=True)
+                         for i in range(self._workers_count)]
+        for worker in self._workers:
+            worker.start()
+
+    def write(self, img: npt.NDArray, dm: npt.NDArray):
+        self._raise_if_failed()
+        index = self._writer.next_index() if isinstance(self._writer, DmMediaIndexedWriter) else None
+        # Кадр записывается после возврата из write: массивы пула удерживаются до записи
+        retain(img)
+        retain(dm)
+        self._queue.put((index, img, dm))
+
+    def flush(self):
+        self._queue.join()
+        self._raise_if_failed()
+
+    def checkpoint(self) -> Optional[dict]:
+        self.flush()
+        return self._writer.checkpoint()
+
+    def restore(self, state: dict):
+        self._writer.restore(state)
+
+    def finish(self):
+        self._writer.finish()
+
+    def close(self):
+        for _ in self._workers:
+            self._queue.put(_END)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        self._writer.close()
+        self._raise_if_failed()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _END:
+                    break
+                # После ошибки очередь продолжает разбираться, чтобы не блокировать конвертер
+                index, img, dm = item
+                try:
+                    if self._error is None:
+                        if index is None:
+                            self._writer.write(img, dm)
+                        else:
+                            self._writer.write_indexed(index, img, dm)
+                finally:
+                    release(img)
+                    release(dm)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise WriterError(f"Ошибка записи ({self._writer.display_name()}): {error}") from error
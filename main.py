@@ -1,20 +1,73 @@
 import enum
+from functools import partial
 
-import cv2
 import os
 import sys
 import settings
 import qtvscodestyle
 from PyQt6.QtWidgets import QApplication
-from dmconvert.postprocessors import create_anaglyph_processor
-from dmconvert.converter import DmMediaConverter, DmMediaReader
-from dmconvert.readers import DmVideoReader, DmImagesReader, DmCameraReader
-from dmconvert.writers import DmScreenWriter, DmImageWriter, DmVideoWriter
-from argparse import ArgumentParser
+from dmconvert.postprocessors import create_anaglyph_processor, create_depth_range_smoother
+from dmconvert.preprocessors import create_resize_preprocessor
+from dmconvert.checkpoint import DmCheckpointer
+from dmconvert.converter import DmMediaConverter, DmMediaReader, DmMediaWriter
+from dmconvert.pipeline import DmPipelinedMediaConverter
+from dmconvert.scenes import DmSceneCutDetector, HISTOGRAM, THUMBNAIL
+from dmconvert.sharding import DmShardedMediaConverter
+from dmconvert.jobs import load_manifest, run_manifest, DmJobResult
+from dmconvert.threads import DmThreadConfig, apply_thread_config, parse_cpu_list
+from dmconvert.readers import DmVideoReader, DmImagesReader, DmCameraReader, DmPrefetchReader, DmLatestFrameReader, \
+    DmFfmpegReader, VIDEO_BACKENDS
+from dmconvert.writers import DmScreenWriter, DmImageWriter, DmVideoWriter, DmAsyncWriter, DmFfmpegWriter, \
+    CONCAT_TOP_BOTTOM, CONCAT_SIDE_BY_SIDE, FFMPEG_LAYOUTS
+from argparse import ArgumentParser, BooleanOptionalAction
 from ui.main_window import MainWindow
+from depthmap_wrappers.cached import CachedDmWrapper
+from depthmap_wrappers.interpolated import DmFrameSkipWrapper
+from depthmap_wrappers.upsampling import DmGuidedUpsampleWrapper
+from depthmap_wrappers.midas_torchscript import MidasTorchScriptDmWrapper
 from depthmap_wrappers.models import Models
 
 
+# Варианты выполнения нейронной сети для CLI (по умолчанию - settings.MODEL_LOADER)
+BACKENDS = {
+    'torchscript': MidasTorchScriptDmWrapper,
+    'torchscript-int8': partial(MidasTorchScriptDmWrapper, quantize=True),
+}
+
+
+def create_loader(args):
+    loader_type = BACKENDS[args.backend] if args.backend else settings.MODEL_LOADER
+    loader = loader_type()
+    if args.inference_size:
+        loader = DmGuidedUpsampleWrapper(loader, args.inference_size, args.tiles,
+                                         guided=args.upsampling == 'guided')
+    if args.cache:
+        loader = CachedDmWrapper(loader, args.cache, settings.DM_CACHE_MAX_SIZE_MB)
+    return loader
+
+
+def create_video_reader(args) -> DmMediaReader:
+    if args.decoder == 'ffmpeg' or args.keyframes_only or args.decode_size:
+        width, height = None, None
+        if args.decode_size:
+            width, _, height = args.decode_size.lower().partition('x')
+            width, height = int(width) if width else None, int(height) if height else None
+        return DmFfmpegReader(args.source, width, height, args.stride, args.keyframes_only, args.decode_threads or 0,
+                              'auto' if args.hw_decode else None, ffmpeg=settings.FFMPEG_PATH)
+    return DmVideoReader(file_path=args.source, backend=args.video_backend, threads=args.decode_threads,
+                         hw_acceleration=args.hw_decode, stride=args.stride)
+
+
+def create_thread_config(args) -> DmThreadConfig:
+    stages = dict(settings.PIPELINE_STAGE_THREADS)
+    for value in args.stage_threads:
+        stage, _, threads = value.partition('=')
+        stages[stage] = int(threads)
+    return DmThreadConfig(torch_threads=args.torch_threads, interop_threads=settings.TORCH_INTEROP_THREADS,
+                          opencv_threads=args.opencv_threads, numba_threads=args.numba_threads,
+                          affinity=args.cpu_affinity and parse_cpu_list(args.cpu_affinity), stages=stages)
+
+
 def use_ui():
     q_app = QApplication(sys.argv)
     stylesheet = qtvscodestyle.load_stylesheet(qtvscodestyle.Theme.SOLARIZED_LIGHT)
@@ -26,25 +79,107 @@ def use_ui():
 
 def use_cli():
     parser = ArgumentParser(prog='Neural depth map tool')
-    parser.add_argument('mode', type=str, help='Video source type CAM/FILE/IMG')
-    parser.add_argument('source', type=str, help='Camera number for CAM, file path for FILE, folder path for IMG')
+    parser.add_argument('mode', type=str, help='Video source type CAM/FILE/IMG or BATCH')
+    parser.add_argument('source', type=str,
+                        help='Camera number for CAM, file path for FILE, folder path for IMG, job manifest for BATCH')
     parser.add_argument('-t', '--targets', nargs='+', type=str, help='SCREEN, IMAGES, VIDEO')
     parser.add_argument('-a', '--anaglyph', action='store_true', help='Anaglyph output')
     parser.add_argument('-m', '--model', type=str, help='Model type')
+    parser.add_argument('--backend', choices=list(BACKENDS),
+                        help='Run the model exported to TorchScript (optionally int8 quantized)')
+    parser.add_argument('--depth-ema', type=float, default=settings.DEPTH_EMA,
+                        help='Smooth depth range across frames, 0..1 (0 - disabled)')
+    parser.add_argument('--decoder', choices=['opencv', 'ffmpeg'], default=settings.VIDEO_DECODER,
+                        help='Video decoder: cv2.VideoCapture or an ffmpeg subprocess')
+    parser.add_argument('--video-backend', choices=list(VIDEO_BACKENDS), help='OpenCV video backend')
+    parser.add_argument('--decode-threads', type=int, help='Video decoding threads')
+    parser.add_argument('--hw-decode', action='store_true', help='Use hardware video decoding if available')
+    parser.add_argument('--stride', type=int, default=1, help='Process every N-th video frame')
+    parser.add_argument('--keyframes-only', action='store_true',
+                        help='Decode only key frames (implies --decoder ffmpeg)')
+    parser.add_argument('--decode-size', type=str,
+                        help='Downscale while decoding, WIDTHxHEIGHT, WIDTH or xHEIGHT (implies --decoder ffmpeg)')
+    parser.add_argument('--resize', type=str, default='640x480',
+                        help='Resize frames before processing, WIDTHxHEIGHT or NONE to keep the source size')
+    parser.add_argument('--inference-size', type=int, default=0,
+                        help='Run the network at this size (longest side) and upsample depth to the frame size')
+    parser.add_argument('--upsampling', choices=['guided', 'linear'], default='guided',
+                        help='With --inference-size: depth upsampling method (guided filter or bilinear)')
+    parser.add_argument('--tiles', type=int, default=1,
+                        help='With --inference-size: split frames into N x N overlapping tiles')
+    parser.add_argument('-p', '--pipeline', action='store_true',
+                        help='Run reading, inference, postprocessing and writing in parallel stages')
+    parser.add_argument('-b', '--batch-size', type=int, default=1, help='Frames per neural network pass')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='Worker processes with own model copy for VID/IMG sources (0 - disabled)')
+    parser.add_argument('--shard-size', type=int, default=32, help='Frames per worker process task')
+    parser.add_argument('--prefetch', type=int, default=0, help='Frames to decode ahead in background (0 - disabled)')
+    parser.add_argument('--concat-layout', choices=[CONCAT_TOP_BOTTOM, CONCAT_SIDE_BY_SIDE], default=CONCAT_TOP_BOTTOM,
+                        help='Depth map and frame layout for IMAGES target')
+    parser.add_argument('--encoder', choices=['opencv', 'ffmpeg'], default=settings.VIDEO_ENCODER,
+                        help='VIDEO target encoder: cv2.VideoWriter or an ffmpeg subprocess')
+    parser.add_argument('--video-layout', choices=FFMPEG_LAYOUTS, default=CONCAT_SIDE_BY_SIDE,
+                        help='Frame and depth layout for the ffmpeg encoder')
+    parser.add_argument('--codec', type=str, help='Video codec (default: mp4v for opencv, libx264 for ffmpeg)')
+    parser.add_argument('--crf', type=int, default=18, help='ffmpeg encoder quality, lower is better')
+    parser.add_argument('--encoder-threads', type=int, default=0, help='ffmpeg encoder threads (0 - auto)')
+    parser.add_argument('-w', '--write-workers', type=int, default=0,
+                        help='Threads writing files in background (0 - write inline)')
+    parser.add_argument('--cache', type=str, default=settings.DM_CACHE_DIR,
+                        help='Directory for caching depth maps between runs')
+    parser.add_argument('-j', '--jobs', type=int, help='Concurrent jobs for BATCH (default - from manifest)')
+    parser.add_argument('-s', '--stats', action='store_true', help='Print per-stage timing summary')
+    parser.add_argument('--queue-size', type=int, default=4, help='Max frames between pipeline stages')
+    parser.add_argument('--scene-cuts', choices=[HISTOGRAM, THUMBNAIL], default=settings.SCENE_DETECTION,
+                        help='Detect scene cuts and reset temporal smoothing at them')
+    parser.add_argument('--scene-threshold', type=float, default=settings.SCENE_CUT_THRESHOLD,
+                        help='Scene cut threshold 0..1 (default depends on the method)')
+    parser.add_argument('--checkpoint', type=str,
+                        help='Periodically save progress to this file (default with --resume: dm_checkpoint.json)')
+    parser.add_argument('--checkpoint-interval', type=float, default=settings.CHECKPOINT_INTERVAL,
+                        help='Seconds between checkpoints')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted conversion from the checkpoint, appending to outputs')
+    parser.add_argument('--realtime', action=BooleanOptionalAction, default=settings.REALTIME_LATEST_FRAME,
+                        help='CAM: always process the newest frame, dropping stale ones')
+    parser.add_argument('--infer-every', type=int, default=settings.REALTIME_INFER_EVERY,
+                        help='CAM: run the network every N frames, warp depth in between')
+    parser.add_argument('--target-fps', type=float, default=settings.REALTIME_TARGET_FPS,
+                        help='CAM: choose the network interval automatically to reach this FPS')
+    parser.add_argument('--torch-threads', type=int, default=settings.TORCH_THREADS,
+                        help='Threads used by the neural network')
+    parser.add_argument('--opencv-threads', type=int, default=settings.OPENCV_THREADS,
+                        help='Threads used by OpenCV (0 - single-threaded)')
+    parser.add_argument('--numba-threads', type=int, default=settings.NUMBA_THREADS,
+                        help='Threads used by postprocessors')
+    parser.add_argument('--cpu-affinity', type=str, default=settings.CPU_AFFINITY,
+                        help='CPU cores to run on, e.g. 0-15,32-47')
+    parser.add_argument('--stage-threads', nargs='+', default=[], metavar='STAGE=N',
+                        help='Threads per pipeline stage (read, process, postprocess), e.g. process=12')
     args = parser.parse_args()
+    apply_thread_config(create_thread_config(args))
+
+    if args.mode.lower() == 'batch':
+        use_batch(args)
+        return
 
     reader: DmMediaReader
     match args.mode.lower():
         case 'vid':
-            reader = DmVideoReader(file_path=args.source)
+            reader = create_video_reader(args)
         case 'cam':
             reader = DmCameraReader(cam_number=args.source)
+            if args.realtime:
+                reader = DmLatestFrameReader(reader)
         case 'img':
             reader = DmImagesReader(directory=args.source)
         case _:
             print('Incorrect mode, allowed: CAM, VID, IMG')
             exit(1)
 
+    if args.prefetch > 0:
+        reader = DmPrefetchReader(reader, queue_size=args.prefetch)
+
     models_list = [m.value for m in Models]
     if len(models_list) == 0:
         print("There is no model to use")
@@ -55,28 +190,82 @@ def use_cli():
     else:
         model = models_list[0]
 
-    loader = settings.MODEL_LOADER()
-    converter = DmMediaConverter(model, reader, loader)
-    converter.preprocessors.append(lambda img: cv2.resize(img, (640, 480), 1, 1, interpolation=cv2.INTER_AREA))
+    loader = create_loader(args)
+    if args.mode.lower() == 'cam' and (args.infer_every > 1 or args.target_fps):
+        loader = DmFrameSkipWrapper(loader, args.infer_every, args.target_fps)
+    if args.processes > 0:
+        converter = DmShardedMediaConverter(model, reader, loader, args.batch_size, workers=args.processes,
+                                            shard_size=args.shard_size)
+    elif args.pipeline:
+        converter = DmPipelinedMediaConverter(model, reader, loader, args.batch_size, queue_size=args.queue_size)
+    else:
+        converter = DmMediaConverter(model, reader, loader, args.batch_size)
+    if args.scene_cuts:
+        converter.scene_detector = DmSceneCutDetector(args.scene_cuts, args.scene_threshold, settings.SCENE_MIN_LENGTH)
+    if args.depth_ema:
+        converter.postprocessors.append(create_depth_range_smoother(args.depth_ema))
+    if args.checkpoint or args.resume:
+        converter.checkpointer = DmCheckpointer(args.checkpoint or 'dm_checkpoint.json', args.checkpoint_interval,
+                                                args.resume, source=args.source)
+    if args.resize.lower() != 'none':
+        width, height = map(int, args.resize.lower().split('x'))
+        converter.preprocessors.append(create_resize_preprocessor(width, height))
+
+    def async_if_needed(writer: DmMediaWriter) -> DmMediaWriter:
+        if args.write_workers > 0:
+            return DmAsyncWriter(writer, queue_size=args.queue_size, workers=args.write_workers)
+        return writer
 
     for target in args.targets:
         match target.lower():
             case 'screen':
                 converter.writers.append(DmScreenWriter())
             case 'images':
-                converter.writers.append(DmImageWriter('output2', write_concat=True))
+                converter.writers.append(async_if_needed(DmImageWriter('output2', write_concat=True,
+                                                                        concat_layout=args.concat_layout)))
             case 'video':
-                converter.writers.append(DmVideoWriter('out2.mp4'))
+                if args.encoder == 'ffmpeg':
+                    writer = DmFfmpegWriter('out2.mp4', args.video_layout, args.codec or 'libx264', args.crf,
+                                            threads=args.encoder_threads, ffmpeg=settings.FFMPEG_PATH)
+                else:
+                    writer = DmVideoWriter('out2.mp4', args.codec or 'mp4v')
+                converter.writers.append(async_if_needed(writer))
 
     if args.anaglyph:
         converter.postprocessors.append(create_anaglyph_processor(10, 1))
 
     converter.start()
 
+    if args.stats:
+        print(converter.stats.summary())
+
+
+def use_batch(args):
+    manifest = load_manifest(args.source)
+
+    def job_done(result: DmJobResult):
+        if result.error is not None:
+            print(f'{result.name}: failed: {result.error}')
+            return
+        print(f'{result.name}: done, {result.converter.stats.frames} frames, {result.converter.stats.fps:.2f} FPS')
+        if args.stats:
+            print(result.converter.stats.summary())
+
+    results = run_manifest(manifest, partial(create_loader, args), args.jobs, job_done)
+    failed = sum(result.error is not None for result in results)
+    print(f'Jobs: {len(results)}, failed: {failed}')
+    if failed:
+        exit(1)
+
 
 def apply_settings():
     if settings.AUTODETECT_MODELS:
         Models.autodetect()
+    apply_thread_config(DmThreadConfig(
+        torch_threads=settings.TORCH_THREADS, interop_threads=settings.TORCH_INTEROP_THREADS,
+        opencv_threads=settings.OPENCV_THREADS, numba_threads=settings.NUMBA_THREADS,
+        affinity=settings.CPU_AFFINITY and parse_cpu_list(settings.CPU_AFFINITY),
+        stages=dict(settings.PIPELINE_STAGE_THREADS)))
 
 
 def main():
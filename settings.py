@@ -10,6 +10,97 @@ MODELS_DIR = 'models'
 # Автоматически регистрировать файлы моделей (*.pt) из директории [MODELS_DIR]
 AUTODETECT_MODELS = True
 
+# Максимальный объем памяти моделей, одновременно хранимых загруженными (МБ), None - без ограничения
+MODEL_POOL_MAX_MB = 4096
+
+# Сглаживание диапазона карты глубины между кадрами видео (0 - без сглаживания, ближе к 1 - сильнее),
+# убирает колебания яркости карт глубины соседних кадров. Выполняется постпроцессором конвертера
+# (сбрасывается при смене сцены), карты глубины загрузчика и кэша не зависят от сглаживания
+DEPTH_EMA = 0.0
+
+
+"""
+    Кэш карт глубины
+"""
+
+# Директория для хранения рассчитанных карт глубины (None - кэш отключен)
+DM_CACHE_DIR = None
+
+# Максимальный размер кэша карт глубины (МБ)
+DM_CACHE_MAX_SIZE_MB = 2048
+
+
+"""
+    Режим реального времени (камера)
+"""
+
+# Обрабатывать только последний полученный с камеры кадр, пропуская устаревшие
+REALTIME_LATEST_FRAME = True
+
+# Нейронная сеть обрабатывает каждый N-й кадр, карты глубины остальных кадров сдвигаются по оптическому потоку
+REALTIME_INFER_EVERY = 1
+
+# Целевая частота кадров: интервал между обрабатываемыми сетью кадрами подбирается автоматически (None - отключено)
+REALTIME_TARGET_FPS = None
+
+
+"""
+    Чтение и запись видео
+"""
+
+# Кодировщик видео для записи в файл: "opencv" (cv2.VideoWriter) или "ffmpeg" (отдельный процесс ffmpeg,
+# многопоточные кодеки и запись кадра вместе с картой глубины)
+VIDEO_ENCODER = "opencv"
+
+# Декодировщик видео: "opencv" (cv2.VideoCapture) или "ffmpeg" (отдельный процесс ffmpeg,
+# уменьшение кадров и пропуск кадров при декодировании)
+VIDEO_DECODER = "opencv"
+
+# Путь к исполняемому файлу ffmpeg
+FFMPEG_PATH = "ffmpeg"
+
+# Период сохранения контрольной точки при конвертации с возможностью продолжения (сек)
+CHECKPOINT_INTERVAL = 60
+
+
+"""
+    Смена сцены
+"""
+
+# Способ определения смены сцены: "histogram", "thumbnail" (None - отключено). На смене сцены сбрасывается
+# состояние загрузчика и постпроцессоров (сглаживание между кадрами), при обработке в нескольких процессах
+# границы частей переносятся на смены сцены
+SCENE_DETECTION = None
+
+# Порог отличия кадров разных сцен 0..1 (None - значение по умолчанию для способа)
+SCENE_CUT_THRESHOLD = None
+
+# Минимальное количество кадров между сменами сцены
+SCENE_MIN_LENGTH = 8
+
+
+"""
+    Потоки вычислений (None - значение библиотеки по умолчанию, обычно по числу ядер)
+"""
+
+# Потоки внутри операций torch (нейронная сеть)
+TORCH_THREADS = None
+
+# Потоки для параллельного выполнения операций torch
+TORCH_INTEROP_THREADS = None
+
+# Потоки OpenCV (чтение, изменение размера, запись; 0 - без распараллеливания)
+OPENCV_THREADS = None
+
+# Потоки numba (постпроцессоры)
+NUMBA_THREADS = None
+
+# Ядра процессора, на которых выполняется конвертация, например "0-15" (None - все)
+CPU_AFFINITY = None
+
+# Потоки этапов параллельной конвертации, например {"process": 12, "postprocess": 4}
+PIPELINE_STAGE_THREADS = {}
+
 
 """
     Сторонние модули
@@ -18,5 +109,7 @@ AUTODETECT_MODELS = True
 sys.path.extend(['./depthmap/MiDaS'])
 
 # Название класса - загрузчика модели, должен наследоваться от [BaseDmWrapper]
+# (для выполнения модели, экспортированной в TorchScript - MidasTorchScriptDmWrapper
+# из depthmap_wrappers.midas_torchscript)
 from depthmap_wrappers.midas import MidasDmWrapper
 MODEL_LOADER = MidasDmWrapper
@@ -0,0 +1,91 @@
+import numpy as np
+
+from dmconvert.buffers import DmFramePool, release, release_replaced, retain
+
+
+def test_released_array_is_reused():
+    pool = DmFramePool()
+    array = pool.get((4, 6, 3))
+    assert array.shape == (4, 6, 3) and array.dtype == np.uint8
+
+    release(array)
+    assert pool.get((4, 6, 3)) is array
+    assert pool.allocations == 1
+
+
+def test_arrays_are_kept_per_shape_and_dtype():
+    pool = DmFramePool()
+    array = pool.get((4, 6))
+    release(array)
+
+    assert pool.get((6, 4)) is not array
+    assert pool.get((4, 6), np.float32) is not array
+    assert pool.get((4, 6)) is array
+    assert pool.allocations == 3
+
+
+def test_retained_array_returns_after_last_release():
+    pool = DmFramePool()
+    array = pool.get((4, 6))
+    retain(array)
+
+    release(array)
+    # Массив еще удерживается вторым участником
+    other = pool.get((4, 6))
+    assert other is not array
+
+    release(array)
+    assert pool.get((4, 6)) is array
+
+
+def test_double_release_does_not_return_array_twice():
+    pool = DmFramePool()
+    array = pool.get((4, 6))
+    release(array)
+    release(array)
+
+    assert pool.get((4, 6)) is array
+    assert pool.get((4, 6)) is not array
+
+
+def test_release_replaced_keeps_shared_memory():
+    pool = DmFramePool()
+    array = pool.get((4, 6))
+
+    # Результат - срез исходного массива: массив еще используется
+    release_replaced(array, array[1:3])
+    release_replaced(array, array)
+    assert pool.get((4, 6)) is not array
+
+    release_replaced(array, np.zeros((4, 6), np.uint8), None)
+    assert pool.get((4, 6)) is array
+
+
+def test_max_buffers_limits_free_arrays():
+    pool = DmFramePool(max_buffers=1)
+    first, second = pool.get((4, 6)), pool.get((4, 6))
+    release(first)
+    release(second)
+
+    assert pool.get((4, 6)) is first
+    pool.get((4, 6))
+    assert pool.allocations == 3
+
+
+def test_release_of_foreign_array_is_noop():
+    pool = DmFramePool()
+    array = np.zeros((4, 6), np.uint8)
+    release(array)
+    retain(array)
+    release_replaced(array)
+
+    assert pool.get((4, 6)) is not array
+
+
+def test_clear_drops_free_arrays():
+    pool = DmFramePool()
+    array = pool.get((4, 6))
+    release(array)
+    pool.clear()
+
+    assert pool.get((4, 6)) is not array
@@ -0,0 +1,132 @@
+import os
+
+import numpy as np
+import pytest
+
+from depthmap_wrappers.base import BaseDmWrapper
+from depthmap_wrappers.cached import CachedDmWrapper, DmCache, open_cache
+from depthmap_wrappers.models import Model
+
+# Карта глубины размером около 400 КБ: в кэш размером 1 МБ помещаются две
+DM_SHAPE = (640, 640)
+
+
+class _CountingDmWrapper(BaseDmWrapper):
+    """
+    Загрузчик без нейронной сети: карта глубины - зеленый канал кадра, вызовы считаются
+    """
+
+    def __init__(self):
+        self.prepared = []
+        self.processed = 0
+
+    def prepare_model(self, model: Model, *args):
+        self.prepared.append(model)
+
+    def process(self, image, *args):
+        self.processed += 1
+        return image[:, :, 1].copy()
+
+
+def _dm(value: int) -> np.ndarray:
+    return np.full(DM_SHAPE, value, np.uint8)
+
+
+def _image(value: int) -> np.ndarray:
+    image = np.zeros((8, 12, 3), np.uint8)
+    image[:, :, 1] = value
+    return image
+
+
+def test_put_and_get(tmp_path):
+    cache = DmCache(str(tmp_path), 16)
+    dm = np.arange(12, dtype=np.uint8).reshape(3, 4)
+    cache.put("frame", dm)
+
+    assert np.array_equal(cache.get("frame"), dm)
+    assert cache.get("missing") is None
+
+
+def test_least_recently_used_map_is_evicted(tmp_path):
+    cache = DmCache(str(tmp_path), 1)
+    cache.put("a", _dm(1))
+    cache.put("b", _dm(2))
+    # Обращение к "a" делает самой старой карту "b"
+    assert cache.get("a") is not None
+    cache.put("c", _dm(3))
+
+    assert cache.get("b") is None
+    assert not os.path.exists(tmp_path / "b.npy")
+    assert np.array_equal(cache.get("a"), _dm(1))
+    assert np.array_equal(cache.get("c"), _dm(3))
+
+
+def test_reopened_cache_finds_saved_maps(tmp_path):
+    DmCache(str(tmp_path), 16).put("frame", _dm(7))
+
+    assert np.array_equal(DmCache(str(tmp_path), 16).get("frame"), _dm(7))
+
+
+def test_deleted_file_is_a_miss(tmp_path):
+    cache = DmCache(str(tmp_path), 16)
+    cache.put("frame", _dm(7))
+    os.remove(tmp_path / "frame.npy")
+
+    assert cache.get("frame") is None
+
+
+def test_open_cache_shares_instance_per_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = open_cache("cache", 16)
+
+    assert open_cache(str(tmp_path / "cache"), 16) is cache
+    assert open_cache(str(tmp_path / "other"), 16) is not cache
+
+
+@pytest.fixture
+def model(tmp_path) -> Model:
+    path = tmp_path / "model.pt"
+    path.write_bytes(b"weights")
+    return Model("test_model", str(path))
+
+
+def test_wrapper_processes_only_missing_frames(tmp_path, model):
+    wrapper = _CountingDmWrapper()
+    cached = CachedDmWrapper(wrapper, str(tmp_path / "cache"), 16)
+    cached.prepare_model(model)
+    # Модель загружается только при первом отсутствующем в кэше кадре
+    assert wrapper.prepared == []
+
+    assert np.array_equal(cached.process(_image(10)), _image(10)[:, :, 1])
+    assert np.array_equal(cached.process(_image(10)), _image(10)[:, :, 1])
+    assert wrapper.processed == 1
+    assert wrapper.prepared == [model]
+
+    cached.process(_image(20))
+    assert wrapper.processed == 2
+
+
+def test_wrapper_batch_uses_cached_frames(tmp_path, model):
+    wrapper = _CountingDmWrapper()
+    cached = CachedDmWrapper(wrapper, str(tmp_path / "cache"), 16)
+    cached.prepare_model(model)
+    cached.process(_image(10))
+
+    dms = cached.process_batch([_image(10), _image(20), _image(30)])
+    assert [int(dm[0, 0]) for dm in dms] == [10, 20, 30]
+    assert wrapper.processed == 3
+
+
+def test_key_depends_on_frame_and_model(tmp_path, model):
+    cached = CachedDmWrapper(_CountingDmWrapper(), str(tmp_path / "cache"), 16)
+    cached.prepare_model(model)
+    key = cached._key(_image(10))
+
+    assert cached._key(_image(10)) == key
+    assert cached._key(_image(11)) != key
+    # Тот же кадр другого типа или формы
+    assert cached._key(_image(10).astype(np.float32)) != key
+    assert cached._key(_image(10).reshape(12, 8, 3)) != key
+
+    cached.prepare_model(Model("other_model", model.path))
+    assert cached._key(_image(10)) != key
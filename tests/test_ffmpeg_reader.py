@@ -0,0 +1,71 @@
+import shutil
+
+import cv2
+import numpy as np
+import pytest
+
+from dmconvert.buffers import DmFramePool
+from dmconvert.readers import DmFfmpegReader
+
+pytestmark = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="не найден ffmpeg")
+
+# Частота кадров NTSC: время кадра не выражается целым числом кадров в секунду
+FPS = 30000 / 1001
+FRAMES = 90
+BITS = 8
+STRIPE = 16
+
+
+def _frame(number: int) -> np.ndarray:
+    """
+    Кадр с номером, записанным двоичными разрядами в вертикальные полосы (устойчиво к сжатию)
+    """
+    img = np.zeros((64, BITS * STRIPE, 3), np.uint8)
+    for bit in range(BITS):
+        if number >> bit & 1:
+            img[:, bit * STRIPE:(bit + 1) * STRIPE] = 255
+    return img
+
+
+def _number(img: np.ndarray) -> int:
+    stripes = img.reshape(img.shape[0], BITS, -1, 3).mean(axis=(0, 2, 3))
+    return sum(1 << bit for bit in range(BITS) if stripes[bit] > 127)
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory) -> str:
+    path = str(tmp_path_factory.mktemp("video") / "ntsc.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), FPS, (BITS * STRIPE, 64))
+    for number in range(FRAMES):
+        writer.write(_frame(number))
+    writer.release()
+    return path
+
+
+def _read(reader: DmFfmpegReader) -> list[int]:
+    reader.prepare_and_get_params()
+    try:
+        return [_number(img) for img in reader.data()]
+    finally:
+        reader.close()
+
+
+@pytest.mark.parametrize("stride", [1, 2])
+@pytest.mark.parametrize("shard_size", [7, 20])
+def test_sharded_frames_match_unsharded(video, stride, shard_size):
+    pool = DmFramePool()
+    whole = _read(DmFfmpegReader(video, stride=stride, pool=pool))
+    assert whole == list(range(0, FRAMES, stride))
+
+    reader = DmFfmpegReader(video, stride=stride, pool=pool)
+    shards = reader.split(shard_size)
+    assert shards is not None and len(shards) > 1
+    sharded = [number for shard in shards for number in _read(shard(pool=pool))]
+    assert sharded == whole
+
+
+def test_skip_starts_at_exact_frame(video):
+    reader = DmFfmpegReader(video)
+    reader.prepare_and_get_params()
+    assert reader.skip(61)
+    assert _read(reader) == list(range(61, FRAMES))
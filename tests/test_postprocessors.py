@@ -0,0 +1,108 @@
+import math
+
+import numpy as np
+import pytest
+from numba import njit
+
+from dmconvert.converter import RED, GREEN, BLUE
+from dmconvert.postprocessors import anaglyph, create_anaglyph_processor, create_dm_correcter, \
+    create_ring_dm_correcter
+
+
+@njit
+def _reference_anaglyph(img, dm, max_offset, direction):
+    """
+    Исходная реализация анаглифа (попиксельный цикл), с которой сравнивается ядро
+    """
+    result = np.zeros(img.shape).astype(np.uint8)
+
+    result[:, :, GREEN] = img[:, :, GREEN]
+    result[:, :, BLUE] = img[:, :, BLUE]
+
+    for x in range(dm.shape[0]):
+        for y in range(dm.shape[1]):
+            offset = math.floor((dm[x][y] / 255) * max_offset * direction)
+            for k in range(min(offset + 1, dm.shape[1] - y)):
+                if not result[x, y + k, RED]:
+                    result[x, y + k, RED] = img[x, y, RED]
+
+    return result
+
+
+def _frame(rng: np.random.Generator, height: int = 24, width: int = 40) -> tuple[np.ndarray, np.ndarray]:
+    img = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    # Нулевые пиксели красного канала не заполняют сдвиг
+    img[rng.random((height, width)) < 0.2, RED] = 0
+    dm = rng.integers(0, 256, (height, width), dtype=np.uint8)
+    return img, dm
+
+
+@pytest.mark.parametrize("max_offset", [0, 1, 7, 30])
+@pytest.mark.parametrize("direction", [1, -1])
+def test_anaglyph_kernel_matches_reference(max_offset, direction):
+    img, dm = _frame(np.random.default_rng(max_offset))
+
+    expected = _reference_anaglyph(img, dm, max_offset, direction)
+    assert np.array_equal(anaglyph(img, dm, max_offset, direction), expected)
+
+    result_img, result_dm = create_anaglyph_processor(max_offset, direction)(img, dm)
+    assert np.array_equal(result_img, expected)
+    assert result_dm is dm
+
+
+def test_anaglyph_kernel_accepts_non_contiguous_frames():
+    img, dm = _frame(np.random.default_rng(1), 48, 80)
+    img, dm = img[::2, ::2], dm[::2, ::2]
+
+    assert np.array_equal(anaglyph(img, dm, 10), _reference_anaglyph(img, dm, 10, 1))
+
+
+def _depth_sequence(rng: np.random.Generator, count: int = 40) -> list[np.ndarray]:
+    """
+    Карты глубины со статичными участками (небольшой шум) и сменами содержимого (движение)
+    """
+    dms = []
+    base = rng.integers(0, 256, (24, 32), dtype=np.uint8)
+    for i in range(count):
+        if i % 9 == 5:
+            base = rng.integers(0, 256, (24, 32), dtype=np.uint8)
+        noise = rng.integers(-2, 3, base.shape)
+        dms.append(np.clip(base.astype(int) + noise, 0, 255).astype(np.uint8))
+    return dms
+
+
+@pytest.mark.parametrize("windows_size", [1, 4, 10])
+@pytest.mark.parametrize("return_num", [-1, 0, 2])
+def test_ring_correcter_matches_reference(windows_size, return_num):
+    rng = np.random.default_rng(windows_size)
+    reference = create_dm_correcter(windows_size, 500, return_num)
+    ring = create_ring_dm_correcter(windows_size, 500, return_num)
+
+    for i, dm in enumerate(_depth_sequence(rng)):
+        img = np.full((24, 32, 3), i, np.uint8)
+        expected_img, expected_dm = reference(img, dm)
+        result_img, result_dm = ring(img, dm)
+
+        assert np.array_equal(result_img, expected_img)
+        # Сумма окна накапливается во float32, а не делится по кадрам во float64
+        assert np.abs(result_dm.astype(int) - expected_dm).max() <= 1
+
+
+def test_ring_correcter_reset_matches_reference():
+    rng = np.random.default_rng(3)
+    reference = create_dm_correcter(5, 500)
+    ring = create_ring_dm_correcter(5, 500)
+    img = np.zeros((24, 32, 3), np.uint8)
+
+    for i, dm in enumerate(_depth_sequence(rng, 20)):
+        if i == 12:
+            reference.reset()
+            ring.reset()
+        _, expected_dm = reference(img, dm)
+        _, result_dm = ring(img, dm)
+        assert np.abs(result_dm.astype(int) - expected_dm).max() <= 1
+
+
+def test_ring_correcter_rejects_negative_return_num():
+    with pytest.raises(ValueError):
+        create_ring_dm_correcter(5, 500, -2)
@@ -0,0 +1,82 @@
+import glob
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+# Загрузчик MiDaS импортирует модули подмодуля depthmap
+pytest.importorskip("depthmap.MiDaS.midas.model_loader")
+
+from depthmap_wrappers.midas_torchscript import _ExportedModel, depth_error  # noqa: E402
+
+# Допустимая средняя ошибка экспортированной модели (уровней глубины из 255)
+FP32_TOLERANCE = 0.05
+INT8_TOLERANCE = 3.0
+
+# Размеры входа (пакет, H, W): несколько размеров кадра и пакеты разного размера одного кадра
+SHAPES = [(1, 64, 96), (3, 64, 96), (2, 96, 64), (1, 128, 128)]
+
+
+class _TinyDepthNet(torch.nn.Module):
+    """
+    Небольшая модель со структурой DPT: свертка в признаки, линейные слои над признаками и
+    изменение формы, зависящее от размера входа
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.embed = torch.nn.Conv2d(3, 32, 8, stride=8)
+        self.mlp = torch.nn.Sequential(torch.nn.Linear(32, 64), torch.nn.GELU(), torch.nn.Linear(64, 32))
+        self.head = torch.nn.Conv2d(32, 1, 1)
+
+    def forward(self, x):
+        features = self.embed(x)
+        batch, channels, height, width = features.shape
+        tokens = features.flatten(2).transpose(1, 2)
+        tokens = tokens + self.mlp(tokens)
+        features = tokens.transpose(1, 2).reshape(batch, channels, height, width)
+        depth = torch.nn.functional.interpolate(self.head(features), size=x.shape[-2:], mode="bilinear")
+        return torch.relu(depth).squeeze(1)
+
+
+def _compare(eager: torch.nn.Module, model_path: str, quantize: bool, tolerance: float, shapes=SHAPES):
+    exported = _ExportedModel(eager, model_path, torch.device("cpu"), quantize, max_error=tolerance)
+    torch.manual_seed(0)
+    with torch.no_grad():
+        for shape in shapes:
+            sample = torch.rand(shape[0], 3, *shape[1:])
+            expected, actual = eager(sample), exported(sample)
+            assert actual.shape == expected.shape
+            assert depth_error(expected, actual) <= tolerance, shape
+    return exported
+
+
+@pytest.mark.parametrize("quantize, tolerance", [(False, FP32_TOLERANCE), (True, INT8_TOLERANCE)])
+def test_exported_matches_eager(tmp_path, quantize, tolerance):
+    model_path = str(tmp_path / "tiny.pt")
+    open(model_path, "wb").close()
+    torch.manual_seed(1)
+    _compare(_TinyDepthNet().eval(), model_path, quantize, tolerance)
+
+    # Один файл на размер кадра, независимо от размера пакета
+    suffix = ".int8" if quantize else ""
+    artifacts = sorted(os.path.basename(path) for path in glob.glob(str(tmp_path / "*.torchscript")))
+    assert artifacts == sorted({f"tiny.{h}x{w}{suffix}.torchscript" for _, h, w in SHAPES})
+
+    # Сохраненные файлы загружаются повторно и дают тот же результат
+    torch.manual_seed(1)
+    _compare(_TinyDepthNet().eval(), model_path, quantize, tolerance)
+
+
+MIDAS_MODEL = next(iter(glob.glob(os.path.join(os.path.dirname(os.path.dirname(__file__)), "models",
+                                               "dpt_swin2_tiny_256.pt"))), None)
+
+
+@pytest.mark.skipif(MIDAS_MODEL is None, reason="нет модели dpt_swin2_tiny_256")
+@pytest.mark.parametrize("quantize, tolerance", [(False, FP32_TOLERANCE), (True, INT8_TOLERANCE)])
+def test_exported_midas_matches_eager(tmp_path, quantize, tolerance):
+    from depthmap.MiDaS.midas.model_loader import load_model
+    model_path = str(tmp_path / "dpt_swin2_tiny_256.pt")
+    os.symlink(MIDAS_MODEL, model_path)
+    net = load_model(torch.device("cpu"), MIDAS_MODEL, "dpt_swin2_tiny_256", False, None, False)[0]
+    _compare(net.eval(), model_path, quantize, tolerance, [(1, 256, 256), (2, 256, 256)])
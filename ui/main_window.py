@@ -10,9 +10,13 @@ from PyQt6.QtGui import QImage, QPixmap, QIcon, QAction, QIntValidator
 from PyQt6.QtWidgets import QMainWindow, QLabel, QHBoxLayout, QWidget, QVBoxLayout, QStackedWidget, QSlider, \
     QPushButton, QToolBar, QDialog, QComboBox, QFileDialog, QLineEdit, QMessageBox
 from numpy import typing as npt
+from dmconvert.buffers import retain, release
+from dmconvert.postprocessors import create_depth_range_smoother
 from dmconvert.converter import DmMediaConverter, DmMediaReader, DmMediaWriter, DmMediaSeekableReader, DmMediaParams
-from dmconvert.readers import DmCameraReader, DmVideoReader, DmImagesReader
+from dmconvert.readers import DmCameraReader, DmVideoReader, DmImagesReader, DmLatestFrameReader
 from dmconvert.writers import DmVideoWriter, DmImageWriter, DmCallbackWriter
+from depthmap_wrappers.cached import CachedDmWrapper
+from depthmap_wrappers.interpolated import DmFrameSkipWrapper
 from depthmap_wrappers.models import Models
 from .control_panel import ControlPanelWidget
 from .processors_settings import POSTPROCESSOR_ELEMENTS, PREPROCESSOR_ELEMENTS
@@ -33,6 +37,7 @@ class WorkerThread(QThread):
 
     s_image_ready = QtCore.pyqtSignal(np.ndarray, np.ndarray, int)
     s_log = QtCore.pyqtSignal(str)
+    s_stats = QtCore.pyqtSignal(str)
 
     def run(self):
         if self.converter:
@@ -49,10 +54,14 @@ class WorkerThread(QThread):
         def ready(img, dm):
             pos = 0
             if isinstance(self.converter.reader, DmMediaSeekableReader):
-                pos = self.converter.reader.progress
+                pos = self.converter.reader.position
+            # Кадр показывается в потоке интерфейса после возврата из write, поэтому удерживается до показа
+            retain(img)
+            retain(dm)
             self.s_image_ready.emit(img, dm, pos)
 
         self.converter.writers.append(DmCallbackWriter(ready))
+        self.converter.stats.on_update = lambda stats: self.s_stats.emit(stats.short_summary())
 
     def stop(self):
         self.converter and self.converter.stop()
@@ -65,9 +74,9 @@ class WorkerThread(QThread):
         if self.converter:
             self.converter.preprocessors = new_list
 
-    def seek_video(self, position: int):
-        if isinstance(self.converter.reader, DmMediaSeekableReader):
-            self.converter.reader.seek(position)
+    def seek_video(self, frame: int):
+        if self.converter and isinstance(self.converter.reader, DmMediaSeekableReader):
+            self.converter.reader.seek_frame(frame)
 
 
 class MainWindow(QMainWindow):
@@ -85,6 +94,7 @@ class MainWindow(QMainWindow):
         self.worker = WorkerThread(self)
         self.worker.s_image_ready.connect(self.show_image_slot)
         self.worker.s_log.connect(self.log)
+        self.worker.s_stats.connect(self.statusBar().showMessage)
         self.s_program_will_finish.connect(self.worker.stop)
 
         # Меню
@@ -152,7 +162,14 @@ class MainWindow(QMainWindow):
         dm_h, dm_w = dm.shape
         pix_img = QPixmap.fromImage(QImage(img.data, img_w, img_h, img_w * img_channel, QImage.Format.Format_BGR888))
         pix_dm = QPixmap.fromImage(QImage(dm.data, dm_w, dm_h, dm_w, QImage.Format.Format_Grayscale8))
-        self.seek_widget.setValue(pos)
+        # QPixmap хранит копию изображения
+        release(img)
+        release(dm)
+        # Позиция кадра не должна вызывать переход, а перетаскиваемый ползунок - перемещаться
+        if not self.seek_widget.isSliderDown():
+            self.seek_widget.blockSignals(True)
+            self.seek_widget.setValue(pos)
+            self.seek_widget.blockSignals(False)
         self.picture_img.setPixmap(pix_img)
         self.picture_dm.setPixmap(pix_dm)
         self.loading(False)
@@ -189,7 +206,7 @@ class MainWindow(QMainWindow):
     def set_converter(self, converter: DmMediaConverter):
         reader = converter.reader
         if isinstance(reader, DmMediaSeekableReader):
-            self.seek_widget.setMaximum(reader.duration)
+            self.seek_widget.setMaximum(max(0, reader.frame_count - 1))
         self.worker.set_converter(converter)
 
 
@@ -209,7 +226,9 @@ class SettingsDialog(QDialog):
         main_layout.addWidget(l_model)
         self.cb_model = QComboBox(self)
         self.cb_model.addItems(self.models_mapping.keys())
+        self.cb_model.currentTextChanged.connect(self.warm_up_model)
         main_layout.addWidget(self.cb_model)
+        self.warm_up_model(self.cb_model.currentText())
 
         l_reader = QLabel("Выбор источника", self)
         main_layout.addWidget(l_reader)
@@ -270,6 +289,11 @@ class SettingsDialog(QDialog):
             path = ""
         return path
 
+    def warm_up_model(self, name: str):
+        model = self.models_mapping.get(name)
+        if model is not None:
+            settings.MODEL_LOADER().warm_up(model.value)
+
     def change_reader(self, index: int):
         self.current_reader = list(self.readers_mapping.items())[index][1]
         self.__setup_reader_param_line_edit()
@@ -278,13 +302,28 @@ class SettingsDialog(QDialog):
         try:
             model = self.models_mapping[self.cb_model.currentText()].value
             loader = settings.MODEL_LOADER()
-            converter = DmMediaConverter(model, self.current_reader(self.le_path.text()), loader)
+            if settings.DM_CACHE_DIR:
+                loader = CachedDmWrapper(loader, settings.DM_CACHE_DIR, settings.DM_CACHE_MAX_SIZE_MB)
+            reader = self.current_reader(self.le_path.text())
+            if self.current_reader == DmCameraReader:
+                reader, loader = self.__setup_realtime(reader, loader)
+            converter = DmMediaConverter(model, reader, loader)
+            if settings.DEPTH_EMA:
+                converter.postprocessors.append(create_depth_range_smoother(settings.DEPTH_EMA))
             self.__add_writer_if_need(converter)
             self.s_apply_settings.emit(converter)
             self.close()
         except Exception as e:
             MainWindow.log(str(e))
 
+    @staticmethod
+    def __setup_realtime(reader: DmMediaReader, loader):
+        if settings.REALTIME_LATEST_FRAME:
+            reader = DmLatestFrameReader(reader)
+        if settings.REALTIME_INFER_EVERY > 1 or settings.REALTIME_TARGET_FPS:
+            loader = DmFrameSkipWrapper(loader, settings.REALTIME_INFER_EVERY, settings.REALTIME_TARGET_FPS)
+        return reader, loader
+
     def __setup_reader_param_line_edit(self):
         self.le_path.clear()
         if self.current_reader == DmCameraReader:
@@ -1,12 +1,20 @@
 import cv2
 
-from dmconvert.postprocessors import create_anaglyph_processor, create_dm_correcter
+from dmconvert.postprocessors import create_anaglyph_processor, create_ring_dm_correcter, create_dm_blur_processor, \
+    create_depth_range_smoother
 from .parameters import ControlElement, ControlProperty
 
 POSTPROCESSOR_ELEMENTS = [
+    ControlElement(
+        name="Сглаживание диапазона глубины",
+        builder=lambda ema: create_depth_range_smoother(ema / 100),
+        properties=[
+            ControlProperty(name="ema", caption="Сила (%)", min_value=0, max_value=99)
+        ]
+    ),
     ControlElement(
         name="DM Corrector",
-        builder=create_dm_correcter,
+        builder=create_ring_dm_correcter,
         properties=[
             ControlProperty(name="windows_size", caption="Окно (кадров)", min_value=1, max_value=50),
             ControlProperty(name="move_factor", caption="Порог движения", min_value=50, max_value=1500)
@@ -21,7 +29,7 @@ POSTPROCESSOR_ELEMENTS = [
     ),
     ControlElement(
         name="Размытие карты глубины",
-        builder=lambda factor: lambda img, dm: (img, cv2.blur(dm, (factor, factor))),
+        builder=create_dm_blur_processor,
         properties=[
             ControlProperty(name="factor", caption="Сила", min_value=1, max_value=50)
         ]